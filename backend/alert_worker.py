@@ -0,0 +1,119 @@
+"""
+Delivers queued budget alerts (the budget_alerts outbox).
+
+Expense writes only insert outbox rows. This worker polls for undelivered
+ones, hands each to a notifier and marks it delivered. Failed deliveries
+are retried on later polls, up to MAX_ATTEMPTS. On Postgres, pending rows
+are claimed with SKIP LOCKED, so several workers can run side by side.
+
+    python alert_worker.py              # poll every ALERT_POLL_SECONDS
+    python alert_worker.py --once       # deliver what is pending and exit
+
+ALERT_WEBHOOK_URL posts each alert as JSON; without it alerts are logged.
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+import urllib.request
+from datetime import datetime
+
+from sqlalchemy import select
+
+import models
+import money
+
+ALERT_POLL_SECONDS = float(os.getenv("ALERT_POLL_SECONDS", "5"))
+ALERT_WEBHOOK_URL = os.getenv("ALERT_WEBHOOK_URL")
+MAX_ATTEMPTS = int(os.getenv("ALERT_MAX_ATTEMPTS", "5"))
+BATCH_SIZE = 100
+
+logger = logging.getLogger("expense_tracker.alerts")
+
+
+def alert_payload(alert: models.BudgetAlert) -> dict:
+    return {
+        "id": alert.id,
+        "user_id": alert.user_id,
+        "month": f"{alert.year:04d}-{alert.month:02d}",
+        "category": alert.category,
+        "threshold": alert.threshold,
+        "spent": money.to_float(alert.spent_cents),
+        "limit": money.to_float(alert.limit_cents),
+    }
+
+
+def log_notifier(payload: dict):
+    logger.warning(
+        "user %s spent %.2f of %.2f (%s%%) on %s in %s",
+        payload["user_id"], payload["spent"], payload["limit"],
+        payload["threshold"], payload["category"], payload["month"],
+    )
+
+
+def webhook_notifier(payload: dict, url: str = ALERT_WEBHOOK_URL, timeout: float = 10):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=timeout):
+        pass
+
+
+def default_notifier():
+    return webhook_notifier if ALERT_WEBHOOK_URL else log_notifier
+
+
+def deliver_pending(db, notify=None, batch_size: int = BATCH_SIZE) -> int:
+    """Deliver one batch of pending alerts; returns how many were delivered."""
+    notify = notify or default_notifier()
+    alert = models.BudgetAlert
+    pending = db.scalars(
+        select(alert)
+        .where(alert.delivered_at.is_(None), alert.attempts < MAX_ATTEMPTS)
+        .order_by(alert.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).all()
+
+    delivered = 0
+    for row in pending:
+        try:
+            notify(alert_payload(row))
+        except Exception:
+            row.attempts += 1
+            logger.exception("delivering budget alert %s failed (attempt %s)", row.id, row.attempts)
+            continue
+        row.delivered_at = datetime.utcnow()
+        delivered += 1
+    db.commit()
+    return delivered
+
+
+def run(poll_seconds: float = ALERT_POLL_SECONDS, once: bool = False):
+    from database import SessionLocal
+
+    while True:
+        with SessionLocal() as db:
+            while deliver_pending(db) == BATCH_SIZE:
+                pass
+        if once:
+            return
+        time.sleep(poll_seconds)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="deliver pending alerts and exit")
+    parser.add_argument("--interval", type=float, default=ALERT_POLL_SECONDS, help="seconds between polls")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    run(args.interval, args.once)
+
+
+if __name__ == "__main__":
+    main()
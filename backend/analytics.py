@@ -0,0 +1,344 @@
+"""
+Spending insights computed with NumPy.
+
+A user's live expenses are read through one projected query into
+columnar arrays: id, day, category code and amount in cents. Everything
+else is array arithmetic on those columns, with no Python loop over
+expenses:
+
+    months       monthly totals and month-over-month growth (bincount)
+    rolling      daily totals with 7 and 30 day rolling averages (cumsum)
+    seasonality  per category, each calendar month's average spend
+                 relative to that category's overall monthly average
+    forecast     next month from a linear trend over the last complete
+                 months, and this month projected from its run rate
+    outliers     expenses whose amount is more than `z` standard
+                 deviations from their category's mean
+
+The route caches each response per user data_version (httpcache.Validator).
+The arrays themselves are kept per user (ANALYTICS_CACHE_USERS) and, like
+search.UserIndex, brought up to date by reading only the rows whose
+change_seq moved since the last refresh. So a write costs one small query
+plus the array arithmetic, not a reload of the whole history. Months moved
+to Parquet by archive.py are read into the arrays on the first load.
+
+    python benchmarks/bench_insights.py   # cold and cached timings
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import String, cast, select
+
+import archive
+import models
+
+ANALYTICS_CACHE_USERS = int(os.getenv("ANALYTICS_CACHE_USERS", "20"))
+ROLLING_WINDOWS = (7, 30)
+FORECAST_MONTHS = 12
+MIN_FORECAST_MONTHS = 3
+OUTLIER_MIN_SAMPLES = 5
+
+
+class History:
+    """One user's live expenses as parallel arrays."""
+
+    __slots__ = ("ids", "days", "codes", "categories", "cents")
+
+    def __init__(self, ids, days, codes, categories, cents):
+        self.ids = ids                # int64
+        self.days = days              # datetime64[D]
+        self.codes = codes            # int64 index into `categories`
+        self.categories = categories  # category names, in first-seen order
+        self.cents = cents            # int64
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _empty_history() -> History:
+    empty = np.array([], dtype=np.int64)
+    return History(empty, empty.astype("datetime64[D]"), empty, np.array([], dtype=object), empty)
+
+
+class UserHistory:
+    """One user's History, kept current from the change feed."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.seen_seq = -1
+        self.category_codes = {}
+        self.history = _empty_history()
+
+    def _codes(self, categories, count: int):
+        return np.fromiter(
+            (self.category_codes.setdefault(name, len(self.category_codes)) for name in categories),
+            dtype=np.int64,
+            count=count,
+        )
+
+    def _load_archived(self, db, user_id: int):
+        table = archive.read_table(db, user_id, ["id", "date", "category", "amount_cents"])
+        if table is None:
+            return
+        codes = self._codes(table.column("category").to_pylist(), table.num_rows)
+        self.history = History(
+            table.column("id").to_numpy(),
+            table.column("date").to_numpy().astype("datetime64[D]"),
+            codes,
+            np.array(list(self.category_codes), dtype=object),
+            table.column("amount_cents").to_numpy(),
+        )
+
+    def refresh(self, db, user_id: int) -> History:
+        """Apply every change since the last refresh (a full read the first time)."""
+        expense = models.Expense
+        purged_seq = (
+            db.query(models.User.purged_seq).filter(models.User.id == user_id).scalar() or 0
+        )
+        if purged_seq > self.seen_seq >= 0:
+            # tombstones we never saw are gone; start over
+            self._reset()
+        if self.seen_seq < 0 and not len(self.history):
+            self._load_archived(db, user_id)
+
+        rows = db.execute(
+            select(
+                expense.id,
+                # ISO text: NumPy parses the whole column at once
+                cast(expense.date, String),
+                expense.category,
+                expense.amount_cents,
+                expense.deleted_at.is_(None),
+                expense.change_seq,
+            ).where(expense.user_id == user_id, expense.change_seq > self.seen_seq)
+        ).all()
+        if not rows:
+            return self.history
+
+        ids, days, categories, cents, live, seqs = zip(*rows)
+        ids = np.array(ids, dtype=np.int64)
+        live = np.array(live, dtype=bool)
+        codes = self._codes(categories, len(rows))
+
+        old = self.history
+        keep = ~np.isin(old.ids, ids)
+        self.history = History(
+            np.concatenate((old.ids[keep], ids[live])),
+            np.concatenate((old.days[keep], np.array(days, dtype="datetime64[D]")[live])),
+            np.concatenate((old.codes[keep], codes[live])),
+            np.array(list(self.category_codes), dtype=object),
+            np.concatenate((old.cents[keep], np.array(cents, dtype=np.int64)[live])),
+        )
+        self.seen_seq = max(self.seen_seq, max(seqs))
+        return self.history
+
+
+_histories = OrderedDict()
+_histories_lock = threading.Lock()
+
+
+def _user_history(user_id: int) -> UserHistory:
+    with _histories_lock:
+        history = _histories.get(user_id)
+        if history is None:
+            history = _histories[user_id] = UserHistory()
+        _histories.move_to_end(user_id)
+        while len(_histories) > ANALYTICS_CACHE_USERS:
+            _histories.popitem(last=False)
+        return history
+
+
+def clear():
+    with _histories_lock:
+        _histories.clear()
+
+
+def load_history(db, user_id: int) -> History:
+    user_history = _user_history(user_id)
+    with user_history.lock:
+        return user_history.refresh(db, user_id)
+
+
+def _amount(cents) -> float:
+    return round(float(cents) / 100, 2)
+
+
+# ------------------------
+# Series
+# ------------------------
+
+def monthly_matrix(history: History, first_month, last_month):
+    """(category x month) totals in cents for every month from first to last."""
+    months = np.arange(first_month, last_month + 1)
+    index = (history.days.astype("datetime64[M]") - first_month).astype(np.int64)
+    matrix = np.bincount(
+        history.codes * len(months) + index,
+        weights=history.cents,
+        minlength=len(history.categories) * len(months),
+    ).reshape(len(history.categories), len(months))
+    return months, matrix
+
+
+def month_series(months, totals, count: int) -> list:
+    growth = np.full(len(totals), np.nan)
+    previous = totals[:-1]
+    np.divide(totals[1:] - previous, previous, out=growth[1:], where=previous != 0)
+    start = max(0, len(months) - count)
+    return [
+        {
+            "month": str(months[i]),
+            "total": _amount(totals[i]),
+            "growth_pct": None if np.isnan(growth[i]) else round(float(growth[i] * 100), 2),
+        }
+        for i in range(start, len(months))
+    ]
+
+
+def rolling_series(history: History, end_day, count: int) -> list:
+    """Daily totals and rolling means for the `count` days ending at `end_day`."""
+    longest = max(ROLLING_WINDOWS)
+    first_day = end_day - (count + longest - 1)
+    index = (history.days - first_day).astype(np.int64)
+    keep = (index >= 0) & (index < count + longest)
+    daily = np.bincount(index[keep], weights=history.cents[keep], minlength=count + longest)
+
+    cumulative = np.concatenate(([0.0], np.cumsum(daily)))
+    shown = np.arange(longest, count + longest)
+    means = {
+        window: (cumulative[shown + 1] - cumulative[shown + 1 - window]) / window
+        for window in ROLLING_WINDOWS
+    }
+    return [
+        {
+            "date": str(first_day + day),
+            "total": _amount(daily[day]),
+            **{f"avg_{window}d": _amount(means[window][i]) for window in ROLLING_WINDOWS},
+        }
+        for i, day in enumerate(shown)
+    ]
+
+
+def seasonality(categories, months, matrix) -> list:
+    """
+    Per category and calendar month: the average spend in that calendar
+    month over the category's overall monthly average (1.0 = typical).
+    None where the calendar month was never observed. Categories without
+    spending in the range are left out.
+    """
+    calendar = months.astype(np.int64) % 12
+    observed = np.bincount(calendar, minlength=12)
+    sums = np.zeros((len(categories), 12))
+    np.add.at(sums.T, calendar, matrix.T)
+
+    by_month = np.divide(sums, observed, out=np.full_like(sums, np.nan), where=observed > 0)
+    overall = matrix.mean(axis=1, keepdims=True) if len(months) else np.zeros((len(categories), 1))
+    index = np.divide(by_month, overall, out=np.full_like(sums, np.nan), where=overall > 0)
+
+    return [
+        {
+            "category": str(categories[code]),
+            "index": [None if np.isnan(value) else round(float(value), 3) for value in index[code]],
+        }
+        for code in np.argsort(categories.astype(str), kind="stable")
+        if matrix[code].any()
+    ]
+
+
+def forecast(months, totals, today: date, current_month) -> dict:
+    current = int((current_month - months[0]).astype(np.int64))
+    recent = totals[:current][-FORECAST_MONTHS:]
+
+    next_month = None
+    if len(recent) >= MIN_FORECAST_MONTHS:
+        slope, intercept = np.polyfit(np.arange(len(recent)), recent, 1)
+        next_month = _amount(max(0.0, intercept + slope * len(recent)))
+
+    month_to_date = totals[current] if 0 <= current < len(totals) else 0
+    month_days = (current_month + 1).astype("datetime64[D]") - current_month.astype("datetime64[D]")
+    days_in_month = int(month_days.astype(np.int64))
+    return {
+        "next_month": next_month,
+        "based_on_months": int(len(recent)),
+        "current_month_to_date": _amount(month_to_date),
+        "current_month_projection": _amount(month_to_date / today.day * days_in_month),
+    }
+
+
+def outliers(db, history: History, threshold: float, limit: int) -> list:
+    """Expenses more than `threshold` standard deviations from their category mean."""
+    if not len(history):
+        return []
+    amounts = history.cents.astype(np.float64)
+    counts = np.bincount(history.codes, minlength=len(history.categories))
+    means = np.bincount(history.codes, weights=amounts) / counts
+    deviations = amounts - means[history.codes]
+    stds = np.sqrt(np.bincount(history.codes, weights=deviations * deviations) / counts)
+
+    usable = (counts >= OUTLIER_MIN_SAMPLES) & (stds > 0)
+    scores = np.zeros(len(history))
+    rows = usable[history.codes]
+    scores[rows] = deviations[rows] / stds[history.codes[rows]]
+
+    flagged = np.flatnonzero(np.abs(scores) > threshold)
+    if len(flagged) > limit:
+        flagged = flagged[np.argpartition(-np.abs(scores[flagged]), limit - 1)[:limit]]
+    flagged = flagged[np.argsort(-np.abs(scores[flagged]), kind="stable")]
+    if not len(flagged):
+        return []
+
+    titles = dict(
+        db.execute(
+            select(models.Expense.id, models.Expense.title)
+            .where(models.Expense.id.in_(history.ids[flagged].tolist()))
+        ).all()
+    )
+    return [
+        {
+            "id": int(history.ids[i]),
+            "title": titles.get(int(history.ids[i])),
+            "date": str(history.days[i]),
+            "amount": _amount(history.cents[i]),
+            "category": str(history.categories[history.codes[i]]),
+            "z_score": round(float(scores[i]), 2),
+            "category_mean": _amount(means[history.codes[i]]),
+        }
+        for i in flagged
+    ]
+
+
+# ------------------------
+# Entry point
+# ------------------------
+
+def insights(db, user_id: int, months: int = 12, days: int = 30, z: float = 3.0,
+             max_outliers: int = 20, today: Optional[date] = None) -> dict:
+    today = today or date.today()
+    history = load_history(db, user_id)
+    end_day = np.datetime64(today, "D")
+    current_month = end_day.astype("datetime64[M]")
+
+    if len(history):
+        first_month = history.days.min().astype("datetime64[M]")
+        last_month = max(history.days.max().astype("datetime64[M]"), current_month)
+    else:
+        first_month = last_month = current_month
+    month_axis, matrix = monthly_matrix(history, first_month, last_month)
+    totals = matrix.sum(axis=0)
+
+    return {
+        "expenses": len(history),
+        "total": _amount(history.cents.sum()),
+        "months": month_series(month_axis, totals, months),
+        "rolling": rolling_series(history, end_day, days),
+        "seasonality": seasonality(history.categories, month_axis, matrix),
+        "forecast": forecast(month_axis, totals, today, current_month),
+        "outliers": outliers(db, history, z, max_outliers),
+    }
@@ -1,63 +1,152 @@
-import token
-from urllib import response
-from fastapi import FastAPI, Depends, HTTPException, Response, Body
-from sqlalchemy.orm import Session
-from sqlalchemy import extract, func
+"""
+The API. `create_app()` builds the FastAPI application; `app` is the one
+uvicorn serves (uvicorn app:app).
+
+Importing this module does no database work. The engine is created on
+first use (database.py), and schema changes are an explicit step run
+before the server starts (python migrations.py; see the Dockerfile), or
+at startup with DB_MIGRATE_ON_STARTUP=1 in development. After startup
+the pool is warmed in the background. /healthz (liveness) never touches
+the database. /readyz reports the database, the schema and the warm-up.
+
+    python benchmarks/bench_startup.py   # import and first-response times
+"""
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import Optional
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Request, Response, Body, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from models import User, Expense
-from database import engine, get_db
-import models, schemas
-from auth import hash_password, verify_password, create_access_token
-from dependencies import get_admin_user, get_current_user
-import os
+from database import dispose_engines, get_db, pool_stats, pool_warmup, run_db, stream_db
+import models, schemas, listing, migrations, summaries, bulk, exports, crud, httpcache, serialization, search, ledger
+import refresh_tokens, budgets, analytics, jobs, money
+import instrumentation, ratelimit, singleflight
+from auth import hash_password_async, verify_password_async, create_access_token, principal_claims
+from dependencies import get_admin_user, get_current_user, request_date, validate_user_data, validate_user_data_daily
+from principals import Principal
 
 
-models.Base.metadata.create_all(bind=engine)
 IS_PRODUCTION = os.getenv("ENV") == "production"
+DB_MIGRATE_ON_STARTUP = os.getenv("DB_MIGRATE_ON_STARTUP", "false").strip().lower() in ("1", "true", "yes", "on")
 
-app = FastAPI(title="Expense Tracker API")
-
-# ------------------------
-# CORS (REQUIRED FOR COOKIES)
-# ------------------------
-from fastapi.middleware.cors import CORSMiddleware
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "http://localhost:3000",          # local dev
-        "https://expense-tracker-inky-delta-53.vercel.app"  # 🔴 VERCEL URL
-    ],
-    allow_credentials=True,  # 🔴 REQUIRED for cookies
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+CORS_ORIGINS = [
+    "http://localhost:3000",          # local dev
+    "https://expense-tracker-inky-delta-53.vercel.app"  # 🔴 VERCEL URL
+]
 
-# ------------------------
-# Create tables
-# ------------------------
-models.Base.metadata.create_all(bind=engine)
+# endpoint functions are timed separately from dependencies and serialization
+router = APIRouter(route_class=instrumentation.TimedRoute)
 
 # ------------------------
 # Root
 # ------------------------
-@app.get("/")
+@router.get("/")
 def root():
     return {"message": "Expense Tracker API running 🚀"}
 
+
+@router.get("/healthz", include_in_schema=False)
+def healthz():
+    """Liveness: the process serves requests. No database access."""
+    return {"status": "ok"}
+
+
+@router.get("/readyz", include_in_schema=False)
+async def readyz(db: Session = Depends(get_db)):
+    """
+    Readiness: the database answers, no migration is pending and the pool
+    warm-up is not still in progress. 503 with the details otherwise.
+    """
+    status = {"pool": pool_warmup.snapshot()}
+    try:
+        status["pending_migrations"] = await run_db(db, migrations.pending)
+        status["database"] = "ok"
+    except SQLAlchemyError as exc:
+        status["database"] = f"unavailable: {exc.__class__.__name__}"
+    ready = (
+        status["database"] == "ok"
+        and not status.get("pending_migrations")
+        and status["pool"]["state"] != "warming"
+    )
+    return JSONResponse(
+        {"status": "ready" if ready else "not ready", **status},
+        status_code=200 if ready else 503,
+    )
+
+
+@router.get("/metrics", include_in_schema=False)
+def metrics(request: Request):
+    """Prometheus text exposition of request, DB and pool metrics."""
+    token = instrumentation.METRICS_TOKEN
+    if token and request.headers.get("authorization") != f"Bearer {token}":
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    gauges = {
+        **instrumentation.pool_gauges(pool_stats()),
+        "rate_limited_requests_total": ratelimit.rejected,
+        "coalesced_requests_total": singleflight.coalesced,
+    }
+    body = instrumentation.registry.render(gauges)
+    return Response(body, media_type="text/plain; version=0.0.4")
+
 # =========================================================
 # AUTH ROUTES
 # =========================================================
 
-@app.post("/auth/register")
-def register(
+def _find_user(db: Session, username: str):
+    return db.query(models.User).filter(
+        models.User.username == username
+    ).first()
+
+
+def _add_user(db: Session, username: str, password_hash: str):
+    db.add(models.User(username=username, password=password_hash))
+    db.commit()
+
+
+# the refresh token is only ever sent to the auth routes
+REFRESH_COOKIE_PATH = "/auth"
+
+
+def _set_auth_cookies(response: Response, principal: Principal, refresh_token: str):
+    token = create_access_token(principal_claims(
+        principal.id, principal.username, principal.is_admin, principal.token_version
+    ))
+    cookie = {
+        "httponly": True,
+        "secure": IS_PRODUCTION,  # 🔴 HTTPS only in prod
+        "samesite": "none" if IS_PRODUCTION else "lax",
+    }
+    response.set_cookie(key="access_token", value=token, **cookie)
+    response.set_cookie(
+        key="refresh_token",
+        value=refresh_token,
+        max_age=refresh_tokens.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 3600,
+        path=REFRESH_COOKIE_PATH,
+        **cookie,
+    )
+
+
+def _clear_auth_cookies(response: Response):
+    response.delete_cookie("access_token")
+    response.delete_cookie("refresh_token", path=REFRESH_COOKIE_PATH)
+
+
+@router.post("/auth/register")
+async def register(
+    response: Response,
     user: schemas.UserCreate = Body(...),
     db: Session = Depends(get_db)
 ):
+    # DB work goes through run_db, bcrypt through its own bounded pool
     username = user.username.strip().lower()
-    existing = db.query(models.User).filter(
-        models.User.username == username
-    ).first()
+    existing = await run_db(db, _find_user, username)
 
     if existing:
         raise HTTPException(
@@ -65,185 +154,530 @@ def register(
             detail="Username already exists"
         )
 
-    new_user = models.User(
-        username=username,
-        password=hash_password(user.password)
-    )
-
-    db.add(new_user)
-    db.commit()
+    password_hash, timing = await hash_password_async(user.password)
+    await run_db(db, _add_user, username, password_hash)
 
+    response.headers["Server-Timing"] = timing.server_timing()
     return {"message": "User registered successfully"}
 
 
-@app.post("/auth/login")
-def login(
+@router.post("/auth/login")
+async def login(
     user: schemas.UserCreate,
     response: Response,
     db: Session = Depends(get_db)
 ):
     username = user.username.strip().lower()
 
-    db_user = db.query(models.User).filter(
-        models.User.username == username
-    ).first()
-
-    if not db_user or not verify_password(user.password, db_user.password):
+    db_user = await run_db(db, _find_user, username)
+    if not db_user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    token = create_access_token({"sub": str(db_user.id)})
+    valid, timing = await verify_password_async(user.password, db_user.password)
+    response.headers["Server-Timing"] = timing.server_timing()
+    if not valid:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid credentials",
+            headers={"Server-Timing": timing.server_timing()},
+        )
 
-    response.set_cookie(
-        key="access_token",
-        value=token,
-        httponly=True,
-        secure=IS_PRODUCTION,  # 🔴 HTTPS only in prod
-        samesite="none" if IS_PRODUCTION else "lax",
-    )
+    principal = Principal(db_user.id, db_user.username, db_user.is_admin, db_user.token_version)
+    refresh_token = await run_db(db, refresh_tokens.login, principal.id, principal.token_version)
+    _set_auth_cookies(response, principal, refresh_token)
     return {"message": "Login successful"}
 
+
+@router.post("/auth/refresh")
+async def refresh(
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db)
+):
+    """
+    Rotate the refresh token cookie and issue a new access token.
+    No password check, so no bcrypt: clients call this when a request
+    gets a 401 instead of sending the user back to the login form.
+    409 when a concurrent request has just rotated the same token: the
+    cookies it set are current, so the client only has to retry.
+    """
+    raw = request.cookies.get("refresh_token")
+    if not raw:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    try:
+        principal, refresh_token = await run_db(db, refresh_tokens.rotate, raw)
+    except refresh_tokens.RefreshRaced:
+        # another tab rotated it just now and set the new cookies; keep them
+        return JSONResponse({"detail": "Token already refreshed"}, status_code=409)
+    except refresh_tokens.InvalidRefreshToken:
+        expired = JSONResponse({"detail": "Session expired"}, status_code=401)
+        _clear_auth_cookies(expired)
+        return expired
+
+    _set_auth_cookies(response, principal, refresh_token)
+    return {"message": "Token refreshed"}
+
 # =========================================================
 # EXPENSE ROUTES (ALL PROTECTED)
 # =========================================================
 
-@app.post("/expenses", response_model=schemas.ExpenseResponse)
-def create_expense(
+@router.post("/expenses", response_model=schemas.ExpenseResponse)
+async def create_expense(
     expense: schemas.ExpenseCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-):
-    new_expense = models.Expense(
-        title=expense.title,
-        amount=expense.amount,
-        category=expense.category,
-        date=expense.date,
-        user_id=current_user.id
-    )
+    current_user: Principal = Depends(get_current_user)
+):
+    return await run_db(db, crud.create_expense, current_user.id, expense)
 
-    db.add(new_expense)
-    db.commit()
-    db.refresh(new_expense)
-    return new_expense
+
+def _accepted(job: dict) -> JSONResponse:
+    return JSONResponse(job, status_code=202, headers={"Location": job["url"]})
 
 
-@app.get("/expenses", response_model=list[schemas.ExpenseResponse])
-def get_expenses(
+@router.post("/expenses/bulk", response_model=schemas.BulkImportResult)
+async def bulk_import_expenses(
+    request: Request,
+    background: bool = Query(False),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
-    return (
-        db.query(models.Expense)
-        .filter(models.Expense.user_id == current_user.id)
-        .all()
+    """
+    Import many expenses at once from a JSON array, NDJSON or CSV body.
+    Rows with an `external_id` seen before for this user update that
+    expense, so re-running an import is safe.
+
+    With ?background=true, or a body over JOBS_BULK_INLINE_MAX_BYTES, the
+    body is saved and imported by a job: 202 with the job to poll, whose
+    result is this route's usual response.
+    """
+    content_type = request.headers.get("content-type", "")
+    size = int(request.headers.get("content-length") or 0)
+    if not background and size <= jobs.BULK_INLINE_MAX_BYTES:
+        return await bulk.import_stream(request, db, current_user.id)
+
+    bulk.parser_for(content_type)  # 415 now rather than in the job
+    body = await jobs.spool_body(request.stream())
+    job = await run_db(
+        db, jobs.enqueue, current_user.id, "bulk_import",
+        {"content_type": content_type, "body": body},
     )
+    return _accepted(job)
 
 
-@app.put("/expenses/{expense_id}", response_model=schemas.ExpenseResponse)
-def update_expense(
-    expense_id: int,
-    expense: schemas.ExpenseCreate,
+@router.get("/expenses", response_model=list[schemas.ExpenseResponse])
+async def get_expenses(
+    response: Response,
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    category: Optional[str] = None,
+    min_amount: Optional[float] = Query(None, allow_inf_nan=False, ge=-money.MAX_AMOUNT, le=money.MAX_AMOUNT),
+    max_amount: Optional[float] = Query(None, allow_inf_nan=False, ge=-money.MAX_AMOUNT, le=money.MAX_AMOUNT),
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=listing.MAX_PAGE_SIZE),
+    output: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user),
+    validator: httpcache.Validator = Depends(validate_user_data)
 ):
-    db_expense = (
-        db.query(models.Expense)
-        .filter(
-            models.Expense.id == expense_id,
-            models.Expense.user_id == current_user.id
+    """
+    Newest first, ordered by (date, id).
+    Without `limit` and `cursor` the whole list is returned as before.
+    With `limit`, the cursor for the next page is sent in `X-Next-Cursor`.
+    `format=ndjson` streams one expense per line from a server-side cursor.
+    Sends an ETag; If-None-Match is answered with 304 until the next write.
+    With FAST_JSON=1 rows skip response-model validation (see serialization).
+    """
+    if cursor and limit is None:
+        limit = listing.DEFAULT_PAGE_SIZE
+    criteria = listing.expense_filters(date_from, date_to, category, min_amount, max_amount)
+
+    if output == "ndjson":
+        return StreamingResponse(
+            stream_db(db, crud.stream_expenses, current_user.id, criteria, cursor, limit),
+            media_type="application/x-ndjson",
         )
-        .first()
-    )
 
-    if not db_expense:
-        raise HTTPException(status_code=404, detail="Expense not found")
+    rows, next_cursor = await run_db(
+        db, crud.list_expenses, current_user.id, criteria, cursor, limit
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if serialization.FAST_JSON:
+        return serialization.rows_response(rows, response)
+    return rows
 
-    db_expense.title = expense.title
-    db_expense.amount = expense.amount
-    db_expense.category = expense.category
-    db_expense.date = expense.date
 
-    db.commit()
-    db.refresh(db_expense)
-    return db_expense
+@router.get("/expenses/search", response_model=list[schemas.ExpenseSearchResult])
+async def search_expenses(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+    validator: httpcache.Validator = Depends(validate_user_data)
+):
+    """
+    Search titles and categories, best matches first. Whole words, prefixes
+    and near misses ("cofee") all match. The next page's cursor is sent in
+    `X-Next-Cursor`.
+    """
+    results, next_cursor = await run_db(
+        db, search.search_expenses, current_user.id, q, cursor, limit
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return results
 
 
-@app.delete("/expenses/{expense_id}")
-def delete_expense(
-    expense_id: int,
+@router.get("/expenses/changes", response_model=schemas.ExpenseChanges)
+async def expense_changes(
+    response: Response,
+    since: Optional[str] = None,
+    limit: int = Query(listing.MAX_PAGE_SIZE, ge=1, le=listing.MAX_PAGE_SIZE),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user),
+    validator: httpcache.Validator = Depends(validate_user_data)
 ):
-    db_expense = (
-        db.query(models.Expense)
-        .filter(
-            models.Expense.id == expense_id,
-            models.Expense.user_id == current_user.id
+    """
+    Incremental sync. Without `since` every live expense is returned; after
+    that, pass the last `next_token` to receive only the expenses created or
+    updated (`upserted`) and the ids deleted since then. Page while
+    `has_more` is true. 410 means the token is older than the tombstone
+    retention window and the client must start over without `since`.
+    """
+    try:
+        changes = await run_db(db, crud.list_changes, current_user.id, since, limit)
+    except crud.SyncTokenExpired:
+        raise HTTPException(
+            status_code=410,
+            detail="Sync token expired, resync without 'since'",
         )
-        .first()
+    if serialization.FAST_JSON:
+        return serialization.fast_response(changes, response)
+    return changes
+
+
+@router.get("/expenses/export")
+async def export_expenses(
+    output: str = Query("xlsx", alias="format", pattern="^(csv|xlsx)$"),
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    Download the user's expenses as CSV, or as an XLSX report with
+    "Expenses" and "Summary" sheets, streamed with flat memory use.
+    """
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    filename = f"Expense_Report.{output}"
+
+    return StreamingResponse(
+        stream_db(db, exports.iter_export, output, current_user.id, date_from, date_to),
+        media_type=exports.MEDIA_TYPES[output],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
 
+
+@router.post("/expenses/export", status_code=202)
+async def export_expenses_job(
+    output: str = Query("xlsx", alias="format", pattern="^(csv|xlsx)$"),
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """Build the same export as a background job; download it from /jobs/{id}/result."""
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    job = await run_db(db, jobs.enqueue, current_user.id, "export", {
+        "format": output,
+        "date_from": date_from.isoformat() if date_from else None,
+        "date_to": date_to.isoformat() if date_to else None,
+    })
+    return _accepted(job)
+
+
+@router.put("/expenses/{expense_id}", response_model=schemas.ExpenseResponse)
+async def update_expense(
+    expense_id: int,
+    expense: schemas.ExpenseCreate,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    db_expense = await run_db(db, crud.update_expense, current_user.id, expense_id, expense)
+
     if not db_expense:
         raise HTTPException(status_code=404, detail="Expense not found")
+    return db_expense
 
-    db.delete(db_expense)
-    db.commit()
+
+@router.delete("/expenses/{expense_id}")
+async def delete_expense(
+    expense_id: int,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    deleted = await run_db(db, crud.delete_expense, current_user.id, expense_id)
+
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Expense not found")
     return {"message": "Expense deleted successfully"}
 
 # =========================================================
 # SUMMARY ROUTES (USER-SCOPED)
 # =========================================================
 
-@app.get("/expenses/summary/monthly")
-def monthly_summary(
-    month: int,
-    year: int,
+@router.get("/expenses/summary/monthly")
+async def monthly_summary(
+    month: int = Query(..., ge=1, le=12),
+    year: int = Query(..., ge=1, le=9999),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+    validator: httpcache.Validator = Depends(validate_user_data)
+):
+    async def compute():
+        total = await run_db(db, summaries.monthly_total, current_user.id, year, month)
+        return {"month": month, "year": year, "total": total or 0}
+
+    return await validator.cached(compute)
+
+
+@router.get("/expenses/summary/category")
+async def category_summary(
+    month: int = Query(..., ge=1, le=12),
+    year: int = Query(..., ge=1, le=9999),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-):
-    total = (
-        db.query(func.sum(models.Expense.amount))
-        .filter(
-            extract("month", models.Expense.date) == month,
-            extract("year", models.Expense.date) == year,
-            models.Expense.user_id == current_user.id
+    current_user: Principal = Depends(get_current_user),
+    validator: httpcache.Validator = Depends(validate_user_data)
+):
+    async def compute():
+        data = await run_db(db, summaries.category_totals, current_user.id, year, month)
+        return [{"category": c, "total": t} for c, t in data]
+
+    return await validator.cached(compute)
+
+
+@router.get("/expenses/summary/range")
+async def range_summary(
+    start: str,
+    end: str,
+    granularity: str = Query("month", pattern="^(day|week|month|year)$"),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+    validator: httpcache.Validator = Depends(validate_user_data)
+):
+    """
+    Totals, counts, category breakdowns and period-over-period deltas for
+    every period from month `start` to month `end` (both YYYY-MM, inclusive).
+    """
+    start_year, start_month = summaries.parse_month(start)
+    end_year, end_month = summaries.parse_month(end)
+    if (start_year, start_month) > (end_year, end_month):
+        raise HTTPException(status_code=400, detail="'start' must not be after 'end'")
+
+    async def compute():
+        data = await run_db(
+            db,
+            summaries.range_summary,
+            current_user.id,
+            date(start_year, start_month, 1),
+            date(end_year, end_month, 1),
+            granularity,
         )
-        .scalar()
-    )
+        return {"start": start, "end": end, **data}
+
+    return await validator.cached(compute)
+
 
-    return {"month": month, "year": year, "total": total or 0}
+@router.get("/expenses/summary/spent")
+async def spent_summary(
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+    validator: httpcache.Validator = Depends(validate_user_data)
+):
+    """
+    Total and count of expenses dated `from` to `to` (inclusive, each
+    optional), read from the ledger's running totals: at most two index
+    lookups, however many expenses the user has.
+    """
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+
+    async def compute():
+        data = await run_db(db, ledger.spent, current_user.id, date_from, date_to)
+        return {
+            "from": date_from.isoformat() if date_from else None,
+            "to": date_to.isoformat() if date_to else None,
+            **data,
+        }
+
+    return await validator.cached(compute)
+
+
+@router.post("/expenses/summary/rebuild", status_code=202)
+async def rebuild_summaries(
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """Recompute the user's rollups and ledger from their full history, as a job."""
+    job = await run_db(db, jobs.enqueue, current_user.id, "rebuild_summaries")
+    return _accepted(job)
 
 
-@app.get("/expenses/summary/category")
-def category_summary(
-    month: int,
-    year: int,
+@router.get("/expenses/insights")
+async def expense_insights(
+    months: int = Query(12, ge=1, le=120),
+    days: int = Query(30, ge=1, le=365),
+    z: float = Query(3.0, gt=0),
+    outliers: int = Query(20, ge=0, le=100),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-):
-    data = (
-        db.query(models.Expense.category, func.sum(models.Expense.amount))
-        .filter(
-            extract("month", models.Expense.date) == month,
-            extract("year", models.Expense.date) == year,
-            models.Expense.user_id == current_user.id
+    current_user: Principal = Depends(get_current_user),
+    today: date = Depends(request_date),
+    validator: httpcache.Validator = Depends(validate_user_data_daily)
+):
+    """
+    Monthly trend, rolling daily averages, seasonality per category, a
+    spending forecast and anomalous expenses (see analytics.py). Computed
+    on the user's in-memory expense arrays and cached per data version
+    and day, since the current month and the forecast move with the date.
+    """
+    async def compute():
+        return await run_db(
+            db, analytics.insights, current_user.id, months, days, z, outliers, today
         )
-        .group_by(models.Expense.category)
-        .all()
-    )
 
-    return [{"category": c, "total": t} for c, t in data]
+    return await validator.cached(compute)
 
 
-@app.post("/auth/logout")
-def logout(response: Response):
-    response.delete_cookie("access_token")
+# =========================================================
+# BUDGET ROUTES (USER-SCOPED)
+# =========================================================
+
+@router.get("/budgets")
+async def get_budgets(
+    month: Optional[str] = None,
+    today: date = Depends(request_date),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """Each budget with its spending in `month` (YYYY-MM, default: this month)."""
+    year, month_no = summaries.parse_month(month) if month else (today.year, today.month)
+    return await run_db(db, budgets.budget_status, current_user.id, year, month_no)
+
+
+@router.put("/budgets/{category}")
+async def set_budget(
+    category: str,
+    budget: schemas.BudgetCreate,
+    today: date = Depends(request_date),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    Set the monthly limit for a category. Alerts are queued when spending
+    crosses 80% and 100% of it (BUDGET_ALERT_THRESHOLDS).
+    """
+    return await run_db(db, budgets.set_budget, current_user.id, category, budget.limit, today)
+
+
+@router.delete("/budgets/{category}")
+async def delete_budget(
+    category: str,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    if not await run_db(db, budgets.delete_budget, current_user.id, category):
+        raise HTTPException(status_code=404, detail="Budget not found")
+    return {"message": "Budget deleted successfully"}
+
+
+@router.get("/budgets/alerts")
+async def get_budget_alerts(
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """The user's most recent budget alerts, newest first."""
+    return await run_db(db, budgets.list_alerts, current_user.id, limit)
+
+
+# =========================================================
+# JOB ROUTES (USER-SCOPED)
+# =========================================================
+
+async def _get_job(db, user_id: int, job_id: str) -> models.Job:
+    job = await run_db(db, jobs.get_job, user_id, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """Status and progress (0 to 1) of one of the user's jobs."""
+    return jobs.describe(await _get_job(db, current_user.id, job_id))
+
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(
+    job_id: str,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """The job's result: a file download for exports, JSON otherwise."""
+    job = await _get_job(db, current_user.id, job_id)
+    if job.status != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    result = job.result or {}
+    if "file" in result:
+        path = jobs.result_path(result["file"])
+        if not os.path.exists(path):
+            raise HTTPException(status_code=410, detail="Result file is no longer available")
+        return FileResponse(path, media_type=result["media_type"], filename=result["filename"])
+    return result
+
+
+@router.post("/auth/logout")
+async def logout(
+    request: Request,
+    response: Response,
+    everywhere: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    End this session by revoking its refresh tokens. With everywhere=true
+    the user's token version is bumped, which also revokes every access
+    token already issued, on every device.
+    """
+    raw = request.cookies.get("refresh_token")
+    if everywhere:
+        current_user = await get_current_user(request, db)
+        await run_db(db, refresh_tokens.logout_everywhere, current_user.id)
+    elif raw:
+        await run_db(db, refresh_tokens.logout, raw)
+
+    _clear_auth_cookies(response)
     return {"message": "Logged out"}
 
 
-@app.get("/auth/me")
+@router.get("/auth/me")
 def get_current_user_info(
-    current_user: models.User = Depends(get_current_user)
+    request: Request,
+    response: Response,
+    current_user: Principal = Depends(get_current_user)
 ):
+    # the body only depends on the principal, so no query is needed for the ETag
+    etag = httpcache.make_etag("me", current_user.id, current_user.username)
+    httpcache.check_etag(request, response, etag)
     return {"username": current_user.username, "id": current_user.id}
 
 
@@ -251,20 +685,174 @@ def get_current_user_info(
 # ADMINSTRATION ROUTES (PROTECTED)
 # =========================================================
 
-@app.get("/admin/users")
-def get_all_users(
+def _admin_page_response(response: Response, page: dict):
+    if page["next_cursor"]:
+        response.headers["X-Next-Cursor"] = page["next_cursor"]
+    if "count" in page:
+        response.headers["X-Total-Count"] = str(page["count"])
+        response.headers["X-Total-Count-Estimated"] = str(page["count_estimated"]).lower()
+    if serialization.FAST_JSON:
+        return serialization.fast_response(page["items"], response)
+    return page["items"]
+
+
+@router.get("/admin/users")
+async def get_all_users(
+    response: Response,
+    fields: Optional[str] = None,
+    username: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(listing.DEFAULT_PAGE_SIZE, ge=1, le=listing.MAX_PAGE_SIZE),
+    count: bool = False,
+    output: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
     db: Session = Depends(get_db),
-    admin: models.User = Depends(get_admin_user)
+    admin: Principal = Depends(get_admin_user)
 ):
-    return db.query(models.User).all()
+    """
+    Users ordered by id, one page at a time (next page in `X-Next-Cursor`).
+    `fields` picks columns from id, username, is_admin. `count=true` adds
+    `X-Total-Count`, estimated on very large tables. `format=ndjson`
+    streams every matching user, ignoring the default page size.
+    """
+    selected = listing.parse_fields(fields, crud.ADMIN_USER_FIELDS)
+
+    if output == "ndjson":
+        return StreamingResponse(
+            stream_db(db, crud.stream_admin_users, selected, username, cursor),
+            media_type="application/x-ndjson",
+        )
 
+    page = await run_db(db, crud.list_admin_users, selected, username, cursor, limit, count)
+    return _admin_page_response(response, page)
 
 
-@app.get("/admin/expenses")
-def get_all_expenses(
+@router.get("/admin/expenses")
+async def get_all_expenses(
+    response: Response,
+    fields: Optional[str] = None,
+    user_id: Optional[int] = None,
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    category: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(listing.DEFAULT_PAGE_SIZE, ge=1, le=listing.MAX_PAGE_SIZE),
+    count: bool = False,
+    output: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
     db: Session = Depends(get_db),
-    admin: User = Depends(get_admin_user)
+    admin: Principal = Depends(get_admin_user)
 ):
-    return db.query(models.Expense).all()
+    """
+    All users' expenses, newest first, one page at a time, with optional
+    user, date range and category filters. Same `fields`, `count` and
+    `format=ndjson` options as /admin/users.
+    """
+    selected = listing.parse_fields(fields, crud.ADMIN_EXPENSE_FIELDS)
+    criteria = listing.expense_filters(date_from, date_to, category)
+    if user_id is not None:
+        criteria.append(models.Expense.user_id == user_id)
+
+    if output == "ndjson":
+        return StreamingResponse(
+            stream_db(db, crud.stream_admin_expenses, selected, criteria, cursor),
+            media_type="application/x-ndjson",
+        )
+
+    page = await run_db(db, crud.list_admin_expenses, selected, criteria, cursor, limit, count)
+    return _admin_page_response(response, page)
+
+@router.post("/admin/expenses/purge-tombstones")
+async def purge_tombstones(
+    older_than_days: int = Query(crud.TOMBSTONE_RETENTION_DAYS, ge=0),
+    db: Session = Depends(get_db),
+    admin: Principal = Depends(get_admin_user)
+):
+    """Permanently remove soft-deleted expenses past the retention window."""
+    purged = await run_db(db, crud.purge_tombstones, older_than_days)
+    return {"purged": purged}
+
+@router.post("/admin/recompute", status_code=202)
+async def recompute_all_summaries(
+    db: Session = Depends(get_db),
+    admin: Principal = Depends(get_admin_user)
+):
+    """Recompute every user's rollups and ledger as a job owned by the admin."""
+    job = await run_db(db, jobs.enqueue, admin.id, "rebuild_summaries", {"all_users": True})
+    return _accepted(job)
+
+@router.post("/admin/archive", status_code=202)
+async def archive_expenses(
+    before: date = Query(...),
+    db: Session = Depends(get_db),
+    admin: Principal = Depends(get_admin_user)
+):
+    """
+    Move every month before `before`'s month to Parquet archives, as a job.
+    Summaries and exports keep including archived expenses.
+    """
+    job = await run_db(db, jobs.enqueue, admin.id, "archive", {"before": before.isoformat()})
+    return _accepted(job)
+
+@router.get("/admin/pool")
+def get_pool_stats(
+    admin: Principal = Depends(get_admin_user)
+):
+    return pool_stats()
+
+# implementation of delete user and delete expense by admin later 
+
+# =========================================================
+# APPLICATION
+# =========================================================
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if DB_MIGRATE_ON_STARTUP:
+        await run_in_threadpool(migrations.migrate)
+    warmup = asyncio.create_task(pool_warmup.run())
+    # picks up jobs a previous run left queued or running (local broker)
+    jobs.get_broker().start()
+    try:
+        yield
+    finally:
+        warmup.cancel()
+        if jobs.broker is not None:
+            jobs.broker.shutdown(wait=False)
+        await dispose_engines()
+
+
+def create_app() -> FastAPI:
+    application = FastAPI(title="Expense Tracker API", lifespan=lifespan)
+
+    # identical concurrent GETs of one user share a response (innermost)
+    application.add_middleware(singleflight.SingleFlightMiddleware)
+    # token buckets per IP, per user and for login/summaries -> 429
+    application.add_middleware(ratelimit.RateLimitMiddleware)
+
+    # ------------------------
+    # CORS (REQUIRED FOR COOKIES)
+    # ------------------------
+    application.add_middleware(
+        CORSMiddleware,
+        allow_origins=CORS_ORIGINS,
+        allow_credentials=True,  # 🔴 REQUIRED for cookies
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=[
+            "X-Next-Cursor",
+            "X-Total-Count",
+            "X-Total-Count-Estimated",
+            "Content-Disposition",
+            "ETag",
+            "Server-Timing",
+            "Retry-After",
+        ],
+    )
+
+    # query counts, DB/handler/serialization time -> Server-Timing and /metrics
+    application.add_middleware(instrumentation.InstrumentationMiddleware)
+
+    application.include_router(router)
+    return application
+
 
-# implementation of delete user and delete expense by admin later 
\ No newline at end of file
+app = create_app()
@@ -0,0 +1,319 @@
+"""
+Archival of old months of expenses to compressed Parquet files.
+
+`archive_month` moves one calendar month out of the expenses table: its
+live rows are written, sorted by user and date, to a zstd-compressed
+Parquet file under ARCHIVE_DIR, their per-day totals go to
+expense_archive_days, and the rows are removed. On a partitioned table
+(partitions.py) that is dropping the month's partition.
+
+Readers do not need to know:
+
+    rollups and the ledger are left as they are, so the summary routes
+    keep counting archived expenses
+    daily_totals() unions live expenses with the archived day totals;
+    the rollup/ledger rebuilds and range summaries aggregate from it
+    read_table() reads archived rows back from the Parquet files, for
+    exports (merged in date order) and the insights history
+
+Archived expenses are read-only: listings, search, sync and edits see
+the live table only. Archiving bumps each affected user's data_version,
+so cached responses and ETags move on. The month's tombstones are
+dropped with it, and purged_seq is raised as crud.purge_tombstones does. pyarrow is only
+needed once something is archived.
+
+    python archive.py --before 2024-01-01   # archive every month before
+    python archive.py --restore 3           # move archive 3 back
+"""
+
+import argparse
+import os
+from collections import namedtuple
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import delete, func, insert, literal, select, union_all, update
+
+import httpcache
+import models
+import money
+import partitions
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+ARCHIVE_BATCH_SIZE = 50_000
+
+ARCHIVED_COLUMNS = ["id", "user_id", "title", "amount_cents", "category", "date", "external_id", "updated_at"]
+
+ArchivedExpense = namedtuple("ArchivedExpense", ["id", "title", "amount", "category", "date"])
+
+
+def archive_path(name: str) -> str:
+    return os.path.join(ARCHIVE_DIR, name)
+
+
+def _schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("id", pa.int64()),
+        ("user_id", pa.int64()),
+        ("title", pa.string()),
+        ("amount_cents", pa.int64()),
+        ("category", pa.string()),
+        ("date", pa.date32()),
+        ("external_id", pa.string()),
+        ("updated_at", pa.timestamp("us")),
+    ])
+
+
+# ------------------------
+# Read path
+# ------------------------
+
+def daily_totals(user_id: int = None, start: date = None, end: date = None):
+    """
+    Subquery of (user_id, date, category, total_cents, count) over live
+    expenses and archived days, for dates in [start, end).
+    """
+    expense = models.Expense
+    day = models.ExpenseArchiveDay
+    live = (
+        select(
+            expense.user_id,
+            expense.date,
+            expense.category,
+            func.sum(expense.amount_cents).label("total_cents"),
+            func.count(expense.id).label("count"),
+        )
+        .where(expense.deleted_at.is_(None))
+        .group_by(expense.user_id, expense.date, expense.category)
+    )
+    archived = select(day.user_id, day.date, day.category, day.total_cents, day.count)
+
+    def bounded(query, table):
+        # on each side of the union, so both can use their (user_id, date) index
+        if user_id is not None:
+            query = query.where(table.user_id == user_id)
+        if start is not None:
+            query = query.where(table.date >= start)
+        if end is not None:
+            query = query.where(table.date < end)
+        return query
+
+    return union_all(bounded(live, expense), bounded(archived, day)).subquery("daily_totals")
+
+
+def archives(db, start: date = None, end: date = None) -> list:
+    """Archive file names whose month overlaps [start, end)."""
+    archive = models.ExpenseArchive
+    query = select(archive.path).order_by(archive.month, archive.id)
+    if start is not None:
+        query = query.where(archive.month >= partitions.month_start(start))
+    if end is not None:
+        query = query.where(archive.month < end)
+    return list(db.execute(query).scalars())
+
+
+def read_table(db, user_id: int, columns: list, start: date = None, end: date = None):
+    """
+    The user's archived expenses with dates in [start, end) as a pyarrow
+    Table sorted by (date, id), or None when nothing is archived there.
+    """
+    files = archives(db, start, end)
+    if not files:
+        return None
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    filters = [("user_id", "=", user_id)]
+    if start is not None:
+        filters.append(("date", ">=", start))
+    if end is not None:
+        filters.append(("date", "<", end))
+    wanted = sorted({*columns, "date", "id"}, key=ARCHIVED_COLUMNS.index)
+    table = pa.concat_tables(
+        pq.read_table(archive_path(name), columns=wanted, filters=filters) for name in files
+    )
+    return table.sort_by([("date", "ascending"), ("id", "ascending")]).select(columns)
+
+
+def iter_expenses(db, user_id: int, start: date = None, end: date = None):
+    """Archived expenses as rows shaped like the export query's, in (date, id) order."""
+    table = read_table(db, user_id, ["id", "title", "amount_cents", "category", "date"], start, end)
+    if table is None:
+        return
+    for batch in table.to_batches(max_chunksize=ARCHIVE_BATCH_SIZE):
+        columns = batch.to_pydict()
+        for values in zip(columns["id"], columns["title"], columns["amount_cents"], columns["category"], columns["date"]):
+            yield ArchivedExpense(values[0], values[1], money.to_float(values[2]), values[3], values[4])
+
+
+# ------------------------
+# Archiving
+# ------------------------
+
+def _write_parquet(db, path: str, criteria) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    expense = models.Expense
+    schema = _schema()
+    result = db.execute(
+        select(*(getattr(expense, name) for name in ARCHIVED_COLUMNS))
+        .where(*criteria)
+        .order_by(expense.user_id, expense.date, expense.id)
+        .execution_options(yield_per=ARCHIVE_BATCH_SIZE)
+    )
+    rows = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for batch in result.partitions():
+            columns = list(zip(*batch))
+            writer.write_batch(pa.record_batch(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema,
+            ))
+            rows += len(batch)
+    return rows
+
+
+def archive_month(db, month: date) -> Optional[dict]:
+    """Archive one month of every user's expenses; None if it has none."""
+    month = partitions.month_start(month)
+    end = partitions.add_months(month, 1)
+    expense = models.Expense
+    in_month = (expense.date >= month, expense.date < end)
+    live = (*in_month, expense.deleted_at.is_(None))
+
+    if db.execute(select(expense.id).where(*in_month).limit(1)).first() is None:
+        return None
+
+    record = models.ExpenseArchive(month=month, path="", row_count=0, archived_at=datetime.utcnow())
+    db.add(record)
+    db.flush()
+    record.path = f"expenses_{month.year:04d}_{month.month:02d}_{record.id}.parquet"
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = archive_path(record.path)
+    try:
+        record.row_count = _write_parquet(db, path, live)
+        db.execute(
+            insert(models.ExpenseArchiveDay).from_select(
+                ["archive_id", "user_id", "date", "category", "total_cents", "count"],
+                select(
+                    literal(record.id),
+                    expense.user_id,
+                    expense.date,
+                    expense.category,
+                    func.sum(expense.amount_cents),
+                    func.count(expense.id),
+                )
+                .where(*live)
+                .group_by(expense.user_id, expense.date, expense.category),
+            )
+        )
+
+        # clients that synced before now could miss these tombstones
+        tombstones = db.execute(
+            select(expense.user_id, func.max(expense.change_seq))
+            .where(*in_month, expense.deleted_at.is_not(None))
+            .group_by(expense.user_id)
+        ).all()
+        for user_id, max_seq in tombstones:
+            db.execute(
+                update(models.User)
+                .where(models.User.id == user_id, models.User.purged_seq < max_seq)
+                .values(purged_seq=max_seq)
+            )
+
+        # the rows leave the live table: listings and their ETags change
+        users = db.execute(select(expense.user_id).where(*in_month).distinct()).scalars()
+        for user_id in sorted(users):
+            httpcache.bump_data_version(db, user_id)
+
+        if partitions.is_partitioned(db.connection()):
+            partitions.drop_partition(db.connection(), month)
+        db.execute(delete(expense).where(*in_month))
+        db.commit()
+    except Exception:
+        db.rollback()
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return {"id": record.id, "month": month.isoformat(), "rows": record.row_count, "file": record.path}
+
+
+def archive_before(db, before: date, progress=None) -> list:
+    """Archive every month before the one `before` falls in, one transaction each."""
+    expense = models.Expense
+    last = partitions.month_start(before)
+    oldest = db.execute(select(func.min(expense.date)).where(expense.date < last)).scalar()
+    db.rollback()
+    if oldest is None:
+        return []
+    if isinstance(oldest, str):
+        oldest = date.fromisoformat(oldest)
+
+    months = []
+    month = partitions.month_start(oldest)
+    while month < last:
+        months.append(month)
+        month = partitions.add_months(month, 1)
+
+    archived = []
+    for done, month in enumerate(months, start=1):
+        result = archive_month(db, month)
+        if result is not None:
+            archived.append(result)
+        if progress is not None:
+            progress(done, len(months))
+    return archived
+
+
+def restore(db, archive_id: int) -> int:
+    """Move an archive's expenses back into the table; returns how many."""
+    import pyarrow.parquet as pq
+
+    record = db.get(models.ExpenseArchive, archive_id)
+    if record is None:
+        raise LookupError(f"No archive {archive_id}")
+    table = pq.read_table(archive_path(record.path))
+
+    if partitions.is_partitioned(db.connection()):
+        partitions.ensure_partitions(db.connection(), record.month, record.month)
+    # back through the change feed, as if just written
+    versions = {
+        user_id: httpcache.bump_data_version(db, user_id)
+        for user_id in sorted(set(table.column("user_id").to_pylist()))
+    }
+    for batch in table.to_batches(max_chunksize=ARCHIVE_BATCH_SIZE):
+        rows = batch.to_pylist()
+        for row in rows:
+            row["change_seq"] = versions[row["user_id"]]
+        db.execute(insert(models.Expense), rows)
+
+    db.execute(delete(models.ExpenseArchiveDay).where(models.ExpenseArchiveDay.archive_id == archive_id))
+    db.delete(record)
+    db.commit()
+    os.remove(archive_path(record.path))
+    return table.num_rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--before", type=date.fromisoformat, help="archive every month before this date's month")
+    group.add_argument("--restore", type=int, metavar="ARCHIVE_ID", help="move an archive back into the table")
+    args = parser.parse_args(argv)
+
+    from database import SessionLocal
+
+    with SessionLocal() as db:
+        if args.restore is not None:
+            print(f"Restored {restore(db, args.restore)} expenses")
+            return
+        for result in archive_before(db, args.before):
+            print(f"{result['month']}: {result['rows']} expenses -> {result['file']}")
+
+
+if __name__ == "__main__":
+    main()
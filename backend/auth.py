@@ -1,12 +1,18 @@
 from datetime import datetime, timedelta
-from jose import jwt
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from jose import JWTError, jwt
 from passlib.context import CryptContext
+import asyncio
+import os
 import re
+import threading
+import time
 from fastapi import HTTPException
 
-SECRET_KEY = "CHANGE_THIS_SECRET_KEY"
+SECRET_KEY = os.getenv("SECRET_KEY", "CHANGE_THIS_SECRET_KEY")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60
+# short lived: clients renew them through /auth/refresh (see refresh_tokens)
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
 
 pwd_context = CryptContext(
     schemes=["bcrypt"],
@@ -60,8 +66,131 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     plain_password = _truncate(plain_password)
     return pwd_context.verify(plain_password, hashed_password)
 
+# =========================================================
+# BCRYPT WORKER POOL
+# =========================================================
+# bcrypt costs ~250ms of CPU per call. Running it on FastAPI's shared
+# threadpool lets a login burst starve every other endpoint, so hashing
+# goes to a dedicated, size-capped pool. Once every worker is busy and
+# HASH_MAX_QUEUE calls are waiting, new calls get a 429 right away.
+
+HASH_POOL_KIND = os.getenv("HASH_POOL_KIND", "thread")  # "thread" or "process"
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_MAX_QUEUE = int(os.getenv("HASH_MAX_QUEUE", "32"))
+
+
+def _timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, started, time.perf_counter()
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class HashTiming:
+    """Time spent waiting for a worker vs. time spent inside bcrypt."""
+
+    __slots__ = ("queue_ms", "hash_ms")
+
+    def __init__(self, queue_ms: float, hash_ms: float):
+        self.queue_ms = queue_ms
+        self.hash_ms = hash_ms
+
+    def server_timing(self) -> str:
+        return f"hash-queue;dur={self.queue_ms:.1f}, hash;dur={self.hash_ms:.1f}"
+
+
+class HashPool:
+    def __init__(self, kind: str = HASH_POOL_KIND, workers: int = HASH_WORKERS,
+                 max_queue: int = HASH_MAX_QUEUE):
+        self.kind = kind
+        self.workers = workers
+        self.max_queue = max_queue
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "process":
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers, thread_name_prefix="bcrypt"
+                    )
+            return self._executor
+
+    async def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HTTPException(
+                status_code=429,
+                detail="Too many authentication requests, please retry",
+                headers={"Retry-After": "1"},
+            )
+        try:
+            submitted = time.perf_counter()
+            future = self._get_executor().submit(_timed, fn, *args)
+            result, started, finished = await asyncio.wrap_future(future)
+        finally:
+            self._slots.release()
+
+        # perf_counter is only comparable within one process
+        if self.kind == "process":
+            hash_ms = (finished - started) * 1000
+            timing = HashTiming(max(0.0, (time.perf_counter() - submitted) * 1000 - hash_ms), hash_ms)
+        else:
+            timing = HashTiming((started - submitted) * 1000, (finished - started) * 1000)
+        return result, timing
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+hash_pool = HashPool()
+
+
+async def hash_password_async(password: str):
+    """Validate, then hash on the bcrypt pool. Returns (hash, HashTiming)."""
+    validate_password(password)
+    return await hash_pool.run(_hash, _truncate(password))
+
+
+async def verify_password_async(plain_password: str, hashed_password: str):
+    """Verify on the bcrypt pool. Returns (matches, HashTiming)."""
+    return await hash_pool.run(_verify, _truncate(plain_password), hashed_password)
+
+
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    now = datetime.utcnow()
+    expire = now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire, "iat": now})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def token_user_id(token: str):
+    """The user id of a valid, unexpired access token, else None. No revocation check."""
+    try:
+        return int(jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])["sub"])
+    except (JWTError, KeyError, TypeError, ValueError):
+        return None
+
+
+def principal_claims(user_id: int, username: str, is_admin: bool, token_version: int) -> dict:
+    """Claims that let get_current_user authorize without a lookup."""
+    return {
+        "sub": str(user_id),
+        "ver": token_version or 0,
+        "usr": username,
+        "adm": bool(is_admin),
+    }
@@ -0,0 +1,166 @@
+"""
+Throughput of the sync (threadpool) and async (AsyncSession) DB modes.
+
+Starts the API under uvicorn once per mode, seeds one user with expenses,
+then drives read routes with 50, 200 and 1000 concurrent clients and
+prints requests/second and latency percentiles for each combination.
+
+    cd backend
+    DATABASE_URL=postgresql://... python benchmarks/bench_async.py
+    python benchmarks/bench_async.py --database-url sqlite:///./bench.db --duration 5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUTES = [
+    "/expenses?limit=50",
+    "/expenses/summary/monthly?month=1&year=2025",
+    "/expenses/summary/category?month=1&year=2025",
+    "/auth/me",
+]
+USERNAME = "bench_async_user"
+PASSWORD = "Bench@1234"
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def start_server(database_url: str, port: int, async_mode: bool):
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        DB_ASYNC="1" if async_mode else "0",
+        DB_MIGRATE_ON_STARTUP="1",
+        # one client address and one user drive every request
+        RATE_LIMIT="0",
+        SINGLEFLIGHT="0",
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/readyz", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("server did not start")
+
+
+def seed(base_url: str, expenses: int) -> dict:
+    with httpx.Client(base_url=base_url, timeout=60) as client:
+        client.post("/auth/register", json={"username": USERNAME, "password": PASSWORD})
+        client.post("/auth/login", json={"username": USERNAME, "password": PASSWORD})
+        rows = [
+            {
+                "title": f"Expense {i}",
+                "amount": round(random.uniform(1, 200), 2),
+                "category": random.choice(["Food", "Rent", "Transport", "Shopping"]),
+                "date": (date(2025, 1, 1) + timedelta(days=random.randint(0, 30))).isoformat(),
+                "external_id": f"bench-{i}",
+            }
+            for i in range(expenses)
+        ]
+        client.post("/expenses/bulk", json=rows)
+        return dict(client.cookies)
+
+
+async def run_level(base_url: str, cookies: dict, concurrency: int, duration: float) -> dict:
+    latencies = []
+    errors = 0
+    stop_at = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, cookies=cookies, limits=limits, timeout=60) as client:
+        async def worker(seed_offset):
+            nonlocal errors
+            i = seed_offset
+            while time.perf_counter() < stop_at:
+                route = ROUTES[i % len(ROUTES)]
+                i += 1
+                started = time.perf_counter()
+                try:
+                    res = await client.get(route)
+                    if res.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "mean_ms": round(statistics.fmean(latencies), 2) if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--levels", default="50,200,1000")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+    parser.add_argument("--expenses", type=int, default=2000)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("set DATABASE_URL or pass --database-url")
+
+    levels = [int(level) for level in args.levels.split(",")]
+    results = []
+    for async_mode in (False, True):
+        mode = "async" if async_mode else "sync"
+        process = start_server(args.database_url, args.port, async_mode)
+        try:
+            base_url = f"http://127.0.0.1:{args.port}"
+            cookies = seed(base_url, args.expenses)
+            for level in levels:
+                result = {"mode": mode, **asyncio.run(run_level(base_url, cookies, level, args.duration))}
+                results.append(result)
+                print(
+                    f"{mode:5} c={level:<5} {result['rps']:>8} req/s  "
+                    f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms "
+                    f"errors={result['errors']}"
+                )
+        finally:
+            process.terminate()
+            process.wait()
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
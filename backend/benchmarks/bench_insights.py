@@ -0,0 +1,122 @@
+"""
+Latency of the /expenses/insights computation (analytics.insights).
+
+Seeds a throwaway SQLite database with 1k, 10k and 100k expenses, then
+times, per size:
+
+    cold          first call: the user's whole history is read into arrays
+    warm          no writes since the last call: only the change feed is checked
+    after-write   one expense created, so one row is read and merged
+
+The HTTP route additionally answers repeated requests from its per-version
+response cache (and 304s), which this does not measure.
+
+    cd backend
+    python benchmarks/bench_insights.py
+    python benchmarks/bench_insights.py --sizes 1000,10000 --repeat 5 --output insights.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+_tmpdir = tempfile.mkdtemp(prefix="bench_insights_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmpdir, 'bench.db')}"
+
+from sqlalchemy import delete, insert  # noqa: E402
+
+import analytics  # noqa: E402
+import crud  # noqa: E402
+import ledger  # noqa: E402
+import models  # noqa: E402
+import schemas  # noqa: E402
+import summaries  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+
+CATEGORIES = ["Food", "Rent", "Transport", "Shopping", "Other"]
+TODAY = date(2025, 12, 31)
+
+
+def seed(db, user_id: int, size: int):
+    for model in (models.Expense, models.ExpenseRollup, models.ExpenseLedger):
+        db.execute(delete(model))
+    start = TODAY - timedelta(days=729)
+    db.execute(insert(models.Expense), [
+        {
+            "user_id": user_id,
+            "title": f"Expense {i}",
+            "amount_cents": (i * 731) % 50000,
+            "category": CATEGORIES[i % len(CATEGORIES)],
+            "date": start + timedelta(days=i % 730),
+            "change_seq": 1,
+        }
+        for i in range(size)
+    ])
+    db.get(models.User, user_id).data_version = 1
+    db.commit()
+    with engine.begin() as conn:
+        summaries.rebuild(conn, user_id)
+        ledger.rebuild(conn, user_id)
+
+
+def timed(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case; the median is reported")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = models.User(username="bench_insights", password="x")
+    db.add(user)
+    db.commit()
+    user_id = user.id
+
+    def compute():
+        analytics.insights(db, user_id, today=TODAY)
+
+    def write_then_compute():
+        crud.create_expense(db, user_id, schemas.ExpenseCreate(
+            title="Extra", amount=12.5, category="Food", date=TODAY,
+        ))
+        compute()
+
+    results = []
+    try:
+        for size in (int(s) for s in args.sizes.split(",")):
+            seed(db, user_id, size)
+            cases = {"cold": [], "warm": [], "after-write": []}
+            for _ in range(args.repeat):
+                analytics.clear()
+                cases["cold"].append(timed(compute))
+                cases["warm"].append(timed(compute))
+                cases["after-write"].append(timed(write_then_compute))
+            for name, samples in cases.items():
+                ms = statistics.median(samples) * 1000
+                results.append({"rows": size, "case": name, "ms": round(ms, 2)})
+                print(f"{size:>7} rows  {name:<12} {ms:>9.2f} ms")
+    finally:
+        db.close()
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Rows per second of the JSON paths behind the expense list routes.
+
+Seeds a throwaway SQLite database with 1k, 10k and 100k expenses, then
+times query + encode, and the encode step alone, for:
+
+    orm+jsonable   ORM instances through jsonable_encoder and json.dumps
+                   (how the list routes originally worked)
+    rows+model     projected rows validated against ExpenseResponse and
+                   dumped by pydantic (the default path today)
+    rows+orjson    projected rows as dicts, encoded by orjson (FAST_JSON=1)
+
+    cd backend
+    python benchmarks/bench_serialization.py
+    python benchmarks/bench_serialization.py --sizes 1000,10000 --repeat 5 --output ser.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+_tmpdir = tempfile.mkdtemp(prefix="bench_serialization_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmpdir, 'bench.db')}"
+
+import orjson  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+from sqlalchemy import delete, insert  # noqa: E402
+
+import models  # noqa: E402
+import schemas  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+
+CATEGORIES = ["Food", "Rent", "Transport", "Shopping", "Other"]
+LIST_ADAPTER = TypeAdapter(list[schemas.ExpenseResponse])
+
+
+def seed(db, user_id: int, size: int):
+    db.execute(delete(models.Expense))
+    start = date(2024, 1, 1)
+    db.execute(insert(models.Expense), [
+        {
+            "user_id": user_id,
+            "title": f"Expense {i}",
+            "amount_cents": (i * 731) % 50000,
+            "category": CATEGORIES[i % len(CATEGORIES)],
+            "date": start + timedelta(days=i % 730),
+        }
+        for i in range(size)
+    ])
+    db.commit()
+
+
+def projected(db, user_id):
+    expense = models.Expense
+    return (
+        db.query(expense.id, expense.title, expense.amount, expense.category, expense.date)
+        .filter(expense.user_id == user_id)
+        .order_by(expense.date.desc(), expense.id.desc())
+        .all()
+    )
+
+
+def orm_instances(db, user_id):
+    expense = models.Expense
+    return (
+        db.query(expense)
+        .filter(expense.user_id == user_id)
+        .order_by(expense.date.desc(), expense.id.desc())
+        .all()
+    )
+
+
+def encode_jsonable(rows) -> bytes:
+    payload = jsonable_encoder([schemas.ExpenseResponse.model_validate(row) for row in rows])
+    return json.dumps(payload).encode("utf-8")
+
+
+def encode_model(rows) -> bytes:
+    return LIST_ADAPTER.dump_json(LIST_ADAPTER.validate_python(rows, from_attributes=True))
+
+
+def encode_orjson(rows) -> bytes:
+    return orjson.dumps([row._asdict() for row in rows])
+
+
+# name: (fetch, encode)
+PATHS = {
+    "orm+jsonable": (orm_instances, encode_jsonable),
+    "rows+model": (projected, encode_model),
+    "rows+orjson": (projected, encode_orjson),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per path; the median is reported")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = models.User(username="bench_serialization", password="x")
+    db.add(user)
+    db.commit()
+    user_id = user.id
+
+    results = []
+    try:
+        for size in (int(s) for s in args.sizes.split(",")):
+            seed(db, user_id, size)
+            for name, (fetch, encode) in PATHS.items():
+                totals, encodes = [], []
+                for _ in range(args.repeat):
+                    db.expunge_all()
+                    started = time.perf_counter()
+                    rows = fetch(db, user_id)
+                    fetched = time.perf_counter()
+                    body = encode(rows)
+                    done = time.perf_counter()
+                    totals.append(done - started)
+                    encodes.append(done - fetched)
+                total, encoding = statistics.median(totals), statistics.median(encodes)
+                result = {
+                    "rows": size,
+                    "path": name,
+                    "seconds": round(total, 4),
+                    "rows_per_second": round(size / total),
+                    "encode_seconds": round(encoding, 4),
+                    "encode_rows_per_second": round(size / encoding),
+                    "bytes": len(body),
+                }
+                results.append(result)
+                print(
+                    f"{size:>7} rows  {name:<13} {result['rows_per_second']:>9} rows/s total  "
+                    f"{result['encode_rows_per_second']:>9} rows/s encode"
+                )
+    finally:
+        db.close()
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
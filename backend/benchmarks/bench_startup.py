@@ -0,0 +1,114 @@
+"""
+Startup cost of the API, each measured in a fresh interpreter.
+
+    migrate       python migrations.py on an empty database (the explicit
+                  step run before the server starts)
+    import        `import app`: no database work, engines are created lazily
+    healthz       from interpreter start to the first /healthz response
+    readyz        from interpreter start to the first 200 from /readyz,
+                  i.e. with the pool warmed by the lifespan task
+
+and prints the modules that take longest to import (python -X importtime).
+
+    cd backend
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --repeat 10 --top 25 --output startup.json
+    python benchmarks/bench_startup.py --database-url postgresql://...
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SCRIPT = """
+import time
+started = time.perf_counter()
+import app
+print(time.perf_counter() - started)
+"""
+
+SERVE_SCRIPT = """
+import json, time
+started = time.perf_counter()
+from fastapi.testclient import TestClient
+import app
+
+result = {}
+with TestClient(app.app) as client:
+    assert client.get("/healthz").status_code == 200
+    result["healthz"] = time.perf_counter() - started
+    deadline = started + 60
+    while client.get("/readyz").status_code != 200:
+        if time.perf_counter() > deadline:
+            raise SystemExit("not ready after 60s")
+        time.sleep(0.005)
+    result["readyz"] = time.perf_counter() - started
+print(json.dumps(result))
+"""
+
+
+def run(args, env) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *args], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+
+
+def import_profile(env, top: int) -> list:
+    """(cumulative_ms, self_ms, module) for the slowest imports of `import app`."""
+    stderr = run(["-X", "importtime", "-c", "import app"], env).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative) / 1000, int(own) / 1000, name.rstrip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="defaults to a throwaway SQLite file")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per case; the median is reported")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    database_url = args.database_url or (
+        f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench_startup_'), 'bench.db')}"
+    )
+    env = dict(os.environ, DATABASE_URL=database_url, DB_MIGRATE_ON_STARTUP="0")
+
+    migrate = run(["-c", "import time, runpy; t = time.perf_counter(); "
+                         "runpy.run_path('migrations.py', run_name='__main__'); "
+                         "print(time.perf_counter() - t)"], env)
+    cases = {"migrate": [float(migrate.stdout.splitlines()[-1])], "import": [], "healthz": [], "readyz": []}
+    for _ in range(args.repeat):
+        cases["import"].append(float(run(["-c", IMPORT_SCRIPT], env).stdout))
+        served = json.loads(run(["-c", SERVE_SCRIPT], env).stdout)
+        cases["healthz"].append(served["healthz"])
+        cases["readyz"].append(served["readyz"])
+
+    results = {"cases": {}, "imports": []}
+    for name, samples in cases.items():
+        ms = statistics.median(samples) * 1000
+        results["cases"][name] = round(ms, 2)
+        print(f"{name:<8} {ms:>9.2f} ms")
+
+    print(f"\n{'slowest imports (ms)':<45} {'cumulative':>10} {'self':>8}")
+    for cumulative, own, name in import_profile(env, args.top):
+        results["imports"].append({"module": name.strip(), "cumulative_ms": cumulative, "self_ms": own})
+        print(f"  {name:<43} {cumulative:>10.1f} {own:>8.1f}")
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+"""
+Load test of the real ASGI app, in process.
+
+Seeds N users x M expenses into a local database (a throwaway SQLite file
+unless --database-url points at a Postgres), then drives `app.app`
+through httpx's ASGITransport with a fixed number of concurrent virtual
+users. Each picks routes by weight: login, list, create, summaries, search
+and the admin listings. Per route it reports requests/second and
+p50/p95/p99 latency, and can write the results as JSON so runs can be
+compared between commits.
+
+    cd backend
+    python benchmarks/loadtest.py --users 20 --expenses 5000 --concurrency 50
+    python benchmarks/loadtest.py --output before.json
+    python benchmarks/loadtest.py --compare before.json --threshold 10
+
+The database is reused (and not reseeded) when it already holds the
+seeded users, so repeated runs against one --database-url are comparable.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+PASSWORD = "Load@1234"
+ADMIN_USERNAME = "loadtest_admin"
+
+# category: (share of expenses, median amount, spread of log(amount))
+CATEGORIES = {
+    "Food": (0.35, 12.0, 0.6),
+    "Transport": (0.20, 8.0, 0.5),
+    "Shopping": (0.15, 40.0, 0.9),
+    "Entertainment": (0.10, 25.0, 0.7),
+    "Utilities": (0.08, 60.0, 0.3),
+    "Health": (0.07, 35.0, 0.8),
+    "Rent": (0.05, 900.0, 0.15),
+}
+TITLES = {
+    "Food": ["Coffee", "Lunch", "Groceries", "Dinner out", "Bakery", "Pizza"],
+    "Transport": ["Bus ticket", "Train pass", "Taxi", "Fuel", "Parking"],
+    "Shopping": ["Clothes", "Shoes", "Books", "Electronics", "Gift"],
+    "Entertainment": ["Cinema", "Concert", "Streaming", "Games"],
+    "Utilities": ["Electricity", "Water", "Internet", "Phone bill"],
+    "Health": ["Pharmacy", "Doctor", "Gym membership", "Dentist"],
+    "Rent": ["Monthly rent"],
+}
+
+# route name: weight
+DEFAULT_MIX = {
+    "login": 1,
+    "list": 30,
+    "list_filtered": 10,
+    "create": 8,
+    "summary_monthly": 12,
+    "summary_category": 12,
+    "summary_range": 8,
+    "summary_spent": 6,
+    "insights": 4,
+    "search": 8,
+    "me": 6,
+    "admin_users": 2,
+    "admin_expenses": 3,
+}
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+# ------------------------
+# Seeding
+# ------------------------
+
+def username(n: int) -> str:
+    return f"loadtest_user_{n}"
+
+
+def random_expense(rng: random.Random, today: date, days: int) -> dict:
+    names = list(CATEGORIES)
+    category = rng.choices(names, weights=[CATEGORIES[c][0] for c in names])[0]
+    _, median, sigma = CATEGORIES[category]
+    # recent days are busier than old ones
+    age = int(rng.expovariate(3 / days)) % days
+    return {
+        "title": rng.choice(TITLES[category]),
+        "amount": round(rng.lognormvariate(math.log(median), sigma), 2),
+        "category": category,
+        "date": today - timedelta(days=age),
+    }
+
+
+def seed(users: int, expenses: int, days: int, rng: random.Random):
+    from sqlalchemy import func, insert, select
+
+    import ledger
+    import models
+    import money
+    import summaries
+    from auth import hash_password
+    from database import engine
+
+    with engine.begin() as conn:
+        existing = conn.execute(
+            select(func.count()).select_from(models.User).where(
+                models.User.username.in_([username(n) for n in range(users)])
+            )
+        ).scalar()
+        if existing == users:
+            return False
+
+        # every user shares one password hash, so seeding is not bcrypt bound
+        password_hash = hash_password(PASSWORD)
+        if not conn.execute(select(models.User.id).where(models.User.username == ADMIN_USERNAME)).first():
+            conn.execute(insert(models.User).values(
+                username=ADMIN_USERNAME, password=password_hash, is_admin=True,
+            ))
+        today = date.today()
+        for n in range(users):
+            user_id = conn.execute(
+                insert(models.User)
+                .values(username=username(n), password=password_hash)
+                .returning(models.User.id)
+            ).scalar_one()
+            rows = []
+            for _ in range(expenses):
+                row = random_expense(rng, today, days)
+                row["amount_cents"] = money.to_cents(row.pop("amount"))
+                rows.append({**row, "user_id": user_id, "change_seq": 1})
+            for start in range(0, len(rows), 5000):
+                conn.execute(insert(models.Expense), rows[start:start + 5000])
+            conn.execute(
+                models.User.__table__.update()
+                .where(models.User.id == user_id)
+                .values(data_version=1)
+            )
+        summaries.rebuild(conn)
+        ledger.rebuild(conn)
+    return True
+
+
+# ------------------------
+# Load
+# ------------------------
+
+def build_request(route: str, rng: random.Random, today: date, days: int):
+    """(method, url, json body) for one call of `route`."""
+    month = today - timedelta(days=rng.randint(0, days))
+    if route == "login":
+        return "POST", "/auth/login", None
+    if route == "list":
+        return "GET", "/expenses?limit=50", None
+    if route == "list_filtered":
+        category = rng.choice(list(CATEGORIES))
+        return "GET", f"/expenses?limit=50&category={category}&from={month.isoformat()}", None
+    if route == "create":
+        body = random_expense(rng, today, days)
+        return "POST", "/expenses", {**body, "date": body["date"].isoformat()}
+    if route == "summary_monthly":
+        return "GET", f"/expenses/summary/monthly?month={month.month}&year={month.year}", None
+    if route == "summary_category":
+        return "GET", f"/expenses/summary/category?month={month.month}&year={month.year}", None
+    if route == "summary_range":
+        start = today - timedelta(days=days)
+        return "GET", f"/expenses/summary/range?start={start:%Y-%m}&end={today:%Y-%m}", None
+    if route == "summary_spent":
+        return "GET", f"/expenses/summary/spent?from={month.isoformat()}&to={today.isoformat()}", None
+    if route == "insights":
+        return "GET", "/expenses/insights", None
+    if route == "search":
+        category = rng.choice(list(CATEGORIES))
+        return "GET", f"/expenses/search?q={rng.choice(TITLES[category]).split()[0].lower()}", None
+    if route == "me":
+        return "GET", "/auth/me", None
+    if route == "admin_users":
+        return "GET", "/admin/users?limit=50", None
+    if route == "admin_expenses":
+        return "GET", "/admin/expenses?limit=50", None
+    raise ValueError(f"unknown route {route!r}")
+
+
+async def run_load(app, users: int, concurrency: int, duration: float, mix: dict,
+                   days: int, warmup: float, rng: random.Random) -> dict:
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    today = date.today()
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    routes, weights = zip(*mix.items())
+
+    async def login(client, name):
+        res = await client.post("/auth/login", json={"username": name, "password": PASSWORD})
+        res.raise_for_status()
+
+    def new_client():
+        return httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=120)
+
+    async def virtual_user(n: int, admin_client, start_at: float, stop_at: float):
+        name = username(n % users)
+        async with new_client() as client:
+            await login(client, name)
+            while True:
+                now = time.perf_counter()
+                if now >= stop_at:
+                    return
+                route = rng.choices(routes, weights=weights)[0]
+                method, url, body = build_request(route, rng, today, days)
+                if route == "login":
+                    body = {"username": name, "password": PASSWORD}
+                # admin routes go out on one shared admin session
+                target = admin_client if route.startswith("admin") else client
+
+                started = time.perf_counter()
+                try:
+                    res = await target.request(method, url, json=body)
+                    failed = res.status_code >= 400
+                except httpx.HTTPError:
+                    failed = True
+                elapsed = (time.perf_counter() - started) * 1000
+                if started >= start_at:
+                    latencies[route].append(elapsed)
+                    if failed:
+                        errors[route] += 1
+
+    async with new_client() as admin_client:
+        await login(admin_client, ADMIN_USERNAME)
+        start_at = time.perf_counter() + warmup
+        stop_at = start_at + duration
+        await asyncio.gather(*(
+            virtual_user(n, admin_client, start_at, stop_at) for n in range(concurrency)
+        ))
+        measured = time.perf_counter() - start_at
+
+    report = {}
+    for route in mix:
+        samples = latencies.get(route, [])
+        report[route] = {
+            "requests": len(samples),
+            "errors": errors.get(route, 0),
+            "rps": round(len(samples) / measured, 1),
+            "p50_ms": round(percentile(samples, 50), 2),
+            "p95_ms": round(percentile(samples, 95), 2),
+            "p99_ms": round(percentile(samples, 99), 2),
+            "mean_ms": round(statistics.fmean(samples), 2) if samples else 0.0,
+        }
+    total = sum(r["requests"] for r in report.values())
+    report["_all"] = {
+        "requests": total,
+        "errors": sum(r["errors"] for r in report.values()),
+        "rps": round(total / measured, 1),
+    }
+    return report
+
+
+# ------------------------
+# Reporting
+# ------------------------
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(report: dict):
+    print(f"{'route':<18}{'req':>8}{'err':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for route, r in report.items():
+        if route == "_all":
+            continue
+        print(
+            f"{route:<18}{r['requests']:>8}{r['errors']:>6}{r['rps']:>9}"
+            f"{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}"
+        )
+    overall = report["_all"]
+    print(f"{'all':<18}{overall['requests']:>8}{overall['errors']:>6}{overall['rps']:>9}")
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> list:
+    """Routes whose p95 got worse than the baseline by more than `threshold` percent."""
+    regressions = []
+    print(f"\n{'route':<18}{'p95 before':>12}{'p95 now':>10}{'change':>9}")
+    for route, now in report.items():
+        before = baseline.get(route)
+        if route == "_all" or not before or not before.get("p95_ms"):
+            continue
+        change = (now["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"{route:<18}{before['p95_ms']:>12}{now['p95_ms']:>10}{change:>+8.1f}%{flag}")
+        if flag:
+            regressions.append(route)
+    return regressions
+
+
+def parse_mix(value: str) -> dict:
+    if not value:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in value.split(","):
+        route, _, weight = part.partition("=")
+        if route.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown route {route!r}; pick from {', '.join(DEFAULT_MIX)}")
+        mix[route.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="defaults to a throwaway SQLite file")
+    parser.add_argument("--users", type=int, default=10, help="seeded users")
+    parser.add_argument("--expenses", type=int, default=2000, help="expenses per seeded user")
+    parser.add_argument("--days", type=int, default=365, help="expense dates span this many days")
+    parser.add_argument("--concurrency", type=int, default=20, help="virtual users")
+    parser.add_argument("--duration", type=float, default=15.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds first")
+    parser.add_argument("--mix", type=parse_mix, default=None,
+                        help="route weights, e.g. list=5,create=1 (default: a read-heavy mix)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --output run")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="p95 increase (percent) counted as a regression by --compare")
+    args = parser.parse_args()
+
+    database_url = args.database_url or os.getenv("LOADTEST_DATABASE_URL")
+    if not database_url:
+        database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='loadtest_'), 'loadtest.db')}"
+    # must be set before the app (and its engine) is imported
+    os.environ["DATABASE_URL"] = database_url
+    # every simulated user shares one client address
+    os.environ.setdefault("RATE_LIMIT", "0")
+
+    from app import app
+    import migrations
+
+    migrations.migrate()
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    seeded = seed(args.users, args.expenses, args.days, rng)
+    if seeded:
+        print(f"seeded {args.users} users x {args.expenses} expenses in {time.perf_counter() - started:.1f}s")
+
+    mix = args.mix or dict(DEFAULT_MIX)
+    report = asyncio.run(run_load(
+        app, args.users, args.concurrency, args.duration, mix, args.days, args.warmup, rng
+    ))
+    print_report(report)
+
+    result = {
+        "revision": git_revision(),
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "database": database_url.split("://")[0],
+        "params": {
+            "users": args.users,
+            "expenses": args.expenses,
+            "days": args.days,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "mix": mix,
+            "seed": args.seed,
+        },
+        "routes": report,
+    }
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(result, fh, indent=2)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        if compare(report, baseline["routes"], args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Monthly budgets per category and threshold alerts.
+
+Nothing is aggregated to evaluate a budget: the expense_rollups row of a
+(user, month, category) already holds its running total, and
+summaries.apply_many hands every rollup change to `check` as an
+(old total, new total) pair. That is one budget lookup per changed cell.
+A total that moves up across ALERT_THRESHOLDS percent of the limit adds
+a row to the budget_alerts outbox in the same transaction, at most once
+per threshold and month. alert_worker.py delivers them.
+"""
+
+import os
+from datetime import date
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+import models
+import money
+
+ALERT_THRESHOLDS = tuple(
+    int(pct) for pct in os.getenv("BUDGET_ALERT_THRESHOLDS", "80,100").split(",")
+)
+
+_INSERT_IGNORE_DIALECTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def crossed(old_cents: int, new_cents: int, limit_cents: int) -> list:
+    """Thresholds (percent) passed on the way from `old_cents` up to `new_cents`."""
+    return [
+        pct for pct in ALERT_THRESHOLDS
+        if old_cents * 100 < limit_cents * pct <= new_cents * 100
+    ]
+
+
+def _enqueue(db, alerts: list):
+    upsert = _INSERT_IGNORE_DIALECTS.get(db.get_bind().dialect.name)
+    alert = models.BudgetAlert
+    if upsert is not None:
+        db.execute(upsert(alert).on_conflict_do_nothing(), alerts)
+        return
+    for values in alerts:
+        exists = db.execute(
+            select(alert.id).where(
+                *(getattr(alert, key) == values[key]
+                  for key in ("user_id", "year", "month", "category", "threshold"))
+            )
+        ).first()
+        if exists is None:
+            db.add(alert(**values))
+
+
+def check(db, user_id: int, changes: list):
+    """
+    Queue alerts for rollup changes given as
+    (year, month, category, old total cents, new total cents).
+    """
+    rising = [change for change in changes if change[4] > change[3]]
+    if not rising:
+        return
+    limits = dict(
+        db.execute(
+            select(models.Budget.category, models.Budget.limit_cents).where(
+                models.Budget.user_id == user_id,
+                models.Budget.category.in_({change[2] for change in rising}),
+            )
+        ).all()
+    )
+    alerts = [
+        {
+            "user_id": user_id,
+            "year": year,
+            "month": month,
+            "category": category,
+            "threshold": pct,
+            "spent_cents": new,
+            "limit_cents": limits[category],
+        }
+        for year, month, category, old, new in rising
+        if category in limits
+        for pct in crossed(old, new, limits[category])
+    ]
+    if alerts:
+        _enqueue(db, alerts)
+
+
+# ------------------------
+# Budgets
+# ------------------------
+
+def _month_total(db, user_id: int, year: int, month: int, category: str) -> int:
+    rollup = models.ExpenseRollup
+    total = db.execute(
+        select(rollup.total_cents).where(
+            rollup.user_id == user_id,
+            rollup.year == year,
+            rollup.month == month,
+            rollup.category == category,
+        )
+    ).scalar()
+    return total or 0
+
+
+def set_budget(db, user_id: int, category: str, limit, today: date = None) -> dict:
+    """
+    Create or change a budget. Thresholds this month's spending is already
+    past are alerted right away, as if the spending had just happened.
+    """
+    today = today or date.today()
+    limit_cents = money.to_cents(limit)
+    budget = db.get(models.Budget, (user_id, category))
+    if budget is None:
+        db.add(models.Budget(user_id=user_id, category=category, limit_cents=limit_cents))
+    else:
+        budget.limit_cents = limit_cents
+    db.flush()
+
+    spent = _month_total(db, user_id, today.year, today.month, category)
+    check(db, user_id, [(today.year, today.month, category, 0, spent)])
+    db.commit()
+    return _status(category, limit_cents, spent)
+
+
+def delete_budget(db, user_id: int, category: str) -> bool:
+    budget = db.get(models.Budget, (user_id, category))
+    if budget is None:
+        return False
+    db.delete(budget)
+    db.commit()
+    return True
+
+
+def _status(category: str, limit_cents: int, spent_cents: int) -> dict:
+    return {
+        "category": category,
+        "limit": money.to_float(limit_cents),
+        "spent": money.to_float(spent_cents),
+        "percent": round(spent_cents * 100 / limit_cents, 1) if limit_cents else None,
+    }
+
+
+def budget_status(db, user_id: int, year: int, month: int) -> list:
+    """Every budget of the user with that month's spending, from the rollups."""
+    budget = models.Budget
+    rollup = models.ExpenseRollup
+    rows = db.execute(
+        select(budget.category, budget.limit_cents, rollup.total_cents)
+        .outerjoin(
+            rollup,
+            (rollup.user_id == budget.user_id)
+            & (rollup.category == budget.category)
+            & (rollup.year == year)
+            & (rollup.month == month),
+        )
+        .where(budget.user_id == user_id)
+        .order_by(budget.category)
+    ).all()
+    return [_status(category, limit, spent or 0) for category, limit, spent in rows]
+
+
+def list_alerts(db, user_id: int, limit: int) -> list:
+    alert = models.BudgetAlert
+    rows = db.execute(
+        select(
+            alert.id, alert.year, alert.month, alert.category, alert.threshold,
+            alert.spent_cents, alert.limit_cents, alert.created_at, alert.delivered_at,
+        )
+        .where(alert.user_id == user_id)
+        .order_by(alert.id.desc())
+        .limit(limit)
+    ).all()
+    return [
+        {
+            "id": row.id,
+            "month": f"{row.year:04d}-{row.month:02d}",
+            "category": row.category,
+            "threshold": row.threshold,
+            "spent": money.to_float(row.spent_cents),
+            "limit": money.to_float(row.limit_cents),
+            "created_at": row.created_at.isoformat(),
+            "delivered": row.delivered_at is not None,
+        }
+        for row in rows
+    ]
@@ -0,0 +1,269 @@
+"""
+Bulk expense import with idempotent upserts.
+
+The body is a JSON array, NDJSON or CSV. NDJSON and CSV bodies are read
+as a stream, either straight from the request or, for imports run as a
+background job (jobs.py), from the spooled body file. Rows are handled in chunks. Each chunk is validated, then
+written with batched executemany statements in its own transaction.
+Rows carrying an `external_id` the user already imported update that
+expense instead of creating a duplicate. Bad rows are reported one by one
+and do not stop the rest of the import.
+"""
+
+import codecs
+import csv
+import json
+
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+import httpcache
+import models
+import money
+import schemas
+import summaries
+from database import run_db
+
+CHUNK_SIZE = 1000
+CSV_REQUIRED_FIELDS = {"title", "amount", "category", "date"}
+
+JSON_TYPES = {"application/json"}
+NDJSON_TYPES = {"application/x-ndjson", "application/jsonl", "application/ndjson"}
+CSV_TYPES = {"text/csv", "application/csv"}
+
+
+# ------------------------
+# Parsing
+# ------------------------
+
+def _validation_message(exc: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}"
+        for err in exc.errors()
+    )
+
+
+async def _iter_lines(chunks):
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer.strip():
+        yield buffer.rstrip("\r")
+
+
+async def _iter_json_array(chunks):
+    try:
+        payload = json.loads(b"".join([chunk async for chunk in chunks]))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body is not valid JSON")
+    if not isinstance(payload, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of expenses")
+    for row_no, raw in enumerate(payload, start=1):
+        yield row_no, raw
+
+
+async def _iter_ndjson(chunks):
+    row_no = 0
+    async for line in _iter_lines(chunks):
+        if not line.strip():
+            continue
+        row_no += 1
+        try:
+            yield row_no, json.loads(line)
+        except ValueError:
+            yield row_no, "Invalid JSON"
+
+
+async def _iter_csv(chunks):
+    header = None
+    pending = ""
+    row_no = 0
+    async for line in _iter_lines(chunks):
+        pending = f"{pending}\n{line}" if pending else line
+        if pending.count('"') % 2:
+            # a quoted field continues on the next line
+            continue
+        fields = next(csv.reader([pending]), [])
+        pending = ""
+
+        if header is None:
+            header = [name.strip().lower() for name in fields]
+            missing = CSV_REQUIRED_FIELDS - set(header)
+            if missing:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"CSV header is missing: {', '.join(sorted(missing))}",
+                )
+            continue
+        if not any(field.strip() for field in fields):
+            continue
+
+        row_no += 1
+        raw = dict(zip(header, fields))
+        if not raw.get("external_id"):
+            raw.pop("external_id", None)
+        yield row_no, raw
+
+
+def parser_for(content_type: str):
+    """The record parser for a Content-Type header; 415 if unsupported."""
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type in JSON_TYPES:
+        return _iter_json_array
+    if media_type in NDJSON_TYPES:
+        return _iter_ndjson
+    if media_type in CSV_TYPES:
+        return _iter_csv
+    raise HTTPException(
+        status_code=415,
+        detail="Send application/json, application/x-ndjson or text/csv",
+    )
+
+
+def iter_records(content_type: str, chunks):
+    """Parse an async iterable of body bytes; yields (row number, raw row)."""
+    return parser_for(content_type)(chunks)
+
+
+# ------------------------
+# Writing
+# ------------------------
+
+def _roll_back(db, exc, result: schemas.BulkImportResult, rows: list):
+    db.rollback()
+    message = f"Chunk rolled back: {exc.__class__.__name__}"
+    for row_no, item in sorted(rows, key=lambda pair: pair[0]):
+        result.errors.append(schemas.BulkImportError(
+            row=row_no, external_id=item.external_id, error=message,
+        ))
+
+
+def import_chunk(db, user_id: int, records: list, result: schemas.BulkImportResult):
+    """Validate and write one chunk of (row number, raw row) records."""
+    keyed = {}
+    anonymous = []
+    superseded = []
+    for row_no, raw in records:
+        if isinstance(raw, str):
+            result.errors.append(schemas.BulkImportError(row=row_no, error=raw))
+            continue
+        try:
+            item = schemas.ExpenseImport.model_validate(raw)
+        except ValidationError as exc:
+            external_id = raw.get("external_id") if isinstance(raw, dict) else None
+            result.errors.append(schemas.BulkImportError(
+                row=row_no,
+                external_id=str(external_id) if external_id is not None else None,
+                error=_validation_message(exc),
+            ))
+            continue
+
+        if item.external_id:
+            if item.external_id in keyed:
+                # the same external id twice in a chunk: the later row wins
+                superseded.append(keyed[item.external_id])
+            keyed[item.external_id] = (row_no, item)
+        else:
+            anonymous.append((row_no, item))
+
+    if not keyed and not anonymous:
+        return
+    try:
+        # the user row lock comes first, so a concurrent import of the same
+        # external ids waits here and then sees this one's rows; on a
+        # partitioned table this is what keeps (user_id, external_id) unique
+        change_seq = httpcache.bump_data_version(db, user_id)
+        existing = {}
+        if keyed:
+            expense = models.Expense
+            rows = db.execute(
+                select(
+                    expense.id, expense.external_id,
+                    expense.date, expense.category, expense.amount_cents, expense.deleted_at,
+                ).where(
+                    expense.user_id == user_id,
+                    expense.external_id.in_(list(keyed)),
+                )
+            )
+            existing = {row.external_id: row for row in rows}
+    except SQLAlchemyError as exc:
+        _roll_back(db, exc, result, [*superseded, *keyed.values(), *anonymous])
+        return
+
+    inserts, updates, removed, added = [], [], [], []
+    for external_id, (row_no, item) in keyed.items():
+        values = {
+            "title": item.title,
+            "amount_cents": money.to_cents(item.amount),
+            "category": item.category,
+            "date": item.date,
+        }
+        old = existing.get(external_id)
+        if old is not None:
+            # re-importing a deleted row brings it back
+            updates.append({"id": old.id, "deleted_at": None, **values})
+            if old.deleted_at is None:
+                removed.append(summaries.Entry(old.date, old.category, old.amount_cents))
+        else:
+            inserts.append({**values, "user_id": user_id, "external_id": external_id})
+        added.append(summaries.Entry(item.date, item.category, values["amount_cents"]))
+
+    for row_no, item in anonymous:
+        inserts.append({
+            "title": item.title,
+            "amount_cents": money.to_cents(item.amount),
+            "category": item.category,
+            "date": item.date,
+            "user_id": user_id,
+            "external_id": None,
+        })
+        added.append(summaries.Entry(item.date, item.category, inserts[-1]["amount_cents"]))
+
+    for values in (*inserts, *updates):
+        values["change_seq"] = change_seq
+
+    try:
+        if inserts:
+            db.execute(insert(models.Expense), inserts)
+        if updates:
+            db.execute(update(models.Expense), updates)
+        summaries.apply_many(db, user_id, removed=removed, added=added)
+        db.commit()
+    except SQLAlchemyError as exc:
+        _roll_back(db, exc, result, [*superseded, *keyed.values(), *anonymous])
+        return
+
+    result.inserted += len(inserts)
+    # a superseded row counts as written, then overwritten by the later one
+    result.updated += len(updates) + len(superseded)
+
+
+async def import_records(records, db, user_id: int, on_chunk=None) -> schemas.BulkImportResult:
+    """Import (row number, raw row) records; on_chunk() runs after each chunk."""
+    result = schemas.BulkImportResult()
+    chunk = []
+    async for record in records:
+        chunk.append(record)
+        if len(chunk) >= CHUNK_SIZE:
+            await run_db(db, import_chunk, user_id, chunk, result)
+            chunk = []
+            if on_chunk is not None:
+                on_chunk()
+    if chunk:
+        await run_db(db, import_chunk, user_id, chunk, result)
+
+    result.failed = len(result.errors)
+    result.errors.sort(key=lambda err: err.row)
+    return result
+
+
+async def import_stream(request: Request, db, user_id: int) -> schemas.BulkImportResult:
+    records = iter_records(request.headers.get("content-type", ""), request.stream())
+    return await import_records(records, db, user_id)
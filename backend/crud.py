@@ -0,0 +1,295 @@
+"""
+Database logic behind the expense and admin routes.
+
+Every function takes a sync Session first, so a route can run it on the
+threadpool or inside AsyncSession.run_sync (see database.run_db) and the
+sync and async modes share one implementation.
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, func, tuple_, update
+
+import httpcache
+import listing
+import models
+import schemas
+import summaries
+
+
+# ------------------------
+# Expenses
+# ------------------------
+
+# Every write bumps the user's data version first and stamps it on the rows
+# it touches as their change_seq, which is what /expenses/changes pages on.
+# Deletes leave a tombstone (deleted_at) so syncing clients learn about them.
+
+TOMBSTONE_RETENTION_DAYS = int(os.getenv("TOMBSTONE_RETENTION_DAYS", "30"))
+
+
+def create_expense(db, user_id: int, expense: schemas.ExpenseCreate) -> models.Expense:
+    new_expense = models.Expense(
+        title=expense.title,
+        amount=expense.amount,
+        category=expense.category,
+        date=expense.date,
+        user_id=user_id,
+        change_seq=httpcache.bump_data_version(db, user_id),
+    )
+
+    db.add(new_expense)
+    summaries.apply_change(db, user_id, after=summaries.entry(new_expense))
+    db.commit()
+    db.refresh(new_expense)
+    return new_expense
+
+
+def _owned_expense(db, user_id: int, expense_id: int) -> Optional[models.Expense]:
+    return (
+        db.query(models.Expense)
+        .filter(
+            models.Expense.id == expense_id,
+            models.Expense.user_id == user_id,
+            models.Expense.deleted_at.is_(None)
+        )
+        .first()
+    )
+
+
+def update_expense(db, user_id: int, expense_id: int,
+                   expense: schemas.ExpenseCreate) -> Optional[models.Expense]:
+    db_expense = _owned_expense(db, user_id, expense_id)
+    if not db_expense:
+        return None
+
+    before = summaries.entry(db_expense)
+    db_expense.title = expense.title
+    db_expense.amount = expense.amount
+    db_expense.category = expense.category
+    db_expense.date = expense.date
+    db_expense.change_seq = httpcache.bump_data_version(db, user_id)
+    summaries.apply_change(
+        db, user_id, before=before, after=summaries.entry(db_expense)
+    )
+
+    db.commit()
+    db.refresh(db_expense)
+    return db_expense
+
+
+def delete_expense(db, user_id: int, expense_id: int) -> bool:
+    db_expense = _owned_expense(db, user_id, expense_id)
+    if not db_expense:
+        return False
+
+    summaries.apply_change(db, user_id, before=summaries.entry(db_expense))
+    db_expense.deleted_at = datetime.utcnow()
+    db_expense.change_seq = httpcache.bump_data_version(db, user_id)
+    db.commit()
+    return True
+
+
+def _expense_list_query(db, user_id: int, criteria: list,
+                        cursor: Optional[str], limit: Optional[int]):
+    query = db.query(
+        models.Expense.id,
+        models.Expense.title,
+        models.Expense.amount,
+        models.Expense.category,
+        models.Expense.date,
+    ).filter(models.Expense.user_id == user_id, *criteria)
+    return listing.keyset_page(
+        query, models.Expense.date, models.Expense.id, cursor, limit
+    )
+
+
+def list_expenses(db, user_id: int, criteria: list,
+                  cursor: Optional[str], limit: Optional[int]):
+    """One page of expenses and the cursor of the next page, if any."""
+    rows = _expense_list_query(db, user_id, criteria, cursor, limit).all()
+    return listing.split_page(rows, limit)
+
+
+def stream_expenses(db, user_id: int, criteria: list,
+                    cursor: Optional[str], limit: Optional[int]):
+    query = _expense_list_query(db, user_id, criteria, cursor, limit)
+    if limit is not None:
+        query = query.limit(limit)
+    return listing.stream_ndjson(query)
+
+
+class SyncTokenExpired(Exception):
+    """The token predates purged tombstones; the client must sync from scratch."""
+
+
+def list_changes(db, user_id: int, since: Optional[str], limit: int) -> dict:
+    """
+    Expenses created, updated or deleted after the `since` token, in
+    (change_seq, id) order. Without a token this is a full sync of the
+    live rows. Keep calling with `next_token` while `has_more` is true.
+    """
+    expense = models.Expense
+    query = db.query(
+        expense.id,
+        expense.title,
+        expense.amount,
+        expense.category,
+        expense.date,
+        expense.change_seq,
+        expense.deleted_at,
+    ).filter(expense.user_id == user_id)
+
+    if since:
+        seq, row_id = listing.decode_change_token(since)
+        purged_seq = (
+            db.query(models.User.purged_seq).filter(models.User.id == user_id).scalar()
+        )
+        if seq < (purged_seq or 0):
+            raise SyncTokenExpired()
+        query = query.filter(tuple_(expense.change_seq, expense.id) > tuple_(seq, row_id))
+    else:
+        query = query.filter(expense.deleted_at.is_(None))
+
+    rows = query.order_by(expense.change_seq, expense.id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if rows:
+        next_token = listing.encode_change_token(rows[-1].change_seq, rows[-1].id)
+    elif since:
+        next_token = since
+    else:
+        version = httpcache.data_version(db, user_id)
+        next_token = listing.encode_change_token(version, 0)
+
+    return {
+        "upserted": [listing.expense_row_to_dict(row) for row in rows if row.deleted_at is None],
+        "deleted": [row.id for row in rows if row.deleted_at is not None],
+        "next_token": next_token,
+        "has_more": has_more,
+    }
+
+
+def purge_tombstones(db, older_than_days: int = TOMBSTONE_RETENTION_DAYS) -> int:
+    """
+    Drop tombstones older than the retention window. Each affected user's
+    purged_seq is raised so tokens that could have missed them get a 410.
+    """
+    expense = models.Expense
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    purged = (
+        db.query(expense.user_id, func.max(expense.change_seq))
+        .filter(expense.deleted_at.is_not(None), expense.deleted_at < cutoff)
+        .group_by(expense.user_id)
+        .all()
+    )
+    for user_id, max_seq in purged:
+        db.execute(
+            update(models.User)
+            .where(models.User.id == user_id, models.User.purged_seq < max_seq)
+            .values(purged_seq=max_seq)
+        )
+    result = db.execute(
+        delete(expense).where(expense.deleted_at.is_not(None), expense.deleted_at < cutoff)
+    )
+    db.commit()
+    return result.rowcount
+
+
+# ------------------------
+# Admin
+# ------------------------
+# Listings never dump whole tables: they are keyset paginated, project
+# only the requested columns (password hashes are never selectable) and
+# can be streamed as NDJSON.
+
+ADMIN_USER_FIELDS = {
+    "id": models.User.id,
+    "username": models.User.username,
+    "is_admin": models.User.is_admin,
+}
+
+ADMIN_EXPENSE_FIELDS = {
+    "id": models.Expense.id,
+    "user_id": models.Expense.user_id,
+    "title": models.Expense.title,
+    "amount": models.Expense.amount,
+    "category": models.Expense.category,
+    "date": models.Expense.date,
+    "external_id": models.Expense.external_id,
+}
+
+
+def _admin_users_query(db, fields: dict, username: Optional[str]):
+    columns = [column.label(name) for name, column in fields.items()]
+    if "id" not in fields:
+        columns.append(models.User.id.label("id"))
+    query = db.query(*columns)
+    if username:
+        query = query.filter(models.User.username.startswith(username.strip().lower()))
+    return query
+
+
+def _admin_users_page(query, cursor: Optional[str], limit: Optional[int]):
+    if cursor:
+        query = query.filter(models.User.id > listing.decode_id_cursor(cursor))
+    query = query.order_by(models.User.id)
+    return query.limit(limit + 1) if limit is not None else query
+
+
+def _admin_expenses_query(db, fields: dict, criteria: list):
+    columns = [column.label(name) for name, column in fields.items()]
+    for name in ("date", "id"):
+        if name not in fields:
+            columns.append(ADMIN_EXPENSE_FIELDS[name].label(name))
+    return db.query(*columns).filter(*criteria)
+
+
+def _project(row, fields: dict) -> dict:
+    data = listing.row_to_dict(row)
+    return {name: data[name] for name in fields}
+
+
+def list_admin_users(db, fields: dict, username: Optional[str],
+                     cursor: Optional[str], limit: int, count: bool = False) -> dict:
+    query = _admin_users_query(db, fields, username)
+    rows = _admin_users_page(query, cursor, limit).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = listing.encode_id_cursor(rows[-1].id)
+
+    page = {"items": [_project(row, fields) for row in rows], "next_cursor": next_cursor}
+    if count:
+        page["count"], page["count_estimated"] = listing.count_rows(db, query)
+    return page
+
+
+def stream_admin_users(db, fields: dict, username: Optional[str], cursor: Optional[str]):
+    query = _admin_users_page(_admin_users_query(db, fields, username), cursor, None)
+    return listing.stream_ndjson(query, lambda row: _project(row, fields))
+
+
+def list_admin_expenses(db, fields: dict, criteria: list,
+                        cursor: Optional[str], limit: int, count: bool = False) -> dict:
+    query = _admin_expenses_query(db, fields, criteria)
+    expense = models.Expense
+    rows = listing.keyset_page(query, expense.date, expense.id, cursor, limit).all()
+    rows, next_cursor = listing.split_page(rows, limit)
+
+    page = {"items": [_project(row, fields) for row in rows], "next_cursor": next_cursor}
+    if count:
+        page["count"], page["count_estimated"] = listing.count_rows(db, query)
+    return page
+
+
+def stream_admin_expenses(db, fields: dict, criteria: list, cursor: Optional[str]):
+    expense = models.Expense
+    query = listing.keyset_page(
+        _admin_expenses_query(db, fields, criteria), expense.date, expense.id, cursor, None
+    )
+    return listing.stream_ndjson(query, lambda row: _project(row, fields))
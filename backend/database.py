@@ -23,28 +23,394 @@
 #     finally:
 #         db.close()
 
+import asyncio
 import os
+import threading
+import time
+from itertools import islice
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from starlette.concurrency import run_in_threadpool
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
 
-SessionLocal = sessionmaker(
-    autocommit=False,
-    autoflush=False,
-    bind=engine
-)
+def _env_flag(name: str, default: str = "false") -> bool:
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+
+# ------------------------
+# Pool configuration
+# ------------------------
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds, -1 disables
+DB_POOL_PRE_PING = _env_flag("DB_POOL_PRE_PING", "true")
+DB_POOL_USE_LIFO = _env_flag("DB_POOL_USE_LIFO", "true")
+# External pooler (PgBouncer in transaction mode): no app-side pool and no
+# server-side prepared statements, which do not survive connection switching.
+DB_USE_PGBOUNCER = _env_flag("DB_USE_PGBOUNCER")
+# Serve requests through an AsyncSession (asyncpg / aiosqlite) instead of
+# running blocking sessions on the threadpool. Scripts and migrations
+# always use the sync engine.
+DB_ASYNC = _env_flag("DB_ASYNC")
+
+# connections opened in the background after startup; /readyz waits for them
+DB_WARM_CONNECTIONS = int(os.getenv("DB_WARM_CONNECTIONS", "2"))
+DB_WARM_RETRY_SECONDS = float(os.getenv("DB_WARM_RETRY_SECONDS", "2"))
+
+
+# ------------------------
+# Pool metrics
+# ------------------------
+class PoolMetrics:
+    """Checkout counts and time spent waiting for a pooled connection."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.checkins = 0
+            self.timeouts = 0
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def record_checkout(self):
+        with self._lock:
+            self.checkouts += 1
+
+    def record_checkin(self):
+        with self._lock:
+            self.checkins += 1
+
+
+pool_metrics = PoolMetrics()
+
+
+class _InstrumentedPoolMixin:
+    """Records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            timed_out = True
+            raise
+        finally:
+            pool_metrics.record_wait(time.perf_counter() - started, timed_out)
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def _engine_options(url: str, is_async: bool = False) -> dict:
+    if url.startswith("sqlite"):
+        return {"connect_args": {"check_same_thread": False}}
+
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    if DB_USE_PGBOUNCER:
+        options["poolclass"] = NullPool
+        driver = make_url(url).get_dialect().driver
+        if driver == "asyncpg":
+            options["connect_args"] = {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+            }
+        elif driver == "psycopg":
+            # psycopg 3 prepares repeated statements server-side by default
+            options["connect_args"] = {"prepare_threshold": None}
+        return options
+
+    options.update(
+        poolclass=InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_use_lifo=DB_POOL_USE_LIFO,
+    )
+    return options
+
+
+def async_database_url(url: str) -> str:
+    """Swap the sync driver for its asyncio counterpart."""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend == "postgresql":
+        parsed = parsed.set(drivername="postgresql+asyncpg")
+    elif backend == "sqlite":
+        parsed = parsed.set(drivername="sqlite+aiosqlite")
+    return parsed.render_as_string(hide_password=False)
+
+
+# ------------------------
+# Engines
+# ------------------------
+# Built on first use, not at import: importing the app (or a script, or
+# the tests) opens no connection and does not need a reachable database.
+# `from database import engine` (and SessionLocal, async_engine,
+# AsyncSessionLocal) still works through the module __getattr__ below.
+
+_engines = {}
+_engines_lock = threading.RLock()  # _build() of a sessionmaker gets its engine
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_metrics.record_checkout()
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    pool_metrics.record_checkin()
+
+
+def _build(name: str):
+    if name == "engine":
+        built = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
+        if not DB_ASYNC:
+            event.listen(built, "checkout", _on_checkout)
+            event.listen(built, "checkin", _on_checkin)
+        return built
+    if name == "SessionLocal":
+        return sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+    if name == "async_engine":
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        url = async_database_url(DATABASE_URL)
+        built = create_async_engine(url, **_engine_options(url, is_async=True))
+        event.listen(built.sync_engine, "checkout", _on_checkout)
+        event.listen(built.sync_engine, "checkin", _on_checkin)
+        return built
+    if name == "AsyncSessionLocal":
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+
+        # objects are serialized after the session call returns, so nothing
+        # may be lazily reloaded outside the greenlet
+        return async_sessionmaker(get_async_engine(), expire_on_commit=False)
+    raise KeyError(name)
+
+
+def _get(name: str):
+    built = _engines.get(name)
+    if built is None:
+        with _engines_lock:
+            built = _engines.get(name)
+            if built is None:
+                built = _engines[name] = _build(name)
+    return built
+
+
+def get_engine():
+    """The sync engine (scripts, migrations, and requests unless DB_ASYNC)."""
+    return _get("engine")
+
+
+def get_async_engine():
+    return _get("async_engine") if DB_ASYNC else None
+
+
+def session_factory():
+    return _get("SessionLocal")
+
+
+def async_session_factory():
+    return _get("AsyncSessionLocal") if DB_ASYNC else None
+
+
+def __getattr__(name: str):
+    if name in ("engine", "SessionLocal"):
+        return _get(name)
+    if name in ("async_engine", "AsyncSessionLocal"):
+        return _get(name) if DB_ASYNC else None
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _serving_engine():
+    return get_async_engine().sync_engine if DB_ASYNC else get_engine()
+
+
+async def dispose_engines():
+    """Close pooled connections; the engines are rebuilt if used again."""
+    with _engines_lock:
+        built = dict(_engines)
+        _engines.clear()
+    if "async_engine" in built:
+        await built["async_engine"].dispose()
+    if "engine" in built:
+        built["engine"].dispose()
+
+
+class PoolWarmup:
+    """
+    Opens the first pooled connections once the app has started, so the
+    first requests do not pay for connecting (and TLS) to the database.
+    Retries until the database answers.
+    """
+
+    def __init__(self):
+        self.state = "idle"   # idle -> warming -> ready
+        self.connections = 0
+        self.attempts = 0
+        self.seconds = None
+        self.error = None
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "connections": self.connections,
+            "attempts": self.attempts,
+            "seconds": self.seconds,
+            "error": self.error,
+        }
+
+    def _open_sync(self, count: int):
+        opened = []
+        try:
+            for _ in range(count):
+                opened.append(get_engine().connect())
+                opened[-1].exec_driver_sql("SELECT 1")
+        finally:
+            for connection in opened:
+                connection.close()
+
+    async def _open_async(self, count: int):
+        opened = []
+        try:
+            for _ in range(count):
+                opened.append(await get_async_engine().connect())
+                await opened[-1].exec_driver_sql("SELECT 1")
+        finally:
+            for connection in opened:
+                await connection.close()
+
+    async def run(self, count: int = None, retry_seconds: float = None):
+        count = DB_WARM_CONNECTIONS if count is None else count
+        retry_seconds = DB_WARM_RETRY_SECONDS if retry_seconds is None else retry_seconds
+        self.state = "warming"
+        started = time.perf_counter()
+        while True:
+            self.attempts += 1
+            try:
+                if DB_ASYNC:
+                    await self._open_async(count)
+                else:
+                    await run_in_threadpool(self._open_sync, count)
+                break
+            except Exception as exc:
+                self.error = f"{exc.__class__.__name__}: {exc}"
+                await asyncio.sleep(retry_seconds)
+        self.connections = count
+        self.error = None
+        self.seconds = round(time.perf_counter() - started, 6)
+        self.state = "ready"
+
+
+pool_warmup = PoolWarmup()
+
+
+def pool_stats() -> dict:
+    pool = _serving_engine().pool
+    stats = {
+        "pool": type(pool).__name__,
+        "async": DB_ASYNC,
+        "checkouts": pool_metrics.checkouts,
+        "checkins": pool_metrics.checkins,
+        "timeouts": pool_metrics.timeouts,
+        "wait_seconds_total": round(pool_metrics.wait_seconds_total, 6),
+        "wait_seconds_max": round(pool_metrics.wait_seconds_max, 6),
+    }
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            idle=pool.checkedin(),
+        )
+    return stats
+
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
+def get_sync_db():
+    """
+    A Session checks out a connection on its first query, not when it is
+    created, so routes that never query (or that are served from cache)
+    never take a connection from the pool.
+    """
+    db = session_factory()()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with async_session_factory()() as db:
+        yield db
+
+
+get_db = get_async_db if DB_ASYNC else get_sync_db
+
+
+# ------------------------
+# Running DB work from async routes
+# ------------------------
+# Route logic is written once against a sync Session. In async mode it
+# runs inside AsyncSession.run_sync, where every query is awaited on the
+# event loop. Otherwise it runs on the threadpool like a sync route.
+
+STREAM_PULL_SIZE = 500
+
+
+async def run_db(db, fn, *args, **kwargs):
+    """Call fn(session, *args, **kwargs) in the way the session needs."""
+    if isinstance(db, Session):
+        return await run_in_threadpool(fn, db, *args, **kwargs)
+    return await db.run_sync(fn, *args, **kwargs)
+
+
+def stream_db(db, fn, *args):
+    """
+    Iterate fn(session, *args) for a StreamingResponse.
+    Sync sessions return the iterator as is (Starlette drains it on the
+    threadpool). Async sessions pull it in batches inside run_sync.
+    """
+    if isinstance(db, Session):
+        return fn(db, *args)
+
+    async def pull_batches():
+        iterator = None
+
+        def pull(session):
+            nonlocal iterator
+            if iterator is None:
+                iterator = iter(fn(session, *args))
+            return list(islice(iterator, STREAM_PULL_SIZE))
+
+        while batch := await db.run_sync(pull):
+            for item in batch:
+                yield item
+
+    return pull_batches()
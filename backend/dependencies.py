@@ -1,15 +1,18 @@
-from fastapi import Depends, HTTPException, Request
+from datetime import date
+from fastapi import Depends, HTTPException, Request, Response
 from jose import jwt, JWTError
 from sqlalchemy.orm import Session
-from database import get_db
+from database import get_db, run_db
+import httpcache
 import models
-from models import User
+import principals
+from principals import Principal
 from auth import SECRET_KEY, ALGORITHM
 
-def get_current_user(
+async def get_current_user(
     request: Request,
     db: Session = Depends(get_db)
-):
+) -> Principal:
     token = request.cookies.get("access_token")
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
@@ -17,22 +20,78 @@ def get_current_user(
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id = int(payload.get("sub"))
+        token_version = int(payload.get("ver", 0))
+        issued_at = float(payload.get("iat", 0))
     except (JWTError, TypeError, ValueError):
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user:
+    if principals.CACHE_ENABLED:
+        change = principals.last_change(user_id)
+        if change is not None and token_version < change["token_version"]:
+            raise HTTPException(status_code=401, detail="Token revoked")
+        if "usr" in payload and "adm" in payload and (change is None or issued_at > change["at"]):
+            # the claims are current: no cache or DB lookup at all
+            return Principal(user_id, payload["usr"], payload["adm"], token_version)
+
+        # cache hit: no query, and the session never checks out a connection
+        principal = principals.get(user_id, token_version)
+        if principal is not None:
+            return principal
+
+    principal = await run_db(db, principals.load, user_id)
+    if not principal:
         raise HTTPException(status_code=401, detail="User not found")
+    if principal.token_version != token_version:
+        raise HTTPException(status_code=401, detail="Token revoked")
 
-    return user
+    if principals.CACHE_ENABLED:
+        principals.put(principal)
+    return principal
 
 
 def get_admin_user(
-    current_user:User=Depends(get_current_user)
-):
+    current_user: Principal = Depends(get_current_user)
+) -> Principal:
     if not current_user.is_admin:
         raise HTTPException(
             status_code=403,
             detail="Admin access required"
         )
-    return current_user
\ No newline at end of file
+    return current_user
+
+
+async def validate_user_data(
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+) -> httpcache.Validator:
+    """
+    Conditional GET on the user's data version: answers 304 when the
+    client's ETag is current, else sets ETag on the response.
+    """
+    return await _validate(request, response, db, current_user, httpcache.resource_key(request))
+
+
+def request_date() -> date:
+    """Today, read once per request: FastAPI caches a dependency's value per request."""
+    return date.today()
+
+
+async def validate_user_data_daily(
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+    today: date = Depends(request_date)
+) -> httpcache.Validator:
+    """validate_user_data for responses that also depend on today's date."""
+    resource = f"{httpcache.resource_key(request)}#{today.isoformat()}"
+    return await _validate(request, response, db, current_user, resource)
+
+
+async def _validate(request, response, db, current_user, resource: str) -> httpcache.Validator:
+    version = await run_db(db, httpcache.data_version, current_user.id)
+    validator = httpcache.Validator(current_user.id, version, resource)
+    httpcache.check_etag(request, response, validator.etag)
+    return validator
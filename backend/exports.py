@@ -0,0 +1,138 @@
+"""
+Server-side expense exports.
+
+Rows are read from a server-side cursor (`yield_per`) and written straight
+into the output: CSV is yielded in chunks, XLSX is built by openpyxl's
+write-only workbook, which spools worksheet rows to disk. Memory use does
+not grow with the number of exported rows.
+
+Only CSV streams, though. An XLSX file is a zip whose parts openpyxl writes
+when the workbook is saved, after the last row, so its first byte is sent
+only once the whole export has been read and the file assembled in a
+temporary file: time to first byte grows with the export. Large XLSX
+exports belong in a background job (POST /expenses/export).
+
+Months moved to Parquet by archive.py are read back and merged in, so an
+export covers the user's whole history in date order.
+
+`progress`, when given, is called with the number of rows written so far
+after every BATCH_SIZE rows; background export jobs report it.
+
+The XLSX layout mirrors the report the frontend used to build in the
+browser: an "Expenses" sheet and a "Summary" sheet with category totals.
+"""
+
+import csv
+import heapq
+import io
+import tempfile
+from datetime import timedelta
+
+from sqlalchemy import func
+
+import archive
+import listing
+import models
+import money
+
+BATCH_SIZE = 1000
+FILE_CHUNK_SIZE = 64 * 1024
+
+EXPENSE_HEADERS = ["Title", "Amount", "Category", "Date"]
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def _expense_rows(db, user_id, date_from, date_to, progress=None):
+    expense = models.Expense
+    live = (
+        db.query(expense.id, expense.title, expense.amount, expense.category, expense.date)
+        .filter(expense.user_id == user_id, *listing.expense_filters(date_from, date_to))
+        .order_by(expense.date, expense.id)
+        .yield_per(BATCH_SIZE)
+    )
+    end = date_to + timedelta(days=1) if date_to else None
+    archived = archive.iter_expenses(db, user_id, date_from, end)
+    rows = heapq.merge(archived, live, key=lambda row: (row.date, row.id))
+    if progress is None:
+        return rows
+    return _counted(rows, progress)
+
+
+def _counted(rows, progress):
+    count = 0
+    for count, row in enumerate(rows, start=1):
+        yield row
+        if count % BATCH_SIZE == 0:
+            progress(count)
+    progress(count)
+
+
+def _category_totals(db, user_id, date_from, date_to):
+    end = date_to + timedelta(days=1) if date_to else None
+    daily = archive.daily_totals(user_id, date_from, end)
+    return (
+        db.query(daily.c.category, func.sum(daily.c.total_cents))
+        .group_by(daily.c.category)
+        .order_by(daily.c.category)
+        .all()
+    )
+
+
+def iter_csv(db, user_id, date_from=None, date_to=None, progress=None):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPENSE_HEADERS)
+
+    for count, row in enumerate(_expense_rows(db, user_id, date_from, date_to, progress), start=1):
+        writer.writerow([row.title, row.amount, row.category, row.date.isoformat()])
+        if count % BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_xlsx(db, user_id, date_from=None, date_to=None, progress=None):
+    """Yields the saved file in chunks; nothing comes out before the last row is read."""
+    # openpyxl takes a quarter of a second to import; only XLSX exports need it
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+
+    expenses_sheet = workbook.create_sheet("Expenses")
+    for column, width in zip("ABCD", (25, 15, 18, 15)):
+        expenses_sheet.column_dimensions[column].width = width
+    expenses_sheet.append(["EXPENSE TRACKER REPORT"])
+    expenses_sheet.append(EXPENSE_HEADERS)
+    for row in _expense_rows(db, user_id, date_from, date_to, progress):
+        expenses_sheet.append([row.title, row.amount, row.category, row.date])
+
+    totals = _category_totals(db, user_id, date_from, date_to)
+    summary_sheet = workbook.create_sheet("Summary")
+    summary_sheet.column_dimensions["A"].width = 20
+    summary_sheet.column_dimensions["B"].width = 18
+    summary_sheet.append(["SUMMARY"])
+    summary_sheet.append([])
+    summary_sheet.append(["Total Expense", money.to_float(sum(total or 0 for _, total in totals))])
+    summary_sheet.append([])
+    summary_sheet.append(["Category", "Total Amount"])
+    for category, total in totals:
+        summary_sheet.append([category, money.to_float(total)])
+
+    with tempfile.TemporaryFile() as output:
+        workbook.save(output)
+        output.seek(0)
+        while chunk := output.read(FILE_CHUNK_SIZE):
+            yield chunk
+
+
+def iter_export(db, output_format: str, user_id: int, date_from=None, date_to=None, progress=None):
+    if output_format == "xlsx":
+        return iter_xlsx(db, user_id, date_from, date_to, progress)
+    return iter_csv(db, user_id, date_from, date_to, progress)
@@ -0,0 +1,116 @@
+"""
+Conditional GETs for per-user resources.
+
+Every user has a `data_version` counter that expense writes bump in the
+same transaction. A list or summary response is fully determined by
+(user, data_version, path and query), so that triple is hashed into a
+strong ETag. A request whose If-None-Match still matches is answered with
+304 after reading one column of the users row; the expense table is
+never touched.
+
+Hot summary payloads can also be kept in an in-process cache keyed the
+same way. A write bumps the version, so stale entries are never read and
+simply age out. RESPONSE_CACHE_SIZE=0 turns the cache off.
+"""
+
+import hashlib
+import os
+from typing import Optional
+
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import update
+
+import models
+from principals import MemoryBackend
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "300"))
+
+# stored by the browser but revalidated on every use
+CACHE_CONTROL = "private, no-cache"
+
+
+# ------------------------
+# Data versions
+# ------------------------
+
+def bump_data_version(db, user_id: int) -> int:
+    """
+    Call inside every transaction that changes a user's expenses. Returns
+    the new version, which also stamps the changed rows' change_seq. The
+    row lock taken here orders concurrent writers of the same user.
+    """
+    return db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(data_version=models.User.data_version + 1)
+        .returning(models.User.data_version)
+    ).scalar_one()
+
+
+def data_version(db, user_id: int) -> int:
+    version = db.query(models.User.data_version).filter(models.User.id == user_id).scalar()
+    return version or 0
+
+
+# ------------------------
+# ETags
+# ------------------------
+
+def resource_key(request: Request) -> str:
+    """Path plus query with parameters sorted, so ?a=1&b=2 and ?b=2&a=1 match."""
+    query = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    return f"{request.url.path}?{query}"
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode("utf-8"))
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag in candidates
+
+
+def check_etag(request: Request, response: Response, etag: str):
+    """Set validator headers, and short-circuit with 304 when the client is current."""
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request, etag):
+        raise HTTPException(status_code=304, headers=headers)
+    response.headers.update(headers)
+
+
+class Validator:
+    """The version a request was validated against; keys the response cache."""
+
+    __slots__ = ("user_id", "version", "resource", "etag")
+
+    def __init__(self, user_id: int, version: int, resource: str):
+        self.user_id = user_id
+        self.version = version
+        self.resource = resource
+        self.etag = make_etag(user_id, version, resource)
+
+    async def cached(self, compute):
+        """Return the cached payload for this version, or await compute() and store it."""
+        if responses is None:
+            return await compute()
+        key = f"response:{self.user_id}:{self.version}:{self.resource}"
+        payload = responses.get(key)
+        if payload is None:
+            payload = await compute()
+            responses.set(key, payload)
+        return payload
+
+
+responses: Optional[MemoryBackend] = (
+    MemoryBackend(max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+    if RESPONSE_CACHE_SIZE > 0 else None
+)
@@ -0,0 +1,347 @@
+"""
+Per-request performance instrumentation.
+
+`InstrumentationMiddleware` opens a `RequestMetrics` for every HTTP request
+and keeps it in a context variable, which follows the request onto the
+threadpool and into AsyncSession.run_sync. SQLAlchemy cursor events (on
+every Engine) add each statement's duration to it, and `TimedRoute` times
+the endpoint function itself. When the response starts, the totals are
+appended to its `Server-Timing` header:
+
+    app     everything from the request arriving to the response starting
+    handler the endpoint function (DB work included)
+    ser     response-model validation and encoding after the handler returned
+    db      time inside the database driver, with the statement count
+
+Totals per route are kept for GET /metrics (Prometheus text format).
+
+Statements slower than SLOW_QUERY_MS are logged to the
+`expense_tracker.slow_queries` logger (and SLOW_QUERY_LOG, if set). When one
+request runs the same statement shape more than N_PLUS_ONE_THRESHOLD times,
+a likely N+1 is logged to `expense_tracker.n_plus_one`.
+"""
+
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Optional
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+INSTRUMENTATION = os.getenv("INSTRUMENTATION", "1") != "0"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG")
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+# when set, /metrics requires "Authorization: Bearer <token>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_query_logger = logging.getLogger("expense_tracker.slow_queries")
+n_plus_one_logger = logging.getLogger("expense_tracker.n_plus_one")
+if SLOW_QUERY_LOG:
+    _handler = logging.FileHandler(SLOW_QUERY_LOG)
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    slow_query_logger.addHandler(_handler)
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+# bind parameters collapse to one placeholder, so IN lists of any length
+# and every driver's paramstyle give the same shape
+_PLACEHOLDER = r"(?:\?|%\(\w+\)s|%s|\$\d+|:\w+)"
+_IN_LIST = re.compile(rf"\(\s*{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    return _WHITESPACE.sub(" ", _IN_LIST.sub("(?)", statement)).strip()
+
+
+class RequestMetrics:
+    """What one request spent, filled in by the hooks below."""
+
+    __slots__ = (
+        "started", "path", "route", "queries", "db_seconds", "handler_seconds",
+        "handler_finished", "shapes", "_lock",
+    )
+
+    def __init__(self, path: str = None):
+        self.started = time.perf_counter()
+        self.path = path
+        self.route = None
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.handler_seconds = 0.0
+        self.handler_finished = None
+        self.shapes = Counter()
+        self._lock = threading.Lock()
+
+    def record_query(self, statement: str, seconds: float):
+        with self._lock:
+            self.queries += 1
+            self.db_seconds += seconds
+            self.shapes[statement_shape(statement)] += 1
+
+    def repeated_statements(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> list:
+        """(shape, count) for statements run more than `threshold` times."""
+        return [(shape, count) for shape, count in self.shapes.items() if count > threshold]
+
+    def server_timing(self, now: float) -> str:
+        parts = [f"app;dur={(now - self.started) * 1000:.1f}"]
+        if self.handler_finished is not None:
+            parts.append(f"handler;dur={self.handler_seconds * 1000:.1f}")
+            parts.append(f"ser;dur={(now - self.handler_finished) * 1000:.1f}")
+        parts.append(f'db;dur={self.db_seconds * 1000:.1f};desc="{self.queries} queries"')
+        return ", ".join(parts)
+
+
+def current() -> Optional[RequestMetrics]:
+    return _current.get()
+
+
+# ------------------------
+# SQLAlchemy hooks
+# ------------------------
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._instrumentation_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_instrumentation_started", None)
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.record_query(statement, seconds)
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        registry.slow_queries.inc()
+        slow_query_logger.warning(
+            "slow query %.1fms path=%s: %s",
+            seconds * 1000,
+            metrics.path if metrics is not None else "-",
+            _WHITESPACE.sub(" ", statement)[:2000],
+        )
+
+
+# ------------------------
+# Endpoint timing
+# ------------------------
+
+def _handler_done(started: float):
+    metrics = _current.get()
+    if metrics is not None:
+        finished = time.perf_counter()
+        metrics.handler_seconds += finished - started
+        metrics.handler_finished = finished
+
+
+def _timed_endpoint(endpoint):
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _handler_done(started)
+    else:
+        @functools.wraps(endpoint)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                _handler_done(started)
+    return timed
+
+
+class TimedRoute(APIRoute):
+    """APIRoute whose endpoint call is timed apart from dependencies and serialization."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if INSTRUMENTATION:
+            endpoint = _timed_endpoint(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+# ------------------------
+# Prometheus registry
+# ------------------------
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict) -> str:
+    inner = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return "{" + inner + "}"
+
+
+class _Total:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Registry:
+    """Just enough of a Prometheus client for the metrics below."""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = defaultdict(int)           # (method, route, status)
+            self.route_totals = defaultdict(lambda: defaultdict(float))
+            self.histograms = defaultdict(lambda: [0] * (len(self.buckets) + 1))
+            self.histogram_sums = defaultdict(float)
+            self.n_plus_one = defaultdict(int)
+        self.slow_queries = _Total()
+
+    def observe(self, method: str, route: str, status: int, seconds: float, metrics: RequestMetrics,
+                suspects: int):
+        with self._lock:
+            self.requests[(method, route, status)] += 1
+            totals = self.route_totals[(method, route)]
+            totals["db_queries"] += metrics.queries
+            totals["db_seconds"] += metrics.db_seconds
+            totals["handler_seconds"] += metrics.handler_seconds
+            counts = self.histograms[(method, route)]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self.histogram_sums[(method, route)] += seconds
+            if suspects:
+                self.n_plus_one[(method, route)] += suspects
+
+    def render(self, extra_gauges: dict = None) -> str:
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            header("http_requests_total", "counter", "Requests by method, route and status.")
+            for (method, route, status), value in sorted(self.requests.items()):
+                lines.append(f"http_requests_total{_labels({'method': method, 'route': route, 'status': status})} {value}")
+
+            header("http_request_duration_seconds", "histogram", "Time until the response finished.")
+            for (method, route), counts in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip((*self.buckets, "+Inf"), counts):
+                    cumulative += count
+                    labels = _labels({"method": method, "route": route, "le": bound})
+                    lines.append(f"http_request_duration_seconds_bucket{labels} {cumulative}")
+                labels = _labels({"method": method, "route": route})
+                lines.append(f"http_request_duration_seconds_sum{labels} {self.histogram_sums[(method, route)]:.6f}")
+                lines.append(f"http_request_duration_seconds_count{labels} {cumulative}")
+
+            for metric, help_text in (
+                ("db_queries", "SQL statements run while serving the route."),
+                ("db_seconds", "Time spent in the database driver."),
+                ("handler_seconds", "Time spent in endpoint functions."),
+            ):
+                header(f"http_{metric}_total", "counter", help_text)
+                for (method, route), totals in sorted(self.route_totals.items()):
+                    labels = _labels({"method": method, "route": route})
+                    lines.append(f"http_{metric}_total{labels} {totals[metric]:.6f}")
+
+            header("http_n_plus_one_total", "counter", "Statement shapes repeated past the N+1 threshold.")
+            for (method, route), value in sorted(self.n_plus_one.items()):
+                lines.append(f"http_n_plus_one_total{_labels({'method': method, 'route': route})} {value}")
+
+        header("db_slow_queries_total", "counter", f"Statements slower than {SLOW_QUERY_MS:g}ms.")
+        lines.append(f"db_slow_queries_total {self.slow_queries.value:g}")
+
+        for name, value in (extra_gauges or {}).items():
+            header(name, "gauge", name.replace("_", " ") + ".")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def pool_gauges(stats: dict) -> dict:
+    """Numeric database.pool_stats() values as db_pool_* gauges."""
+    return {
+        f"db_pool_{key}": float(value)
+        for key, value in stats.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    }
+
+
+# ------------------------
+# Middleware
+# ------------------------
+
+class InstrumentationMiddleware:
+    """Pure ASGI middleware, so streamed bodies pass through untouched."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not INSTRUMENTATION:
+            await self.app(scope, receive, send)
+            return
+
+        metrics = RequestMetrics(scope.get("path"))
+        token = _current.set(metrics)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timing = metrics.server_timing(time.perf_counter()).encode("latin-1")
+                headers = list(message.get("headers", []))
+                for i, (name, value) in enumerate(headers):
+                    if name.lower() == b"server-timing":
+                        headers[i] = (name, value + b", " + timing)
+                        break
+                else:
+                    headers.append((b"server-timing", timing))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            route = scope.get("route")
+            metrics.route = getattr(route, "path", "unmatched")
+            suspects = metrics.repeated_statements()
+            for shape, count in suspects:
+                n_plus_one_logger.warning(
+                    "possible N+1 on %s %s: statement ran %d times: %s",
+                    scope["method"], metrics.route, count, shape[:500],
+                )
+            registry.observe(
+                scope["method"], metrics.route, status,
+                time.perf_counter() - metrics.started, metrics, len(suspects),
+            )
@@ -0,0 +1,574 @@
+"""
+Background jobs for work too slow to do inside a request.
+
+A route enqueues a job (a row in `jobs`) and answers 202 with its id.
+The client polls GET /jobs/{id} for status and progress, then fetches
+GET /jobs/{id}/result once it has succeeded. The request holds neither a
+worker thread nor a DB connection while the work runs.
+
+Tasks are plain functions registered with @task(name). Each is called as
+fn(db, ctx, user_id, **params) with its own Session and a JobContext,
+and returns a JSON-able result. Files (exports) go to ctx.path(); only
+their name is stored. Where jobs run is up to the broker (JOBS_BROKER):
+
+    local     (default) a pool inside the API process: processes, or
+              threads with JOBS_EXECUTOR=thread
+    database  jobs stay queued in the table and worker processes claim
+              them, so the API and the workers scale separately:
+
+                  python jobs.py              # poll every JOBS_POLL_SECONDS
+                  python jobs.py --once       # run what is due and exit
+
+              JOBS_RESULT_DIR must then be shared by API and workers.
+
+A failed attempt is retried after an exponential backoff, up to the
+task's max_attempts. A task raises JobFailed to fail without retrying.
+A job past its timeout fails at its next progress report. A running job
+whose worker died is re-queued (or failed) once it is past its timeout
+(reap_stale). Workers of the database broker do that as they poll. The
+local broker does it every JOBS_RECOVER_SECONDS once the API has
+started, and also hands its pool any queued job that no pool is running:
+jobs left behind when the API restarted.
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+import archive
+import bulk
+import exports
+import httpcache
+import ledger
+import models
+import summaries
+
+JOBS_BROKER = os.getenv("JOBS_BROKER", "local")
+JOBS_EXECUTOR = os.getenv("JOBS_EXECUTOR", "process")
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+JOBS_POLL_SECONDS = float(os.getenv("JOBS_POLL_SECONDS", "1"))
+JOBS_RESULT_DIR = os.getenv(
+    "JOBS_RESULT_DIR", os.path.join(tempfile.gettempdir(), "expense_tracker_jobs")
+)
+JOB_TIMEOUT_SECONDS = int(os.getenv("JOB_TIMEOUT_SECONDS", "900"))
+# bulk bodies larger than this are imported as a job even without ?background=true
+BULK_INLINE_MAX_BYTES = int(os.getenv("JOBS_BULK_INLINE_MAX_BYTES", str(8 * 1024 * 1024)))
+RETRY_BASE_SECONDS = 2.0
+PROGRESS_INTERVAL_SECONDS = 0.5
+REAP_GRACE_SECONDS = 60
+JOBS_RECOVER_SECONDS = float(os.getenv("JOBS_RECOVER_SECONDS", "60"))
+
+logger = logging.getLogger("expense_tracker.jobs")
+
+Task = namedtuple("Task", "fn max_attempts timeout")
+TASKS = {}
+
+
+def task(name: str, max_attempts: int = 3, timeout: int = JOB_TIMEOUT_SECONDS):
+    def register(fn):
+        TASKS[name] = Task(fn, max_attempts, timeout)
+        return fn
+    return register
+
+
+class JobFailed(Exception):
+    """Raised by a task to fail its job without further attempts."""
+
+
+class JobTimeout(JobFailed):
+    pass
+
+
+def result_path(name: str) -> str:
+    return os.path.join(JOBS_RESULT_DIR, name)
+
+
+class JobContext:
+    """What a running task gets besides its Session."""
+
+    def __init__(self, session_factory, job_id: str, deadline: float):
+        self.session_factory = session_factory
+        self.job_id = job_id
+        self.deadline = deadline
+        self._reported_at = 0.0
+        self._report = True
+
+    def progress(self, done, total=None):
+        """
+        Record progress as done/total (or `done` as a fraction) and enforce
+        the job's timeout. Written on its own connection, at most every
+        PROGRESS_INTERVAL_SECONDS; a failed write only stops later reports.
+        """
+        now = time.monotonic()
+        if now > self.deadline:
+            raise JobTimeout("Job timed out")
+        if not self._report or now - self._reported_at < PROGRESS_INTERVAL_SECONDS:
+            return
+        self._reported_at = now
+        fraction = done if total is None else (done / total if total else 1.0)
+        job = models.Job
+        try:
+            with self.session_factory() as db:
+                db.execute(
+                    update(job)
+                    .where(job.id == self.job_id, job.status == "running")
+                    .values(progress=round(min(max(fraction, 0.0), 1.0), 4))
+                )
+                db.commit()
+        except SQLAlchemyError:
+            logger.warning("job %s: progress could not be recorded", self.job_id, exc_info=True)
+            self._report = False
+
+    def path(self, suffix: str) -> str:
+        """Where to write a result file; return os.path.basename of it in the result."""
+        os.makedirs(JOBS_RESULT_DIR, exist_ok=True)
+        return result_path(f"{self.job_id}{suffix}")
+
+
+# ------------------------
+# Queue
+# ------------------------
+
+def describe(job: models.Job) -> dict:
+    payload = {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": job.progress,
+        "attempts": job.attempts,
+        "error": job.error,
+        "created_at": job.created_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "url": f"/jobs/{job.id}",
+    }
+    if job.status == "succeeded":
+        payload["result_url"] = f"/jobs/{job.id}/result"
+    return payload
+
+
+def enqueue(db, user_id: int, kind: str, params: Optional[dict] = None) -> dict:
+    spec = TASKS[kind]
+    job = models.Job(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        kind=kind,
+        params=params or {},
+        status="queued",
+        progress=0.0,
+        attempts=0,
+        max_attempts=spec.max_attempts,
+        timeout_seconds=spec.timeout,
+        created_at=datetime.utcnow(),
+        run_after=datetime.utcnow(),
+    )
+    db.add(job)
+    payload = describe(job)
+    db.commit()
+    get_broker().submit(job.id)
+    return payload
+
+
+def get_job(db, user_id: int, job_id: str) -> Optional[models.Job]:
+    job = db.get(models.Job, job_id)
+    if job is None or job.user_id != user_id:
+        return None
+    return job
+
+
+async def spool_body(chunks) -> str:
+    """Save a request body for a job; returns the file name under JOBS_RESULT_DIR."""
+    os.makedirs(JOBS_RESULT_DIR, exist_ok=True)
+    name = f"{uuid.uuid4().hex}.body"
+    with open(result_path(name), "wb") as fh:
+        async for chunk in chunks:
+            fh.write(chunk)
+    return name
+
+
+# ------------------------
+# Running
+# ------------------------
+
+def _claim(db, job_id: str):
+    """Move a queued job to running; None if another worker got it first."""
+    job = models.Job
+    claimed = db.execute(
+        update(job)
+        .where(job.id == job_id, job.status == "queued")
+        .values(
+            status="running",
+            attempts=job.attempts + 1,
+            progress=0.0,
+            started_at=datetime.utcnow(),
+        )
+        .returning(job.kind, job.params, job.user_id, job.attempts, job.max_attempts, job.timeout_seconds)
+    ).first()
+    db.commit()
+    return claimed
+
+
+def _finish(db, job_id: str, **values):
+    job = models.Job
+    db.execute(update(job).where(job.id == job_id).values(**values))
+    db.commit()
+
+
+def _finish_unless_done(db, job_id: str, **values):
+    job = models.Job
+    db.execute(
+        update(job)
+        .where(job.id == job_id, job.status.in_(("queued", "running")))
+        .values(**values)
+    )
+    db.commit()
+
+
+def run_job(session_factory, job_id: str) -> Optional[float]:
+    """
+    Run one attempt of a queued job. Returns the number of seconds after
+    which a retry is due, or None when the job is done with.
+    """
+    with session_factory() as db:
+        claimed = _claim(db, job_id)
+        if claimed is None:
+            return None
+        spec = TASKS.get(claimed.kind)
+        ctx = JobContext(session_factory, job_id, time.monotonic() + claimed.timeout_seconds)
+        try:
+            if spec is None:
+                raise JobFailed(f"Unknown job kind {claimed.kind!r}")
+            result = spec.fn(db, ctx, claimed.user_id, **claimed.params)
+        except Exception as exc:
+            db.rollback()
+            error = str(exc) or exc.__class__.__name__
+            if isinstance(exc, JobFailed) or claimed.attempts >= claimed.max_attempts:
+                logger.warning("job %s (%s) failed: %s", job_id, claimed.kind, error, exc_info=not isinstance(exc, JobFailed))
+                _finish(db, job_id, status="failed", error=error, finished_at=datetime.utcnow())
+                return None
+            delay = RETRY_BASE_SECONDS * 2 ** (claimed.attempts - 1)
+            logger.warning("job %s (%s) attempt %s failed, retrying in %ss", job_id, claimed.kind, claimed.attempts, delay, exc_info=True)
+            _finish(db, job_id, status="queued", error=error, run_after=datetime.utcnow() + timedelta(seconds=delay))
+            return delay
+
+        _finish(
+            db, job_id,
+            status="succeeded", progress=1.0, result=result, error=None, finished_at=datetime.utcnow(),
+        )
+        return None
+
+
+def next_due(db) -> Optional[str]:
+    job = models.Job
+    job_id = db.execute(
+        select(job.id)
+        .where(job.status == "queued", job.run_after <= datetime.utcnow())
+        .order_by(job.run_after, job.created_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).scalar()
+    db.rollback()
+    return job_id
+
+
+def reap_stale(db) -> int:
+    """Re-queue (or fail) running jobs well past their timeout: their worker is gone."""
+    job = models.Job
+    now = datetime.utcnow()
+    stale = [
+        row for row in db.execute(
+            select(job.id, job.started_at, job.timeout_seconds, job.attempts, job.max_attempts)
+            .where(job.status == "running")
+        )
+        if row.started_at + timedelta(seconds=row.timeout_seconds + REAP_GRACE_SECONDS) < now
+    ]
+    for row in stale:
+        values = (
+            {"status": "queued", "run_after": now}
+            if row.attempts < row.max_attempts
+            else {"status": "failed", "finished_at": now}
+        )
+        db.execute(
+            update(job)
+            .where(job.id == row.id, job.status == "running")
+            .values(error="Worker lost", **values)
+        )
+    db.commit()
+    return len(stale)
+
+
+# ------------------------
+# Brokers
+# ------------------------
+
+def _run_in_worker(job_id: str) -> Optional[float]:
+    from database import SessionLocal
+
+    return run_job(SessionLocal, job_id)
+
+
+class LocalBroker:
+    """Runs jobs in a pool inside this process; retries are timers."""
+
+    def __init__(self, executor: str = JOBS_EXECUTOR, workers: int = JOBS_WORKERS, session_factory=None):
+        self.executor = executor
+        self.workers = workers
+        self.session_factory = session_factory
+        self._pool = None
+        self._lock = threading.Lock()
+        # submitted here and not finished yet, including retries on a timer
+        self._pending = set()
+        self._stopped = threading.Event()
+        self._recovery = None
+
+    def _sessions(self):
+        from database import SessionLocal
+
+        return self.session_factory or SessionLocal
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                if self.executor == "thread":
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+                else:
+                    # spawn: forking a process that runs an event loop and
+                    # pooled connections is not safe
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+            return self._pool
+
+    def submit(self, job_id: str, delay: float = 0):
+        with self._lock:
+            self._pending.add(job_id)
+        if delay > 0:
+            timer = threading.Timer(delay, self.submit, (job_id,))
+            timer.daemon = True
+            timer.start()
+            return
+        if self.executor == "thread":
+            future = self._get_pool().submit(run_job, self._sessions(), job_id)
+        else:
+            future = self._get_pool().submit(_run_in_worker, job_id)
+        future.add_done_callback(lambda done: self._done(job_id, done))
+
+    def _done(self, job_id: str, future):
+        try:
+            delay = future.result()
+        except Exception as exc:
+            logger.error("job %s could not be run", job_id, exc_info=True)
+            if isinstance(exc, BrokenProcessPool):
+                with self._lock:
+                    self._pool = None
+            self._abandon(job_id)
+            return
+        if delay is not None:
+            self.submit(job_id, delay)
+            return
+        with self._lock:
+            self._pending.discard(job_id)
+
+    def _abandon(self, job_id: str):
+        with self._lock:
+            self._pending.discard(job_id)
+        with self._sessions()() as db:
+            _finish_unless_done(db, job_id, status="failed", error="Worker lost", finished_at=datetime.utcnow())
+
+    def recover(self) -> int:
+        """
+        Reap stale running jobs, then submit every queued job this broker is
+        not already running (left by an earlier run of the API). Returns how
+        many were submitted.
+        """
+        job = models.Job
+        with self._sessions()() as db:
+            reap_stale(db)
+            queued = db.execute(select(job.id, job.run_after).where(job.status == "queued")).all()
+            db.rollback()
+        with self._lock:
+            queued = [row for row in queued if row.id not in self._pending]
+        now = datetime.utcnow()
+        for row in queued:
+            self.submit(row.id, max(0.0, (row.run_after - now).total_seconds()))
+        return len(queued)
+
+    def _recover_forever(self, interval: float):
+        while not self._stopped.is_set():
+            try:
+                recovered = self.recover()
+                if recovered:
+                    logger.info("resubmitted %s queued jobs", recovered)
+            except SQLAlchemyError:
+                logger.warning("job recovery failed", exc_info=True)
+            self._stopped.wait(interval)
+
+    def start(self, interval: float = JOBS_RECOVER_SECONDS):
+        """Recover left-behind jobs now and every `interval` seconds until shutdown."""
+        with self._lock:
+            if self._recovery is not None:
+                return
+            self._stopped.clear()
+            self._recovery = threading.Thread(
+                target=self._recover_forever, args=(interval,), name="job-recovery", daemon=True
+            )
+        self._recovery.start()
+
+    def shutdown(self, wait: bool = True):
+        self._stopped.set()
+        with self._lock:
+            self._recovery = None
+            if self._pool is not None:
+                self._pool.shutdown(wait=wait)
+                self._pool = None
+
+
+class DatabaseBroker:
+    """Leaves jobs queued in the table for `python jobs.py` workers."""
+
+    def submit(self, job_id: str, delay: float = 0):
+        pass
+
+    def start(self):
+        pass
+
+    def shutdown(self, wait: bool = True):
+        pass
+
+
+BROKERS = {
+    "local": LocalBroker,
+    "database": DatabaseBroker,
+}
+
+broker = None
+
+
+def get_broker():
+    global broker
+    if broker is None:
+        broker = BROKERS[JOBS_BROKER]()
+    return broker
+
+
+# ------------------------
+# Tasks
+# ------------------------
+
+@task("export")
+def export_expenses(db, ctx, user_id, format="xlsx", date_from=None, date_to=None):
+    start = date.fromisoformat(date_from) if date_from else None
+    end = date.fromisoformat(date_to) if date_to else None
+    total = ledger.spent(db, user_id, start, end)["count"]
+
+    path = ctx.path(f".{format}")
+    with open(f"{path}.part", "wb") as fh:
+        chunks = exports.iter_export(db, format, user_id, start, end, lambda rows: ctx.progress(rows, total))
+        for chunk in chunks:
+            fh.write(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+    os.replace(f"{path}.part", path)
+    return {
+        "file": os.path.basename(path),
+        "filename": f"Expense_Report.{format}",
+        "media_type": exports.MEDIA_TYPES[format],
+        "rows": total,
+    }
+
+
+# rows without an external_id would be imported twice by a retry
+@task("bulk_import", max_attempts=1)
+def import_expenses(db, ctx, user_id, content_type, body):
+    path = result_path(body)
+    size = os.path.getsize(path)
+    read = 0
+
+    async def chunks():
+        nonlocal read
+        with open(path, "rb") as fh:
+            while chunk := fh.read(exports.FILE_CHUNK_SIZE):
+                read += len(chunk)
+                yield chunk
+
+    try:
+        records = bulk.iter_records(content_type, chunks())
+        result = asyncio.run(
+            bulk.import_records(records, db, user_id, on_chunk=lambda: ctx.progress(read, size))
+        )
+    except HTTPException as exc:
+        raise JobFailed(exc.detail)
+    finally:
+        os.remove(path)
+    return result.model_dump()
+
+
+@task("rebuild_summaries")
+def rebuild_summaries(db, ctx, user_id, all_users=False):
+    """Recompute rollups and the ledger from the raw expenses, one user at a time."""
+    user_ids = (
+        db.scalars(select(models.User.id).order_by(models.User.id)).all()
+        if all_users else [user_id]
+    )
+    for done, rebuilt_id in enumerate(user_ids, start=1):
+        # the user row lock first, as every writer takes it: expense writes
+        # wait for the rebuild instead of being overwritten by it, and the
+        # bump also stops cached summaries of the old rollups being served
+        httpcache.bump_data_version(db, rebuilt_id)
+        summaries.rebuild(db, rebuilt_id)
+        ledger.rebuild(db, rebuilt_id)
+        db.commit()
+        ctx.progress(done, len(user_ids))
+    return {"users": len(user_ids)}
+
+
+@task("archive")
+def archive_months(db, ctx, user_id, before):
+    archived = archive.archive_before(db, date.fromisoformat(before), ctx.progress)
+    return {"archives": archived}
+
+
+# ------------------------
+# Worker
+# ------------------------
+
+def work(poll_seconds: float = JOBS_POLL_SECONDS, once: bool = False):
+    from database import SessionLocal
+
+    while True:
+        with SessionLocal() as db:
+            reap_stale(db)
+            job_id = next_due(db)
+        if job_id is not None:
+            run_job(SessionLocal, job_id)
+            continue
+        if once:
+            return
+        time.sleep(poll_seconds)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="run the jobs that are due and exit")
+    parser.add_argument("--interval", type=float, default=JOBS_POLL_SECONDS, help="seconds between polls")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    work(args.interval, args.once)
+
+
+if __name__ == "__main__":
+    main()
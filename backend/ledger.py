@@ -0,0 +1,182 @@
+"""
+Per-user running totals of expenses by day.
+
+`expense_ledger` has one row per (user, day) with expenses on it: that
+day's total and count, and the running total and count through that day.
+The row for the last day on or before D answers "spent up to D" with one
+primary key seek, and "spent between A and B" is the difference of two
+such seeks, however many expenses the user has.
+
+Writes go through `apply_deltas`, called by summaries.apply_many in the
+same transaction as the expense write. A change on day D moves the running
+totals of every later day of that user, in one UPDATE per changed day
+range. Most writes land on recent days, so few rows follow them. Writes
+for one user are already serialized by the data_version bump they all
+start with, so the rows read here cannot change underneath.
+"""
+
+from datetime import date, timedelta
+from typing import Optional
+
+from sqlalchemy import bindparam, delete, func, insert, select, update
+
+import archive
+import models
+import money
+
+
+# ------------------------
+# Write path
+# ------------------------
+
+def _insert_missing_days(db, user_id: int, days: list):
+    """
+    Add empty rows for days without one. Each starts from the running
+    totals of the closest earlier row, as they were before this change.
+    """
+    ledger = models.ExpenseLedger
+    previous = db.execute(
+        select(ledger.running_cents, ledger.running_count)
+        .where(ledger.user_id == user_id, ledger.date < days[0])
+        .order_by(ledger.date.desc())
+        .limit(1)
+    ).first()
+    existing = {
+        row.date: (row.running_cents, row.running_count)
+        for row in db.execute(
+            select(ledger.date, ledger.running_cents, ledger.running_count).where(
+                ledger.user_id == user_id, ledger.date >= days[0], ledger.date <= days[-1]
+            )
+        )
+    }
+
+    running = tuple(previous) if previous is not None else (0, 0)
+    missing = []
+    for day in sorted(set(existing) | set(days)):
+        if day in existing:
+            running = existing[day]
+        else:
+            missing.append({
+                "user_id": user_id,
+                "date": day,
+                "day_cents": 0,
+                "day_count": 0,
+                "running_cents": running[0],
+                "running_count": running[1],
+            })
+    if missing:
+        db.execute(insert(ledger), missing)
+
+
+def apply_deltas(db, user_id: int, deltas: dict):
+    """Apply {day: (cents, count)} changes to one user's ledger."""
+    deltas = {day: delta for day, delta in deltas.items() if delta != (0, 0)}
+    if not deltas:
+        return
+    ledger = models.ExpenseLedger
+    days = sorted(deltas)
+    _insert_missing_days(db, user_id, days)
+
+    # Core table: an ORM update with a parameter list would be a bulk update by primary key
+    table = ledger.__table__
+    db.execute(
+        update(table)
+        .where(table.c.user_id == user_id, table.c.date == bindparam("day"))
+        .values(
+            day_cents=table.c.day_cents + bindparam("cents"),
+            day_count=table.c.day_count + bindparam("count"),
+        ),
+        [{"day": day, "cents": deltas[day][0], "count": deltas[day][1]} for day in days],
+    )
+
+    # every row from days[i] up to days[i + 1] moves by the sum of deltas so far
+    shift_cents = shift_count = 0
+    for i, day in enumerate(days):
+        shift_cents += deltas[day][0]
+        shift_count += deltas[day][1]
+        if not (shift_cents or shift_count):
+            continue
+        criteria = [ledger.user_id == user_id, ledger.date >= day]
+        if i + 1 < len(days):
+            criteria.append(ledger.date < days[i + 1])
+        db.execute(
+            update(ledger)
+            .where(*criteria)
+            .values(
+                running_cents=ledger.running_cents + shift_cents,
+                running_count=ledger.running_count + shift_count,
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    # a day whose expenses are all gone just repeats the previous running totals
+    if any(count < 0 for _, count in deltas.values()):
+        db.execute(
+            delete(ledger)
+            .where(ledger.user_id == user_id, ledger.date.in_(days), ledger.day_count <= 0)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def rebuild(conn, user_id: int = None):
+    """
+    Recompute the ledger from the raw expenses (and archived day totals),
+    for one user or everyone. Works with both a Session and a Connection.
+    """
+    ledger = models.ExpenseLedger
+
+    totals = archive.daily_totals(user_id)
+    daily = (
+        select(
+            totals.c.user_id,
+            totals.c.date,
+            func.sum(totals.c.total_cents).label("day_cents"),
+            func.sum(totals.c.count).label("day_count"),
+        )
+        .group_by(totals.c.user_id, totals.c.date)
+        .subquery()
+    )
+    clear = delete(ledger)
+    if user_id is not None:
+        clear = clear.where(ledger.user_id == user_id)
+
+    window = {"partition_by": daily.c.user_id, "order_by": daily.c.date}
+    source = select(
+        daily.c.user_id,
+        daily.c.date,
+        daily.c.day_cents,
+        daily.c.day_count,
+        func.sum(daily.c.day_cents).over(**window),
+        func.sum(daily.c.day_count).over(**window),
+    )
+
+    conn.execute(clear)
+    conn.execute(
+        insert(ledger).from_select(
+            ["user_id", "date", "day_cents", "day_count", "running_cents", "running_count"],
+            source,
+        )
+    )
+
+
+# ------------------------
+# Read path
+# ------------------------
+
+def running_totals(db, user_id: int, through: Optional[date] = None) -> tuple[int, int]:
+    """(cents, count) of the user's expenses up to and including `through` (default: all)."""
+    ledger = models.ExpenseLedger
+    query = select(ledger.running_cents, ledger.running_count).where(ledger.user_id == user_id)
+    if through is not None:
+        query = query.where(ledger.date <= through)
+    row = db.execute(query.order_by(ledger.date.desc()).limit(1)).first()
+    return tuple(row) if row is not None else (0, 0)
+
+
+def spent(db, user_id: int, start: Optional[date] = None, end: Optional[date] = None) -> dict:
+    """Total and count of expenses dated from `start` to `end`, both inclusive and optional."""
+    cents, count = running_totals(db, user_id, end)
+    if start is not None and start > date.min:
+        before_cents, before_count = running_totals(db, user_id, start - timedelta(days=1))
+        cents, count = cents - before_cents, count - before_count
+    return {"total": money.to_float(cents), "count": count}
@@ -0,0 +1,208 @@
+"""
+Helpers for the list endpoints: keyset (cursor) pagination on (date, id),
+server-side expense filters and NDJSON streaming from a server-side cursor.
+"""
+
+import base64
+import binascii
+import json
+from datetime import date
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import func, tuple_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+import models
+import money
+import serialization
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+# above this many rows (per the planner's estimate) counts are not exact
+COUNT_ESTIMATE_THRESHOLD = 100_000
+
+
+def encode_cursor(row_date: date, row_id: int) -> str:
+    raw = f"{row_date.isoformat()}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[date, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8")
+        row_date, row_id = raw.split("|")
+        return date.fromisoformat(row_date), int(row_id)
+    except (ValueError, UnicodeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def encode_id_cursor(row_id: int) -> str:
+    return base64.urlsafe_b64encode(str(row_id).encode("ascii")).decode("ascii").rstrip("=")
+
+
+def decode_id_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode("ascii")).decode("ascii"))
+    except (ValueError, UnicodeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def encode_change_token(change_seq: int, row_id: int) -> str:
+    raw = f"{change_seq}|{row_id}".encode("ascii")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_change_token(token: str) -> tuple[int, int]:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        change_seq, row_id = base64.urlsafe_b64decode(padded.encode("ascii")).decode("ascii").split("|")
+        return int(change_seq), int(row_id)
+    except (ValueError, UnicodeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+
+def parse_fields(fields: Optional[str], allowed: dict) -> dict:
+    """
+    Resolve a comma-separated `fields` projection against the allowed
+    {name: column} map. All allowed fields are returned when it is empty.
+    """
+    if not fields:
+        return dict(allowed)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}",
+        )
+    return {name: allowed[name] for name in names}
+
+
+def expense_filters(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    category: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+) -> list:
+    """
+    Build SQL criteria for the optional expense filters.
+    Date bounds are inclusive on both ends. Soft-deleted rows are always
+    excluded.
+    """
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+
+    criteria = [models.Expense.deleted_at.is_(None)]
+    if date_from is not None:
+        criteria.append(models.Expense.date >= date_from)
+    if date_to is not None:
+        criteria.append(models.Expense.date <= date_to)
+    if category:
+        criteria.append(models.Expense.category == category)
+    if min_amount is not None:
+        criteria.append(models.Expense.amount_cents >= money.to_cents(min_amount))
+    if max_amount is not None:
+        criteria.append(models.Expense.amount_cents <= money.to_cents(max_amount))
+    return criteria
+
+
+def keyset_page(query, date_col, id_col, cursor: Optional[str], limit: Optional[int]):
+    """
+    Order a query newest first on (date, id) and continue after `cursor`.
+    One extra row is fetched so the caller can tell whether a next page exists.
+    """
+    if cursor:
+        cursor_date, cursor_id = decode_cursor(cursor)
+        query = query.filter(tuple_(date_col, id_col) < tuple_(cursor_date, cursor_id))
+
+    query = query.order_by(date_col.desc(), id_col.desc())
+    if limit is not None:
+        query = query.limit(limit + 1)
+    return query
+
+
+def split_page(rows: list, limit: Optional[int]) -> tuple[list, Optional[str]]:
+    """
+    Trim the look-ahead row returned by keyset_page and build the next cursor.
+    """
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last.date, last.id)
+
+
+def row_to_dict(row) -> dict:
+    """JSON-ready dict of a projected row."""
+    return {
+        key: value.isoformat() if isinstance(value, date) else value
+        for key, value in row._mapping.items()
+    }
+
+
+def expense_row_to_dict(row) -> dict:
+    return {
+        "id": row.id,
+        "title": row.title,
+        "amount": row.amount,
+        "category": row.category,
+        "date": row.date.isoformat(),
+    }
+
+
+def stream_ndjson(query, to_dict=expense_row_to_dict, batch_size: int = STREAM_BATCH_SIZE):
+    """
+    Yield newline-delimited JSON, one object per row.
+
+    `yield_per` makes SQLAlchemy use a server-side cursor where the driver
+    supports it, so only one batch of rows is held in memory at a time.
+    """
+    buffer = []
+    for row in query.yield_per(batch_size):
+        buffer.append(serialization.dumps(to_dict(row)))
+        if len(buffer) >= batch_size:
+            yield "\n".join(buffer) + "\n"
+            buffer = []
+    if buffer:
+        yield "\n".join(buffer) + "\n"
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN (FORMAT JSON) of a statement, with its parameters bound as usual."""
+
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+def count_rows(db, query) -> tuple[int, bool]:
+    """
+    Count the rows a filtered query matches, as (count, estimated).
+    On Postgres the planner's row estimate is returned instead of an exact
+    COUNT(*) once it goes past COUNT_ESTIMATE_THRESHOLD.
+    """
+    count_query = query.order_by(None).limit(None).with_entities(func.count())
+    bind = db.get_bind()
+
+    if bind.dialect.name == "postgresql":
+        # filter values stay bound parameters, never part of the SQL text
+        plan = db.execute(Explain(query.order_by(None).limit(None).statement)).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = int(plan[0]["Plan"]["Plan Rows"])
+        if estimate >= COUNT_ESTIMATE_THRESHOLD:
+            return estimate, True
+
+    return count_query.scalar(), False
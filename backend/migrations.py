@@ -0,0 +1,228 @@
+"""
+Minimal schema migrations.
+
+`Base.metadata.create_all` only creates missing tables, it never adds
+columns or indexes to tables that already exist. Each migration below
+brings an existing database up to the current models and is written to be
+idempotent, so it is also a no-op on a database freshly built by create_all.
+
+Applied versions are recorded in the `schema_migrations` table.
+The API does not migrate on import: run this before starting it
+(python migrations.py). /readyz reports pending versions.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import (
+    BigInteger, Column, DateTime, Integer, MetaData, String, Table, cast, func, inspect,
+    literal_column, select,
+)
+
+import ledger
+import models
+import partitions
+import summaries
+
+_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+MIGRATIONS = []
+
+
+def migration(version: int, description: str):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+# ------------------------
+# Helpers
+# ------------------------
+
+def create_index_if_missing(conn, index):
+    existing = {ix["name"] for ix in inspect(conn).get_indexes(index.table.name)}
+    if index.name not in existing:
+        index.create(bind=conn)
+
+
+def add_column_if_missing(conn, table, column):
+    existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+    if column.name in existing:
+        return
+    column_type = column.type.compile(dialect=conn.dialect)
+    ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+    if column.server_default is not None:
+        ddl += f" DEFAULT {column.server_default.arg}"
+    conn.exec_driver_sql(ddl)
+
+
+def has_columns(conn, table) -> bool:
+    """Whether the database table already has every column of the model's."""
+    existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+    return {column.name for column in table.columns} <= existing
+
+
+def _index(table, name):
+    return next(ix for ix in table.indexes if ix.name == name)
+
+
+# ------------------------
+# Migrations
+# ------------------------
+
+@migration(1, "expenses (user_id, date, id) keyset index")
+def _expenses_keyset_index(conn):
+    create_index_if_missing(conn, _index(models.Expense.__table__, "ix_expenses_user_date_id"))
+
+
+@migration(2, "backfill expense_rollups")
+def _backfill_rollups(conn):
+    # the rebuild reads columns added by later migrations; on a database
+    # that predates them, migration 8 rebuilds the rollups once they exist
+    if has_columns(conn, models.Expense.__table__) and has_columns(conn, models.ExpenseRollup.__table__):
+        summaries.rebuild(conn)
+
+
+@migration(3, "expenses.external_id for idempotent bulk imports")
+def _expenses_external_id(conn):
+    table = models.Expense.__table__
+    add_column_if_missing(conn, table, table.c.external_id)
+    create_index_if_missing(conn, _index(table, "ux_expenses_user_external_id"))
+
+
+@migration(4, "users.token_version")
+def _users_token_version(conn):
+    table = models.User.__table__
+    add_column_if_missing(conn, table, table.c.token_version)
+
+
+@migration(5, "users.data_version for ETags")
+def _users_data_version(conn):
+    table = models.User.__table__
+    add_column_if_missing(conn, table, table.c.data_version)
+
+
+@migration(6, "expense change tracking and tombstones")
+def _expenses_change_tracking(conn):
+    users = models.User.__table__
+    expenses = models.Expense.__table__
+    add_column_if_missing(conn, users, users.c.purged_seq)
+    for column in (expenses.c.updated_at, expenses.c.deleted_at, expenses.c.change_seq):
+        add_column_if_missing(conn, expenses, column)
+    conn.execute(
+        expenses.update()
+        .where(expenses.c.updated_at.is_(None))
+        .values(updated_at=func.current_timestamp())
+    )
+    create_index_if_missing(conn, _index(expenses, "ix_expenses_user_change_seq_id"))
+
+
+@migration(7, "expense search indexes (Postgres only)")
+def _expense_search_indexes(conn):
+    # elsewhere search.py keeps an in-process index instead
+    if conn.dialect.name != "postgresql":
+        return
+    conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_expenses_search_tsv ON expenses "
+        "USING gin (to_tsvector('simple', title || ' ' || category))"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_expenses_search_trgm ON expenses "
+        "USING gin (lower(title || ' ' || category) gin_trgm_ops)"
+    )
+
+
+@migration(8, "amounts in integer cents, rollups in cents, expense ledger")
+def _amounts_in_cents(conn):
+    expenses = models.Expense.__table__
+    add_column_if_missing(conn, expenses, expenses.c.amount_cents)
+    if "amount" in {c["name"] for c in inspect(conn).get_columns("expenses")}:
+        conn.execute(
+            expenses.update().values(
+                amount_cents=cast(func.round(literal_column("amount") * 100), BigInteger)
+            )
+        )
+        conn.exec_driver_sql("ALTER TABLE expenses DROP COLUMN amount")
+
+    # rollups and the ledger are derived data: rebuild them in cents
+    rollups = models.ExpenseRollup.__table__
+    rollups.drop(bind=conn, checkfirst=True)
+    rollups.create(bind=conn)
+    summaries.rebuild(conn)
+    models.ExpenseLedger.__table__.create(bind=conn, checkfirst=True)
+    ledger.rebuild(conn)
+
+
+@migration(9, "expenses partitioned by month (Postgres only)")
+def _partition_expenses(conn):
+    # archive.py drops whole partitions; see partitions.py
+    if not partitions.supported(conn) or partitions.is_partitioned(conn):
+        return
+    partitions.partition_expenses(conn)
+    # the search indexes went with the old table
+    _expense_search_indexes(conn)
+
+
+# ------------------------
+# Runner
+# ------------------------
+
+def applied_versions(conn) -> set:
+    return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def pending(db) -> list:
+    """Versions not applied yet (all of them on a fresh database)."""
+    conn = db.connection()
+    if not inspect(conn).has_table(schema_migrations.name):
+        return [version for version, _, _ in MIGRATIONS]
+    done = applied_versions(conn)
+    return [version for version, _, _ in MIGRATIONS if version not in done]
+
+
+def upgrade(engine):
+    """Apply every migration that has not been recorded yet."""
+    _metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        done = applied_versions(conn)
+
+    applied = []
+    for version, description, fn in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as conn:
+            fn(conn)
+            conn.execute(
+                schema_migrations.insert().values(
+                    version=version,
+                    description=description,
+                    applied_at=datetime.utcnow(),
+                )
+            )
+        applied.append(version)
+    return applied
+
+
+def migrate(engine=None) -> list:
+    """Create missing tables, then apply pending migrations."""
+    if engine is None:
+        from database import get_engine
+
+        engine = get_engine()
+    models.Base.metadata.create_all(bind=engine)
+    return upgrade(engine)
+
+
+if __name__ == "__main__":
+    applied = migrate()
+    print(f"Applied migrations: {applied}" if applied else "Schema is up to date")
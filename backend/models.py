@@ -1,7 +1,10 @@
 from xmlrpc.client import Boolean
-from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey
+from datetime import datetime
+from sqlalchemy import BigInteger, Column, Integer, String, Float, Date, DateTime, ForeignKey, Index, JSON
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 from database import Base
+import money
 from sqlalchemy import Boolean
 class User(Base):
     __tablename__ = "users"
@@ -15,14 +18,183 @@ class User(Base):
     # adding admin field
     is_admin=Column(Boolean, default=False)  #false by default true for admin users
     # need to update the sql db accordingly ---??
+
+    # bumped to revoke every token issued to the user; part of the principal cache key
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
+    # bumped by every expense write; list and summary ETags are derived from it
+    data_version = Column(Integer, nullable=False, default=0, server_default="0")
+    # change tokens at or below this sequence may have lost purged tombstones
+    purged_seq = Column(Integer, nullable=False, default=0, server_default="0")
 class Expense(Base):
     __tablename__ = "expenses"
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
-    amount = Column(Float, nullable=False)
+    # fixed point: see money.py; `amount` below is the Decimal view of it
+    amount_cents = Column(BigInteger, nullable=False)
     category = Column(String, nullable=False)
     date = Column(Date, nullable=False)
+    # client-supplied id that makes bulk imports idempotent
+    external_id = Column(String, nullable=True)
+
+    # sync bookkeeping: the user's data_version at the last write, and a
+    # tombstone timestamp (deleted rows stay until purged so clients see them)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    deleted_at = Column(DateTime, nullable=True)
+    change_seq = Column(Integer, nullable=False, default=0, server_default="0")
 
     user_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User", back_populates="expenses")
+
+    # keyset pagination on (date, id) per user is an index range scan
+    __table_args__ = (
+        Index("ix_expenses_user_date_id", "user_id", "date", "id"),
+        Index("ux_expenses_user_external_id", "user_id", "external_id", unique=True),
+        Index("ix_expenses_user_change_seq_id", "user_id", "change_seq", "id"),
+    )
+
+    @hybrid_property
+    def amount(self):
+        return money.to_decimal(self.amount_cents) if self.amount_cents is not None else None
+
+    @amount.setter
+    def amount(self, value):
+        self.amount_cents = money.to_cents(value)
+
+    @amount.expression
+    def amount(cls):
+        # for projections and filters; sum amount_cents, not this
+        return cls.amount_cents / 100.0
+
+
+class RefreshToken(Base):
+    """
+    One rotating refresh token. Only a hash of the token is stored. Tokens
+    rotated from the same login share a family, which is revoked as a
+    whole when an already rotated token is presented again.
+    """
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    token_hash = Column(String, nullable=False, unique=True)
+    family = Column(String, nullable=False, index=True)
+    # the user's token_version when issued; bumping it revokes the token
+    token_version = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime, nullable=True)
+
+
+class ExpenseRollup(Base):
+    """Per-user (year, month, category) totals, maintained on every expense write."""
+    __tablename__ = "expense_rollups"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    category = Column(String, primary_key=True)
+    total_cents = Column(BigInteger, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class Budget(Base):
+    """A user's monthly spending limit for one category."""
+    __tablename__ = "budgets"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    category = Column(String, primary_key=True)
+    limit_cents = Column(BigInteger, nullable=False)
+
+
+class BudgetAlert(Base):
+    """
+    Outbox of budget threshold crossings, written in the transaction of the
+    expense write that caused them and delivered later by alert_worker.py.
+    """
+    __tablename__ = "budget_alerts"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    category = Column(String, nullable=False)
+    threshold = Column(Integer, nullable=False)  # percent of the limit
+    spent_cents = Column(BigInteger, nullable=False)
+    limit_cents = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    delivered_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # each threshold alerts once per user, month and category
+        Index("ux_budget_alerts_once", "user_id", "year", "month", "category", "threshold", unique=True),
+        Index("ix_budget_alerts_pending", "delivered_at", "id"),
+        Index("ix_budget_alerts_user_id", "user_id", "id"),
+    )
+
+
+class ExpenseLedger(Base):
+    """Per-user daily totals and running totals through each day; see ledger.py."""
+    __tablename__ = "expense_ledger"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    date = Column(Date, primary_key=True)
+    day_cents = Column(BigInteger, nullable=False, default=0)
+    day_count = Column(Integer, nullable=False, default=0)
+    running_cents = Column(BigInteger, nullable=False, default=0)
+    running_count = Column(Integer, nullable=False, default=0)
+
+
+class Job(Base):
+    """A unit of background work and its outcome; see jobs.py."""
+    __tablename__ = "jobs"
+
+    id = Column(String, primary_key=True)  # uuid4 hex
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    kind = Column(String, nullable=False)
+    params = Column(JSON, nullable=False, default=dict)
+    # queued -> running -> succeeded | failed (or back to queued for a retry)
+    status = Column(String, nullable=False, default="queued")
+    progress = Column(Float, nullable=False, default=0.0)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=1)
+    timeout_seconds = Column(Integer, nullable=False)
+    result = Column(JSON, nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_queue", "status", "run_after"),
+        Index("ix_jobs_user_id", "user_id", "created_at"),
+    )
+
+
+class ExpenseArchive(Base):
+    """A month of expenses moved to a Parquet file; see archive.py."""
+    __tablename__ = "expense_archives"
+
+    id = Column(Integer, primary_key=True)
+    month = Column(Date, nullable=False, index=True)  # first day of the month
+    path = Column(String, nullable=False)  # file name under ARCHIVE_DIR
+    row_count = Column(Integer, nullable=False, default=0)
+    archived_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class ExpenseArchiveDay(Base):
+    """Per user, day and category totals of an archive's expenses."""
+    __tablename__ = "expense_archive_days"
+
+    archive_id = Column(Integer, ForeignKey("expense_archives.id"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    date = Column(Date, primary_key=True)
+    category = Column(String, primary_key=True)
+    total_cents = Column(BigInteger, nullable=False)
+    count = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_expense_archive_days_user_date", "user_id", "date"),
+    )
@@ -0,0 +1,32 @@
+"""
+Fixed-point money.
+
+Amounts are stored as integer cents (expenses, rollups and the ledger),
+so totals are exact sums of integers however many rows go into them.
+Request bodies are parsed into Decimal with at most two places; JSON
+responses still carry amounts as plain numbers.
+"""
+
+from decimal import ROUND_HALF_EVEN, Decimal
+
+CENT = Decimal("0.01")
+# keeps every amount in cents below 2**53, so it survives a JSON float exactly
+MAX_DIGITS = 15
+# largest amount with two places in MAX_DIGITS digits, e.g. for query filters
+MAX_AMOUNT = 10 ** (MAX_DIGITS - 2)
+
+
+def to_cents(value) -> int:
+    """Decimal, int, float or numeric string -> integer cents."""
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return int(value.quantize(CENT, rounding=ROUND_HALF_EVEN).scaleb(2))
+
+
+def to_decimal(cents: int) -> Decimal:
+    return Decimal(cents).scaleb(-2)
+
+
+def to_float(cents) -> float:
+    """For JSON: the nearest float to the exact amount (0 for no rows)."""
+    return (cents or 0) / 100
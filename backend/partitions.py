@@ -0,0 +1,168 @@
+"""
+Monthly range partitions of `expenses` by date (PostgreSQL only).
+
+Migration 9 turns the heap table into a partitioned one: one partition per
+month (expenses_y2025m03) plus expenses_default for dates without one.
+Per-month partitions keep indexes small, let vacuum work month by month,
+let date-bounded scans skip whole months, and let archive.py drop an
+archived month in one statement instead of deleting its rows.
+
+New months need their partitions before they start; run this daily, e.g.
+from cron:
+
+    python partitions.py            # create partitions PARTITION_MONTHS_AHEAD ahead
+
+Rows that already landed in the default partition for a month are moved
+into that month's partition when it is created.
+
+Unique indexes on a partitioned table must include the partition key, so
+(user_id, external_id) is a plain index there and the database no longer
+enforces it. bulk.import_chunk is the only writer of external ids and
+takes the user row lock (httpcache.bump_data_version) before it looks
+them up, so concurrent imports of the same ids run one after the other
+and the second updates the first's rows: re-imports stay idempotent as
+long as external ids are only written under that lock.
+Elsewhere (SQLite) the table stays a single heap table.
+"""
+
+import os
+from datetime import date
+
+from sqlalchemy import text
+
+import models
+
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+DEFAULT_PARTITION = "expenses_default"
+
+
+def supported(conn) -> bool:
+    return conn.dialect.name == "postgresql"
+
+
+def is_partitioned(conn) -> bool:
+    if not supported(conn):
+        return False
+    return conn.execute(
+        text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('expenses')")
+    ).first() is not None
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"expenses_y{month.year:04d}m{month.month:02d}"
+
+
+def existing_partitions(conn) -> set:
+    return set(
+        conn.execute(
+            text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass('expenses')"
+            )
+        ).scalars()
+    )
+
+
+def create_partition(conn, month: date):
+    """
+    Add the partition for `month`, moving in any of its rows that were
+    stored in the default partition meanwhile.
+    """
+    name = partition_name(month)
+    start, end = month.isoformat(), add_months(month, 1).isoformat()
+    conn.exec_driver_sql(f"CREATE TABLE {name} (LIKE expenses INCLUDING DEFAULTS)")
+    conn.exec_driver_sql(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+        f"WHERE date >= '{start}' AND date < '{end}' RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    )
+    conn.exec_driver_sql(
+        f"ALTER TABLE expenses ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"
+    )
+
+
+def ensure_partitions(conn, first: date, last: date) -> list:
+    """Create the missing monthly partitions from `first` through `last`."""
+    existing = existing_partitions(conn)
+    created = []
+    month = month_start(first)
+    while month <= last:
+        if partition_name(month) not in existing:
+            create_partition(conn, month)
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    return created
+
+
+def ensure_upcoming(conn, today: date = None) -> list:
+    if not is_partitioned(conn):
+        return []
+    month = month_start(today or date.today())
+    return ensure_partitions(conn, month, add_months(month, PARTITION_MONTHS_AHEAD))
+
+
+def drop_partition(conn, month: date) -> bool:
+    """Drop the month's partition and its rows; False if it has none."""
+    name = partition_name(month)
+    if name not in existing_partitions(conn):
+        return False
+    conn.exec_driver_sql(f"ALTER TABLE expenses DETACH PARTITION {name}")
+    conn.exec_driver_sql(f"DROP TABLE {name}")
+    return True
+
+
+def partition_expenses(conn, today: date = None):
+    """Convert the heap `expenses` table into monthly partitions, keeping its rows and ids."""
+    table = models.Expense.__table__
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence('expenses', 'id')")).scalar()
+    if sequence:
+        # the sequence would go with the old table
+        conn.exec_driver_sql(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+
+    conn.exec_driver_sql("ALTER TABLE expenses RENAME TO expenses_heap")
+    conn.exec_driver_sql(
+        "CREATE TABLE expenses (LIKE expenses_heap INCLUDING DEFAULTS) PARTITION BY RANGE (date)"
+    )
+    conn.exec_driver_sql(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF expenses DEFAULT")
+
+    current = month_start(today or date.today())
+    oldest = conn.exec_driver_sql("SELECT min(date) FROM expenses_heap").scalar()
+    ensure_partitions(
+        conn, min(month_start(oldest), current) if oldest else current,
+        add_months(current, PARTITION_MONTHS_AHEAD),
+    )
+    conn.exec_driver_sql("INSERT INTO expenses SELECT * FROM expenses_heap")
+    conn.exec_driver_sql("DROP TABLE expenses_heap")
+
+    # constraints and indexes are named after the old table's, so only now
+    conn.exec_driver_sql("ALTER TABLE expenses ADD PRIMARY KEY (id, date)")
+    conn.exec_driver_sql("ALTER TABLE expenses ADD FOREIGN KEY (user_id) REFERENCES users (id)")
+    for index in table.indexes:
+        if index.unique:
+            columns = ", ".join(column.name for column in index.columns)
+            conn.exec_driver_sql(f"CREATE INDEX {index.name} ON expenses ({columns})")
+        else:
+            index.create(bind=conn)
+    if sequence:
+        conn.exec_driver_sql(f"ALTER SEQUENCE {sequence} OWNED BY expenses.id")
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            print("expenses is not partitioned (run migrations.py on PostgreSQL)")
+        else:
+            made = ensure_upcoming(connection)
+            print(f"Created partitions: {made}" if made else "Partitions are up to date")
@@ -0,0 +1,248 @@
+"""
+Cache of authenticated principals.
+
+`get_current_user` used to load the full `User` row on every protected
+request. It now resolves a lightweight `Principal` from this cache and
+only falls back to the database on a miss. Entries are keyed by user id
+and only match while the token's version equals the cached one.
+
+The cache and the claims fast path below are only as good as their
+invalidations, so they are used only where every API process sees every
+invalidation: with PRINCIPAL_CACHE_URL (redis://...), a Redis backend
+shared by all workers and replicas, or with PRINCIPAL_CACHE_LOCAL=1, an
+in-process TTL/LRU cache for deployments that run a single process (it
+refuses to start when WEB_CONCURRENCY asks for more). With neither, every
+request loads its principal from the database, so a revocation, delete or
+demotion made by one worker applies at once on all of them.
+
+Entries are dropped when a user is deleted or when their username, admin
+flag or token version changes through the ORM (after the transaction
+commits). Code that changes users with Core statements must call
+`invalidate` and `note_change` itself.
+
+Access tokens carry the principal in their claims, so most requests never
+get here. Each change above is also noted for as long as an access token
+can live: tokens issued before it are resolved here again instead of being
+trusted, and tokens with an older version are refused.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+import models
+from auth import ACCESS_TOKEN_EXPIRE_MINUTES
+
+CACHE_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+CACHE_URL = os.getenv("PRINCIPAL_CACHE_URL")
+CACHE_LOCAL = os.getenv("PRINCIPAL_CACHE_LOCAL", "0") == "1"
+
+if CACHE_LOCAL and not CACHE_URL and int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+    raise RuntimeError(
+        "PRINCIPAL_CACHE_LOCAL=1 is for a single process; set PRINCIPAL_CACHE_URL for several workers"
+    )
+
+# whether invalidations reach every process, i.e. the cache may be trusted
+CACHE_ENABLED = bool(CACHE_URL) or CACHE_LOCAL
+
+_WATCHED_FIELDS = ("username", "is_admin", "token_version")
+
+
+class Principal:
+    """The authenticated user as seen by request handlers."""
+
+    __slots__ = ("id", "username", "is_admin", "token_version")
+
+    def __init__(self, id: int, username: str, is_admin: bool, token_version: int = 0):
+        self.id = id
+        self.username = username
+        self.is_admin = bool(is_admin)
+        self.token_version = token_version or 0
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Principal":
+        return cls(**data)
+
+    def __repr__(self):
+        return f"Principal(id={self.id!r}, username={self.username!r}, is_admin={self.is_admin!r})"
+
+
+# ------------------------
+# Backends
+# ------------------------
+
+class MemoryBackend:
+    """Bounded, thread-safe LRU cache whose entries expire after a TTL."""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: int = CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisBackend:
+    """Shared backend for running several API replicas."""
+
+    def __init__(self, url: str, ttl: int = CACHE_TTL_SECONDS, prefix: str = "principal:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[dict]:
+        raw = self.client.get(key)
+        return json.loads(raw) if raw else None
+
+    def set(self, key: str, value: dict):
+        self.client.set(key, json.dumps(value), ex=self.ttl)
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+    def clear(self):
+        for key in self.client.scan_iter(f"{self.prefix}*"):
+            self.client.delete(key)
+
+
+_backend = RedisBackend(CACHE_URL) if CACHE_URL else MemoryBackend()
+
+# must outlive every access token issued before a change
+_CHANGES_TTL = ACCESS_TOKEN_EXPIRE_MINUTES * 60 + 60
+_changes = (
+    RedisBackend(CACHE_URL, ttl=_CHANGES_TTL, prefix="user-change:")
+    if CACHE_URL
+    else MemoryBackend(ttl=_CHANGES_TTL)
+)
+
+
+def set_backend(backend, changes=None):
+    """
+    Plug in any object with get/set/delete/clear that every process shares,
+    e.g. a shared cache, and optionally another for the change notes.
+    """
+    global _backend, _changes, CACHE_ENABLED
+    _backend = backend
+    if changes is not None:
+        _changes = changes
+    CACHE_ENABLED = True
+
+
+def _key(user_id: int) -> str:
+    return f"principal:{user_id}"
+
+
+# ------------------------
+# Lookups
+# ------------------------
+
+def get(user_id: int, token_version: int) -> Optional[Principal]:
+    data = _backend.get(_key(user_id))
+    if data is None or data.get("token_version") != token_version:
+        return None
+    return Principal.from_dict(data)
+
+
+def put(principal: Principal):
+    _backend.set(_key(principal.id), principal.to_dict())
+
+
+def invalidate(user_id: int):
+    _backend.delete(_key(user_id))
+
+
+def clear():
+    _backend.clear()
+    _changes.clear()
+
+
+def note_change(user_id: int, token_version: int):
+    _changes.set(f"user-change:{user_id}", {"token_version": token_version, "at": time.time()})
+
+
+def last_change(user_id: int) -> Optional[dict]:
+    """{"token_version", "at"} of the user's last recent change, if any."""
+    return _changes.get(f"user-change:{user_id}")
+
+
+def load(db, user_id: int) -> Optional[Principal]:
+    """Read just the principal's columns, never the password hash."""
+    user = models.User
+    row = (
+        db.query(user.id, user.username, user.is_admin, user.token_version)
+        .filter(user.id == user_id)
+        .first()
+    )
+    return Principal(*row) if row else None
+
+
+# ------------------------
+# Invalidation
+# ------------------------
+
+def _pending(session) -> dict:
+    # user id -> token version after the change
+    return session.info.setdefault("principal_invalidations", {})
+
+
+@event.listens_for(models.User, "after_update")
+def _user_updated(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in _WATCHED_FIELDS):
+        _pending(state.session)[target.id] = target.token_version or 0
+
+
+@event.listens_for(models.User, "after_delete")
+def _user_deleted(mapper, connection, target):
+    # older tokens fall back to `load`, which no longer finds the user
+    _pending(inspect(target).session)[target.id] = target.token_version or 0
+
+
+@event.listens_for(Session, "after_commit")
+def _flush_invalidations(session):
+    for user_id, token_version in session.info.pop("principal_invalidations", {}).items():
+        invalidate(user_id)
+        note_change(user_id, token_version)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_invalidations(session):
+    session.info.pop("principal_invalidations", None)
@@ -1,122 +1,279 @@
 """
-Standalone script to print expense database contents to console in tabular format
-Run this directly: python print_db.py
+Report on the expense database from the command line.
+
+Every section comes from a single set-based query: users are joined to
+their per-user COUNT/SUM/AVG aggregates, expenses are joined to their
+owner's username, and the summary is computed by SQL aggregates. Rows
+are streamed with yield_per, so large tables never sit in memory.
+
+Examples (run from backend/):
+    python print_db.py
+    python print_db.py --stats-only
+    python print_db.py --user alice --limit 50 --offset 100
+    python print_db.py --format csv --section expenses > expenses.csv
+    python print_db.py --format json --page-size 1000
 """
 
+import argparse
+import csv
+import json
 import logging
-from backend import models
-from sqlalchemy import event
-from database import SessionLocal, engine, Base
-from models import User, Expense
+import sys
+from datetime import date
+from itertools import islice
+
+from sqlalchemy import func
 from tabulate import tabulate
-models.Base.metadata.create_all(bind=engine)
-# Enable SQL logging
-logging.basicConfig()
-logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
-
-# Capture SQL commands
-sql_commands = []
-
-@event.listens_for(engine, "before_cursor_execute")
-def receive_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
-    sql_commands.append(statement)
-
-def print_database():
-    """Print all users and their expenses from the database in tabular format"""
-    
-    # Create tables if they don't exist
-    Base.metadata.create_all(bind=engine)
-    
-    # Get database session
+
+import money
+from database import SessionLocal
+from models import User, Expense
+
+SECTIONS = ("users", "expenses", "stats")
+STREAM_BATCH_SIZE = 1000
+
+
+# ------------------------
+# Queries
+# ------------------------
+
+def users_query(db, username=None):
+    """Users with their expense count, total and average, in one GROUP BY."""
+    query = (
+        db.query(
+            User.id,
+            User.username,
+            User.is_admin,
+            func.count(Expense.id).label("expenses"),
+            (func.coalesce(func.sum(Expense.amount_cents), 0) / 100.0).label("total"),
+            (func.coalesce(func.avg(Expense.amount_cents), 0) / 100.0).label("average"),
+        )
+        .outerjoin(Expense, (Expense.user_id == User.id) & Expense.deleted_at.is_(None))
+        .group_by(User.id, User.username, User.is_admin)
+        .order_by(User.id)
+    )
+    if username:
+        query = query.filter(User.username == username.strip().lower())
+    return query
+
+
+def expenses_query(db, username=None):
+    """Expenses with their owner's username via a join, not one lookup per row."""
+    query = (
+        db.query(
+            Expense.id,
+            func.coalesce(User.username, "Unknown").label("username"),
+            Expense.title,
+            Expense.amount,
+            Expense.category,
+            Expense.date,
+        )
+        .outerjoin(User, User.id == Expense.user_id)
+        .filter(Expense.deleted_at.is_(None))
+        .order_by(Expense.id)
+    )
+    if username:
+        query = query.filter(User.username == username.strip().lower())
+    return query
+
+
+def stats(db, username=None) -> dict:
+    """Totals from SQL aggregates; no individual rows are loaded."""
+    expense_stats = db.query(
+        func.count(Expense.id),
+        func.coalesce(func.sum(Expense.amount_cents), 0),
+        func.coalesce(func.avg(Expense.amount_cents), 0),
+        func.min(Expense.date),
+        func.max(Expense.date),
+    ).filter(Expense.deleted_at.is_(None))
+    user_count = db.query(func.count(User.id))
+    if username:
+        username = username.strip().lower()
+        expense_stats = expense_stats.join(User, User.id == Expense.user_id).filter(User.username == username)
+        user_count = user_count.filter(User.username == username)
+
+    count, total, average, first, last = expense_stats.one()
+    return {
+        "total_users": user_count.scalar(),
+        "total_expenses": count,
+        "total_amount": money.to_float(total),
+        "average_expense": round(float(average) / 100, 2),
+        "first_expense": first,
+        "last_expense": last,
+    }
+
+
+def paged(query, offset=0, limit=None):
+    if offset:
+        query = query.offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.yield_per(STREAM_BATCH_SIZE)
+
+
+# ------------------------
+# Output
+# ------------------------
+
+def _plain(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float):
+        return round(value, 2)
+    return value
+
+
+def _rows(query):
+    for row in query:
+        yield {key: _plain(value) for key, value in row._mapping.items()}
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class GridWriter:
+    """tabulate needs whole tables, so large sections print one page at a time."""
+
+    def __init__(self, out, page_size):
+        self.out = out
+        self.page_size = page_size
+
+    def section(self, title, rows):
+        self.out.write(f"\n{title}\n{'-' * 100}\n")
+        empty = True
+        for batch in _batches(rows, self.page_size):
+            empty = False
+            self.out.write(tabulate(batch, headers="keys", tablefmt="grid", numalign="right"))
+            self.out.write("\n")
+        if empty:
+            self.out.write("[No rows]\n")
+
+    def stats(self, data):
+        self.section("SUMMARY STATISTICS", [{"metric": k, "value": _plain(v)} for k, v in data.items()])
+
+    def close(self):
+        pass
+
+
+class CsvWriter:
+    def __init__(self, out, page_size):
+        self.out = out
+        self.first = True
+
+    def section(self, title, rows):
+        writer = None
+        if not self.first:
+            self.out.write("\n")
+        self.first = False
+        for row in rows:
+            if writer is None:
+                writer = csv.DictWriter(self.out, fieldnames=list(row))
+                writer.writeheader()
+            writer.writerow(row)
+
+    def stats(self, data):
+        self.section("stats", [{"metric": k, "value": _plain(v)} for k, v in data.items()])
+
+    def close(self):
+        pass
+
+
+class JsonWriter:
+    """One JSON object, written incrementally so rows are never buffered."""
+
+    def __init__(self, out, page_size):
+        self.out = out
+        self.sections = 0
+        self.out.write("{")
+
+    def _key(self, name):
+        self.out.write(("," if self.sections else "") + f"\n  {json.dumps(name)}: ")
+        self.sections += 1
+
+    def section(self, title, rows):
+        self._key(title.lower())
+        self.out.write("[")
+        for i, row in enumerate(rows):
+            self.out.write(("," if i else "") + "\n    " + json.dumps(row))
+        self.out.write("\n  ]")
+
+    def stats(self, data):
+        self._key("stats")
+        self.out.write(json.dumps({k: _plain(v) for k, v in data.items()}))
+
+    def close(self):
+        self.out.write("\n}\n")
+
+
+WRITERS = {"grid": GridWriter, "csv": CsvWriter, "json": JsonWriter}
+
+
+# ------------------------
+# CLI
+# ------------------------
+
+def print_database(output_format="grid", sections=SECTIONS, username=None,
+                   offset=0, limit=None, page_size=500, stats_only=False, out=sys.stdout):
+    if stats_only:
+        sections = ("stats",)
+
     db = SessionLocal()
-    
+    writer = WRITERS[output_format](out, page_size)
     try:
-        print("\n" + "="*100)
-        print("EXPENSE DATABASE CONTENTS")
-        print("="*100)
-        
-        # Get all users
-        users = db.query(User).all()
-        
-        if not users:
-            print("\n[No users found in database]\n")
-        else:
-            # Print users table
-            print("\n\n📋 USERS TABLE")
-            print("-"*100)
-            users_data = []
-            for user in users:
-                users_data.append([user.id, user.username])
-            print(tabulate(users_data, headers=["User ID", "Username"], tablefmt="grid", numalign="center"))
-            
-            # Print expenses table
-            print("\n\n💰 EXPENSES TABLE")
-            print("-"*100)
-            all_expenses = db.query(Expense).all()
-            
-            if not all_expenses:
-                print("[No expenses found in database]\n")
-            else:
-                expenses_data = []
-                for expense in all_expenses:
-                    user = db.query(User).filter(User.id == expense.user_id).first()
-                    username = user.username if user else "Unknown"
-                    expenses_data.append([
-                        expense.id,
-                        username,
-                        expense.title,
-                        f"${expense.amount:.2f}",
-                        expense.category,
-                        str(expense.date)
-                    ])
-                print(tabulate(expenses_data, 
-                             headers=["Expense ID", "Username", "Title", "Amount", "Category", "Date"], 
-                             tablefmt="grid",
-                             numalign="right"))
-            
-            # Print expenses by user
-            print("\n\n👤 EXPENSES BY USER")
-            print("-"*100)
-            for user in users:
-                expenses = db.query(Expense).filter(Expense.user_id == user.id).all()
-                print(f"\n{user.username} (User ID: {user.id})")
-                if not expenses:
-                    print("  [No expenses]")
-                else:
-                    exp_data = []
-                    for expense in expenses:
-                        exp_data.append([
-                            expense.id,
-                            expense.title,
-                            f"${expense.amount:.2f}",
-                            expense.category,
-                            str(expense.date)
-                        ])
-                    print(tabulate(exp_data,
-                                 headers=["ID", "Title", "Amount", "Category", "Date"],
-                                 tablefmt="simple",
-                                 numalign="right"))
-        
-        # Print summary statistics
-        total_users = db.query(User).count()
-        total_expenses = db.query(Expense).count()
-        total_amount = sum([e.amount for e in db.query(Expense).all()]) if total_expenses > 0 else 0
-        
-        print("\n\n📊 SUMMARY STATISTICS")
-        print("-"*100)
-        summary_data = [
-            ["Total Users", total_users],
-            ["Total Expenses", total_expenses],
-            ["Total Amount Spent", f"${total_amount:.2f}"],
-            ["Average Expense", f"${total_amount/total_expenses:.2f}" if total_expenses > 0 else "$0.00"]
-        ]
-        print(tabulate(summary_data, headers=["Metric", "Value"], tablefmt="grid", numalign="right"))
-        print("="*100 + "\n")
-        
-    except Exception as e:
-        print(f"\nError reading database: {e}\n")
+        if "users" in sections:
+            writer.section("USERS", _rows(paged(users_query(db, username), offset, limit)))
+        if "expenses" in sections:
+            writer.section("EXPENSES", _rows(paged(expenses_query(db, username), offset, limit)))
+        if "stats" in sections:
+            writer.stats(stats(db, username))
+        writer.close()
     finally:
         db.close()
 
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--format", choices=sorted(WRITERS), default="grid")
+    parser.add_argument("--section", action="append", choices=SECTIONS,
+                        help="limit the report to these sections (repeatable)")
+    parser.add_argument("--stats-only", action="store_true",
+                        help="only print aggregates; never loads individual rows")
+    parser.add_argument("--user", help="restrict the report to one username")
+    parser.add_argument("--offset", type=int, default=0, help="rows to skip per section")
+    parser.add_argument("--limit", type=int, help="maximum rows per section")
+    parser.add_argument("--page-size", type=int, default=500,
+                        help="rows per printed table in grid format")
+    parser.add_argument("--echo-sql", action="store_true", help="log the SQL statements issued")
+    args = parser.parse_args(argv)
+
+    if args.echo_sql:
+        logging.basicConfig()
+        logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
+
+    try:
+        print_database(
+            output_format=args.format,
+            sections=tuple(args.section or SECTIONS),
+            username=args.user,
+            offset=args.offset,
+            limit=args.limit,
+            page_size=args.page_size,
+            stats_only=args.stats_only,
+        )
+    except BrokenPipeError:
+        # output piped into `head` and friends
+        sys.stderr.close()
+        return 0
+    except Exception as e:
+        print(f"\nError reading database: {e}\n", file=sys.stderr)
+        return 1
+    return 0
+
+
 if __name__ == "__main__":
-    print_database()
+    sys.exit(main())
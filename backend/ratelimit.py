@@ -0,0 +1,222 @@
+"""
+Token-bucket rate limiting at the API edge.
+
+`RateLimitMiddleware` runs before routing, so a rejected request costs a
+bucket lookup and nothing else: no dependency, session or query. Every
+request takes a token from its client IP's bucket and, when it carries a
+valid access token, from its user's bucket. Some routes also take from a
+bucket of their own:
+
+    auth      POST /auth/login and /auth/register, per IP (bcrypt bound)
+    summary   GET /expenses/summary/* and /expenses/insights, per user
+
+A bucket holds up to `burst` tokens and refills at `rate` per second, so
+short bursts pass untouched and only sustained traffic above the rate is
+answered 429 with a Retry-After header. Limits are "<count>/<s|m|h>,<burst>"
+strings (RATE_LIMIT_IP, RATE_LIMIT_USER, RATE_LIMIT_AUTH,
+RATE_LIMIT_SUMMARY); RATE_LIMIT=0 turns limiting off.
+
+Buckets live in process memory by default. Setting RATE_LIMIT_URL
+(redis://...) shares them between API replicas. Behind a proxy, run
+uvicorn with --proxy-headers (and FORWARDED_ALLOW_IPS) so the client IP is
+the caller's, not the proxy's.
+"""
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from typing import Optional
+
+from starlette.responses import JSONResponse
+
+import auth
+
+RATE_LIMIT = os.getenv("RATE_LIMIT", "1") != "0"
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+Limit = namedtuple("Limit", ["rate", "burst"])  # tokens per second, bucket size
+
+_PERIODS = {"s": 1, "m": 60, "h": 3600}
+
+
+def parse_limit(value: str) -> Limit:
+    """'10/m,5' -> 10 per minute with bursts of 5 (the burst defaults to the count)."""
+    amount, _, burst = value.partition(",")
+    count, _, period = amount.strip().partition("/")
+    count = float(count)
+    return Limit(count / _PERIODS[period.strip() or "s"], float(burst) if burst else count)
+
+
+LIMITS = {
+    "ip": parse_limit(os.getenv("RATE_LIMIT_IP", "100/s,200")),
+    "user": parse_limit(os.getenv("RATE_LIMIT_USER", "30/s,60")),
+    "auth": parse_limit(os.getenv("RATE_LIMIT_AUTH", "20/m,10")),
+    "summary": parse_limit(os.getenv("RATE_LIMIT_SUMMARY", "5/s,20")),
+}
+
+# (limit, method, path prefixes, keyed by "ip" or "user")
+ROUTE_LIMITS = [
+    ("auth", "POST", ("/auth/login", "/auth/register"), "ip"),
+    ("summary", "GET", ("/expenses/summary", "/expenses/insights"), "user"),
+]
+
+
+# ------------------------
+# Stores
+# ------------------------
+
+class MemoryStore:
+    """Buckets in this process, least recently used dropped beyond max_keys."""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, monotonic time)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: Limit, cost: float = 1.0) -> float:
+        """Take `cost` tokens; 0 when allowed, else seconds until they would be."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp = self._buckets.get(key, (limit.burst, now))
+            tokens = min(limit.burst, tokens + (now - stamp) * limit.rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / limit.rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class RedisStore:
+    """Buckets shared by every API replica; one atomic script per take."""
+
+    SCRIPT = """
+    local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+    local tokens = tonumber(bucket[1]) or burst
+    local stamp = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - stamp) * rate)
+    local wait = 0
+    if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'stamp', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, url: str, prefix: str = "ratelimit:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._take = self.client.register_script(self.SCRIPT)
+
+    def take(self, key: str, limit: Limit, cost: float = 1.0) -> float:
+        # the server's clock, so replicas agree on refills
+        seconds, micros = self.client.time()
+        now = seconds + micros / 1_000_000
+        return float(self._take(keys=[self.prefix + key], args=[limit.rate, limit.burst, cost, now]))
+
+    def clear(self):
+        for key in self.client.scan_iter(f"{self.prefix}*"):
+            self.client.delete(key)
+
+
+_store = RedisStore(RATE_LIMIT_URL) if RATE_LIMIT_URL else MemoryStore()
+
+rejected = 0
+
+
+def set_store(store):
+    """Plug in any object with take/clear, e.g. a shared store."""
+    global _store
+    _store = store
+
+
+def clear():
+    global rejected
+    _store.clear()
+    rejected = 0
+
+
+# ------------------------
+# Checks
+# ------------------------
+
+def client_ip(scope) -> str:
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def access_token(scope) -> Optional[str]:
+    for name, value in scope.get("headers", ()):
+        if name == b"cookie":
+            for part in value.decode("latin-1").split(";"):
+                key, _, token = part.strip().partition("=")
+                if key == "access_token":
+                    return token.strip('"') or None
+    return None
+
+
+def request_user_id(scope) -> Optional[int]:
+    """The user of a valid access token cookie, cached on the scope."""
+    state = scope.setdefault("state", {})
+    if "token_user_id" not in state:
+        token = access_token(scope)
+        state["token_user_id"] = auth.token_user_id(token) if token else None
+    return state["token_user_id"]
+
+
+def check(scope) -> float:
+    """Take this request's tokens; 0 when it may proceed, else the seconds to wait."""
+    method, path = scope["method"], scope["path"]
+    keys = {"ip": client_ip(scope)}
+    buckets = [("ip", f"ip:{keys['ip']}")]
+    user_id = request_user_id(scope)
+    if user_id is not None:
+        keys["user"] = str(user_id)
+        buckets.append(("user", f"user:{user_id}"))
+    for name, route_method, prefixes, keyed_by in ROUTE_LIMITS:
+        if method == route_method and path.startswith(prefixes) and keyed_by in keys:
+            buckets.append((name, f"{name}:{keys[keyed_by]}"))
+
+    for name, key in buckets:
+        wait = _store.take(key, LIMITS[name])
+        if wait:
+            return wait
+    return 0.0
+
+
+class RateLimitMiddleware:
+    """Pure ASGI middleware: answers 429 before the request reaches the app."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global rejected
+        if scope["type"] != "http" or not RATE_LIMIT:
+            await self.app(scope, receive, send)
+            return
+
+        wait = check(scope)
+        if wait:
+            rejected += 1
+            response = JSONResponse(
+                {"detail": "Too many requests"},
+                status_code=429,
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
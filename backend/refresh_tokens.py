@@ -0,0 +1,138 @@
+"""
+Rotating refresh tokens.
+
+Access tokens live for auth.ACCESS_TOKEN_EXPIRE_MINUTES and are checked
+from their claims alone. When one expires, the client posts its refresh
+token cookie to /auth/refresh. It gets a new access token and a new
+refresh token, and the old refresh token is revoked. No password is
+involved, so bcrypt only runs at login.
+
+Only the SHA-256 of a token is stored. The tokens are 256 random bits,
+so a slow hash would add nothing. A rotated token that is presented
+again has been copied, so its whole family is revoked: every token
+descended from the same login. Requests that race the rotation (two
+tabs refreshing at once) get a grace period instead: RefreshRaced, which
+/auth/refresh answers with 409 and leaves the cookies the winning
+request set alone. Bumping
+users.token_version revokes every refresh token issued before it, and
+every access token too (see principals).
+"""
+
+import hashlib
+import os
+import secrets
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import update
+
+import models
+import principals
+
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+ROTATION_GRACE_SECONDS = int(os.getenv("REFRESH_ROTATION_GRACE_SECONDS", "10"))
+
+
+class InvalidRefreshToken(Exception):
+    """Unknown, expired, revoked or reused; the client has to log in again."""
+
+
+class RefreshRaced(Exception):
+    """Rotated moments ago by a concurrent request; its successor is the current token."""
+
+
+def _hash(raw: str) -> str:
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def issue(db, user_id: int, token_version: int, family: Optional[str] = None) -> str:
+    """Add a refresh token (committed by the caller) and return its raw value."""
+    raw = secrets.token_urlsafe(32)
+    db.add(models.RefreshToken(
+        user_id=user_id,
+        token_hash=_hash(raw),
+        family=family or secrets.token_hex(16),
+        token_version=token_version or 0,
+        expires_at=datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    ))
+    return raw
+
+
+def login(db, user_id: int, token_version: int) -> str:
+    raw = issue(db, user_id, token_version)
+    db.commit()
+    return raw
+
+
+def _revoke_family(db, family: str, now: datetime):
+    db.execute(
+        update(models.RefreshToken)
+        .where(models.RefreshToken.family == family, models.RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=now)
+    )
+
+
+def _has_successor(db, token) -> bool:
+    """Whether the family still has a live token issued when `token` was rotated."""
+    return db.query(
+        db.query(models.RefreshToken.id)
+        .filter(
+            models.RefreshToken.family == token.family,
+            models.RefreshToken.revoked_at.is_(None),
+            models.RefreshToken.created_at >= token.revoked_at,
+        )
+        .exists()
+    ).scalar()
+
+
+def rotate(db, raw: str) -> tuple[principals.Principal, str]:
+    """Trade a refresh token for its successor; returns (principal, new raw token)."""
+    token = (
+        db.query(models.RefreshToken)
+        .filter(models.RefreshToken.token_hash == _hash(raw))
+        .with_for_update()
+        .first()
+    )
+    if token is None:
+        raise InvalidRefreshToken()
+
+    now = datetime.utcnow()
+    if token.revoked_at is not None:
+        if now - token.revoked_at <= timedelta(seconds=ROTATION_GRACE_SECONDS) and _has_successor(db, token):
+            raise RefreshRaced()
+        if now - token.revoked_at > timedelta(seconds=ROTATION_GRACE_SECONDS):
+            _revoke_family(db, token.family, now)
+            db.commit()
+        raise InvalidRefreshToken()
+    if token.expires_at <= now:
+        raise InvalidRefreshToken()
+
+    principal = principals.load(db, token.user_id)
+    token.revoked_at = now
+    if principal is None or principal.token_version != token.token_version:
+        db.commit()
+        raise InvalidRefreshToken()
+
+    new_raw = issue(db, principal.id, principal.token_version, token.family)
+    db.commit()
+    return principal, new_raw
+
+
+def logout(db, raw: str):
+    """Revoke the family of the presented token: this login, on this device."""
+    token = (
+        db.query(models.RefreshToken.family)
+        .filter(models.RefreshToken.token_hash == _hash(raw))
+        .first()
+    )
+    if token is not None:
+        _revoke_family(db, token.family, datetime.utcnow())
+        db.commit()
+
+
+def logout_everywhere(db, user_id: int):
+    """Bump the user's token version: every access and refresh token stops working."""
+    user = db.get(models.User, user_id)
+    if user is not None:
+        user.token_version = (user.token_version or 0) + 1
+        db.commit()
@@ -1,5 +1,16 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, PlainSerializer
 from datetime import date
+from decimal import Decimal
+from typing import Annotated, Optional
+
+import money
+
+# parsed exactly (at most two decimal places), sent as a JSON number
+Money = Annotated[
+    Decimal,
+    Field(max_digits=money.MAX_DIGITS, decimal_places=2),
+    PlainSerializer(float, return_type=float, when_used="json"),
+]
 
 class UserCreate(BaseModel):
     username: str
@@ -7,12 +18,38 @@ class UserCreate(BaseModel):
 
 class ExpenseCreate(BaseModel):
     title: str
-    amount: float
+    amount: Money
     category: str
     date: date
 
+class ExpenseImport(ExpenseCreate):
+    external_id: Optional[str] = None
+
+class BulkImportError(BaseModel):
+    row: int
+    external_id: Optional[str] = None
+    error: str
+
+class BulkImportResult(BaseModel):
+    inserted: int = 0
+    updated: int = 0
+    failed: int = 0
+    errors: list[BulkImportError] = []
+
 class ExpenseResponse(ExpenseCreate):
     id: int
 
     class Config:
         from_attributes = True
+
+class ExpenseSearchResult(ExpenseResponse):
+    score: float
+
+class BudgetCreate(BaseModel):
+    limit: Annotated[Money, Field(gt=0)]
+
+class ExpenseChanges(BaseModel):
+    upserted: list[ExpenseResponse]
+    deleted: list[int]
+    next_token: str
+    has_more: bool
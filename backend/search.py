@@ -0,0 +1,260 @@
+"""
+Ranked search over expense titles and categories.
+
+On Postgres the query runs against two GIN expression indexes created by
+migration 7: a `simple` tsvector for whole-word matches and a pg_trgm
+index for substring and fuzzy (typo tolerant) matches. The rank adds
+ts_rank and word_similarity.
+
+Other databases (SQLite in development and tests) use an in-process
+inverted index per user: token -> expense ids, plus trigram -> token for
+fuzzy lookups. It is built on a user's first search and then kept current
+by reading only the rows whose change_seq moved past the last one it saw,
+the same feed /expenses/changes serves. Indexes for the least recently
+searching users are dropped past SEARCH_INDEX_USERS.
+
+Results are ordered by (score, id) descending. Pages are rank ordered, so
+the cursor is an opaque offset rather than a keyset.
+"""
+
+import heapq
+import os
+import re
+import threading
+from collections import OrderedDict, defaultdict
+
+from sqlalchemy import func, literal, literal_column, or_
+
+import listing
+import models
+
+SEARCH_INDEX_USERS = int(os.getenv("SEARCH_INDEX_USERS", "100"))
+MAX_OFFSET = 10_000
+
+EXACT_WEIGHT = 1.0
+PREFIX_WEIGHT = 0.75
+FUZZY_WEIGHT = 0.5
+FUZZY_MIN_SIMILARITY = 0.35
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def trigrams(token: str) -> set:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# ------------------------
+# Postgres
+# ------------------------
+
+def _pg_search(db, user_id: int, q: str, offset: int, limit: int) -> list:
+    expense = models.Expense
+    # must match the indexed expressions in migration 7 exactly
+    doc = expense.title + literal_column("' '") + expense.category
+    config = literal_column("'simple'")
+    tsv = func.to_tsvector(config, doc)
+    tsq = func.websearch_to_tsquery(config, q)
+    lowered = func.lower(doc)
+    needle = q.lower()
+
+    score = (func.ts_rank(tsv, tsq) + func.word_similarity(needle, lowered)).label("score")
+    rows = (
+        db.query(
+            expense.id, expense.title, expense.amount, expense.category, expense.date, score
+        )
+        .filter(
+            expense.user_id == user_id,
+            expense.deleted_at.is_(None),
+            or_(
+                tsv.op("@@")(tsq),
+                literal(needle).op("<%")(lowered),
+                lowered.contains(needle, autoescape=True),
+            ),
+        )
+        .order_by(score.desc(), expense.id.desc())
+        .offset(offset)
+        .limit(limit + 1)
+        .all()
+    )
+    return [{**listing.expense_row_to_dict(row), "score": round(float(row.score), 4)} for row in rows]
+
+
+# ------------------------
+# In-process index
+# ------------------------
+
+class UserIndex:
+    """Inverted index of one user's live expenses."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.seen_seq = -1
+        self.docs = {}                     # expense id -> tokens
+        self.postings = defaultdict(set)   # token -> expense ids
+        self.grams = defaultdict(set)      # trigram -> tokens
+
+    def _remove(self, expense_id: int):
+        for token in self.docs.pop(expense_id, ()):
+            ids = self.postings[token]
+            ids.discard(expense_id)
+            if not ids:
+                del self.postings[token]
+                for gram in trigrams(token):
+                    self.grams[gram].discard(token)
+
+    def _add(self, expense_id: int, text: str):
+        tokens = tuple(set(tokenize(text)))
+        self.docs[expense_id] = tokens
+        for token in tokens:
+            if token not in self.postings:
+                for gram in trigrams(token):
+                    self.grams[gram].add(token)
+            self.postings[token].add(expense_id)
+
+    def refresh(self, db, user_id: int):
+        """Apply every change since the last refresh (a full build the first time)."""
+        expense = models.Expense
+        purged_seq = (
+            db.query(models.User.purged_seq).filter(models.User.id == user_id).scalar() or 0
+        )
+        if purged_seq > self.seen_seq >= 0:
+            # tombstones we never saw are gone; start over
+            self._reset()
+
+        query = db.query(
+            expense.id, expense.title, expense.category, expense.deleted_at, expense.change_seq
+        ).filter(expense.user_id == user_id, expense.change_seq > self.seen_seq)
+        for row in query.yield_per(listing.STREAM_BATCH_SIZE):
+            self._remove(row.id)
+            if row.deleted_at is None:
+                self._add(row.id, f"{row.title} {row.category}")
+            self.seen_seq = max(self.seen_seq, row.change_seq)
+
+    def _term_weights(self, term: str) -> dict:
+        weights = {}
+        if term in self.postings:
+            weights[term] = EXACT_WEIGHT
+        if len(term) >= 2:
+            for token in self.postings:
+                if token != term and token.startswith(term):
+                    weights[token] = PREFIX_WEIGHT
+        term_grams = trigrams(term)
+        candidates = set()
+        for gram in term_grams:
+            candidates |= self.grams.get(gram, set())
+        for token in candidates:
+            if token in weights:
+                continue
+            token_grams = trigrams(token)
+            similarity = len(term_grams & token_grams) / len(term_grams | token_grams)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                weights[token] = FUZZY_WEIGHT * similarity
+        return weights
+
+    def _term_levels(self, term: str) -> list:
+        """Disjoint (weight, expense ids) groups, each id at its best weight."""
+        levels = []
+        seen = set()
+        for token, weight in sorted(self._term_weights(term).items(), key=lambda item: -item[1]):
+            ids = self.postings[token] - seen
+            if ids:
+                levels.append((weight, ids))
+                seen |= ids
+        return levels
+
+    def rank(self, q: str, count: int) -> list:
+        """The top `count` (expense id, score) pairs."""
+        terms = set(tokenize(q))
+        if len(terms) == 1:
+            # one term: the levels are already in score order, so only the
+            # highest ids of each level are needed (set ops stay in C)
+            ranked = []
+            levels = self._term_levels(terms.pop())
+            for weight, ids in sorted(levels, key=lambda level: -level[0]):
+                if len(ranked) >= count:
+                    break
+                ranked.extend((expense_id, weight) for expense_id in heapq.nlargest(count - len(ranked), ids))
+            return ranked
+
+        scores = defaultdict(float)
+        for term in terms:
+            for weight, ids in self._term_levels(term):
+                for expense_id in ids:
+                    scores[expense_id] += weight
+        return heapq.nsmallest(count, scores.items(), key=lambda item: (-item[1], -item[0]))
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _user_index(user_id: int) -> UserIndex:
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+        if index is None:
+            index = _indexes[user_id] = UserIndex()
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > SEARCH_INDEX_USERS:
+            _indexes.popitem(last=False)
+        return index
+
+
+def clear():
+    with _indexes_lock:
+        _indexes.clear()
+
+
+def _memory_search(db, user_id: int, q: str, offset: int, limit: int) -> list:
+    index = _user_index(user_id)
+    with index.lock:
+        index.refresh(db, user_id)
+        ranked = index.rank(q, offset + limit + 1)[offset:]
+    if not ranked:
+        return []
+
+    expense = models.Expense
+    # primary key lookups only; with a user_id filter SQLite picks the
+    # (user_id, date, id) index and scans the whole account instead
+    rows = (
+        db.query(
+            expense.id, expense.title, expense.amount, expense.category, expense.date,
+            expense.user_id, expense.deleted_at,
+        )
+        .filter(expense.id.in_([expense_id for expense_id, _ in ranked]))
+        .all()
+    )
+    by_id = {
+        row.id: row for row in rows
+        if row.user_id == user_id and row.deleted_at is None
+    }
+    return [
+        {**listing.expense_row_to_dict(by_id[expense_id]), "score": round(score, 4)}
+        for expense_id, score in ranked
+        if expense_id in by_id
+    ]
+
+
+# ------------------------
+# Entry point
+# ------------------------
+
+def search_expenses(db, user_id: int, q: str, cursor, limit: int):
+    """One rank-ordered page of matches and the cursor of the next page, if any."""
+    offset = listing.decode_id_cursor(cursor) if cursor else 0
+    offset = min(offset, MAX_OFFSET)
+    if db.get_bind().dialect.name == "postgresql":
+        results = _pg_search(db, user_id, q, offset, limit)
+    else:
+        results = _memory_search(db, user_id, q, offset, limit)
+
+    if len(results) > limit:
+        return results[:limit], listing.encode_id_cursor(offset + limit)
+    return results, None
@@ -0,0 +1,164 @@
+"""
+Single-flight coalescing of identical concurrent GETs.
+
+When a GET arrives while an identical GET (same access token, path,
+query string, If-None-Match and Accept) is still being served, it does
+not run the route again: it waits for that request and is sent a copy of
+its response. React StrictMode double renders and bursts of refreshes
+cost one round of dependencies, queries and serialization instead of
+several. Requests that arrive alone go straight through.
+
+Keying on the token itself, not just the user, means a revoked or
+outdated token never shares the response of a current one. The key also
+holds the user's write stamp, which changes when one of their
+POST/PUT/PATCH/DELETE requests starts and again when it sends its
+response, so a GET sent after a write never joins one that started
+before the write committed. Stamps live in this process, like the
+requests being coalesced; a write served by another worker is not seen,
+so with several workers and no sticky routing, read-your-writes after a
+write on another worker holds only once the earlier GET has finished.
+
+Only responses up to SINGLEFLIGHT_MAX_BYTES are shared. As soon as the
+first request's body grows past that (large exports), the waiting ones are
+released to run on their own. Requests without a valid access token, and
+Range requests (partial downloads of job results), are never coalesced.
+SINGLEFLIGHT=0 turns it off.
+"""
+
+import asyncio
+import itertools
+import os
+from collections import OrderedDict
+
+import ratelimit
+
+SINGLEFLIGHT = os.getenv("SINGLEFLIGHT", "1") != "0"
+SINGLEFLIGHT_MAX_BYTES = int(os.getenv("SINGLEFLIGHT_MAX_BYTES", str(1024 * 1024)))
+
+_VARY_HEADERS = (b"if-none-match", b"accept")
+
+SINGLEFLIGHT_MAX_USERS = int(os.getenv("SINGLEFLIGHT_MAX_USERS", "100000"))
+_WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+# key -> future of (response start message, body), or None when not shared
+_inflight = {}
+coalesced = 0
+
+# user id -> stamp of their latest write, least recently written dropped
+# beyond SINGLEFLIGHT_MAX_USERS; a dropped user reads the highest dropped
+# stamp, which is still newer than any stamp their earlier GETs were keyed on
+_writes = OrderedDict()
+_dropped = 0
+_stamps = itertools.count(1)
+
+
+def stamp_write(user_id: int):
+    global _dropped
+    _writes[user_id] = next(_stamps)
+    _writes.move_to_end(user_id)
+    while len(_writes) > SINGLEFLIGHT_MAX_USERS:
+        _dropped = max(_dropped, _writes.popitem(last=False)[1])
+
+
+def write_stamp(user_id: int) -> int:
+    return _writes.get(user_id, _dropped)
+
+
+def request_key(scope, token: str, user_id: int) -> tuple:
+    headers = {name: value for name, value in scope.get("headers", ()) if name in _VARY_HEADERS}
+    return (
+        token,
+        write_stamp(user_id),
+        scope["path"],
+        scope.get("query_string", b""),
+        *(headers.get(name) for name in _VARY_HEADERS),
+    )
+
+
+def clear():
+    global coalesced, _dropped
+    _inflight.clear()
+    _writes.clear()
+    coalesced = 0
+    _dropped = 0
+
+
+class SingleFlightMiddleware:
+    """Pure ASGI middleware; the first of identical requests serves them all."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global coalesced
+        if scope["type"] != "http" or not SINGLEFLIGHT:
+            await self.app(scope, receive, send)
+            return
+        if scope["method"] in _WRITE_METHODS:
+            await self.write(scope, receive, send)
+            return
+        user_id = ratelimit.request_user_id(scope) if scope["method"] == "GET" else None
+        ranged = any(name == b"range" for name, _ in scope.get("headers", ()))
+        if ranged or user_id is None:
+            await self.app(scope, receive, send)
+            return
+
+        key = request_key(scope, ratelimit.access_token(scope), user_id)
+        leader = _inflight.get(key)
+        if leader is not None:
+            shared = await asyncio.shield(leader)
+            if shared is None:
+                await self.app(scope, receive, send)
+                return
+            coalesced += 1
+            start, body = shared
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        _inflight[key] = future
+        start, chunks, size = None, [], 0
+
+        def release(shared):
+            if _inflight.get(key) is future:
+                del _inflight[key]
+            if not future.done():
+                future.set_result(shared)
+
+        async def capture(message):
+            nonlocal start, size
+            if not future.done():
+                if message["type"] == "http.response.start":
+                    start = message
+                elif message["type"] == "http.response.body":
+                    chunk = message.get("body", b"")
+                    size += len(chunk)
+                    if size > SINGLEFLIGHT_MAX_BYTES:
+                        release(None)
+                    else:
+                        chunks.append(chunk)
+                        if not message.get("more_body", False):
+                            release((start, b"".join(chunks)))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            release(None)
+
+    async def write(self, scope, receive, send):
+        """Run a write, stamping its user before it starts and once it has committed."""
+        user_id = ratelimit.request_user_id(scope)
+        if user_id is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def stamped(message):
+            # routes commit before they respond
+            if message["type"] == "http.response.start":
+                stamp_write(user_id)
+            await send(message)
+
+        stamp_write(user_id)
+        await self.app(scope, receive, stamped)
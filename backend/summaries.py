@@ -0,0 +1,335 @@
+"""
+Monthly rollups of expenses per (user, year, month, category).
+
+The rollup rows are kept current inside the same transaction as every
+expense write, so the summary endpoints read O(categories) rows instead
+of aggregating the user's raw expenses. The same writes keep the daily
+running totals in ledger.py current and evaluate budgets (budgets.py).
+
+Amounts are summed in integer cents and only converted for the response.
+"""
+
+from collections import defaultdict, namedtuple
+from datetime import date, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import Date, Integer, cast, delete, extract, func, insert, literal_column, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+import archive
+import budgets
+import ledger
+import models
+import money
+
+# amount in cents
+Entry = namedtuple("Entry", ["date", "category", "amount"])
+
+MAX_PERIODS = 1000
+
+_UPSERT_DIALECTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def month_bounds(year: int, month: int) -> tuple[date, date]:
+    """Half-open [first day of month, first day of next month) range."""
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+
+def parse_month(value: str) -> tuple[int, int]:
+    """Parse a 'YYYY-MM' query value."""
+    try:
+        year, month = (int(part) for part in value.split("-"))
+        date(year, month, 1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid month '{value}', expected YYYY-MM")
+    return year, month
+
+
+def period_start(day: date, granularity: str) -> date:
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day.replace(month=1, day=1)
+
+
+def next_period(start: date, granularity: str) -> date:
+    if granularity == "day":
+        return start + timedelta(days=1)
+    if granularity == "week":
+        return start + timedelta(days=7)
+    if granularity == "month":
+        return month_bounds(start.year, start.month)[1]
+    return start.replace(year=start.year + 1)
+
+
+def previous_period(start: date, granularity: str) -> date:
+    return period_start(start - timedelta(days=1), granularity)
+
+
+def period_expr(dialect: str, granularity: str, column):
+    """
+    SQL expression truncating `column` to the start of its period
+    (weeks start on Monday). Other dialects fall back to grouping by day
+    and the rows are bucketed in Python.
+    """
+    if dialect == "postgresql":
+        # inlined (granularity is whitelisted) so SELECT and GROUP BY match
+        unit = literal_column(f"'{granularity}'")
+        return cast(func.date_trunc(unit, column), Date)
+    if dialect == "sqlite":
+        if granularity == "day":
+            return column
+        if granularity == "week":
+            weekday = (cast(func.strftime("%w", column), Integer) + 6) % 7
+            return func.date(column, func.printf("-%d days", weekday))
+        if granularity == "month":
+            return func.strftime("%Y-%m-01", column)
+        return func.strftime("%Y-01-01", column)
+    return column
+
+
+def entry(expense) -> Entry:
+    return Entry(expense.date, expense.category, expense.amount_cents)
+
+
+# ------------------------
+# Write path
+# ------------------------
+
+def _apply_delta(db, user_id: int, year: int, month: int, category: str, amount, count: int) -> int:
+    """Add to one rollup row; returns its new total in cents."""
+    rollup = models.ExpenseRollup
+    key = {
+        "user_id": user_id,
+        "year": year,
+        "month": month,
+        "category": category,
+    }
+
+    upsert = _UPSERT_DIALECTS.get(db.get_bind().dialect.name)
+    if upsert is not None:
+        stmt = upsert(rollup).values(**key, total_cents=amount, count=count)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key),
+            set_={
+                "total_cents": rollup.total_cents + stmt.excluded.total_cents,
+                "count": rollup.count + stmt.excluded.count,
+            },
+        )
+        total = db.execute(stmt.returning(rollup.total_cents)).scalar_one()
+    else:
+        row = db.get(rollup, key, with_for_update=True)
+        if row is None:
+            db.add(rollup(**key, total_cents=amount, count=count))
+            db.flush()
+            total = amount
+        else:
+            row.total_cents += amount
+            row.count += count
+            total = row.total_cents
+
+    if count < 0:
+        db.execute(
+            delete(rollup).where(
+                *(getattr(rollup, k) == v for k, v in key.items()),
+                rollup.count <= 0,
+            )
+        )
+    return total
+
+
+def apply_many(db, user_id: int, removed=(), added=()):
+    """
+    Apply many expense changes at once: deltas are netted per
+    (year, month, category) so each rollup row is written at most once,
+    and per day for the ledger.
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    daily = defaultdict(lambda: (0, 0))
+    for items, sign in ((removed, -1), (added, 1)):
+        for item in items:
+            cell = deltas[(item.date.year, item.date.month, item.category)]
+            cell[0] += sign * item.amount
+            cell[1] += sign
+            cents, count = daily[item.date]
+            daily[item.date] = (cents + sign * item.amount, count + sign)
+
+    changes = []
+    for (year, month, category), (amount, count) in deltas.items():
+        if count == 0 and amount == 0:
+            continue
+        total = _apply_delta(db, user_id, year, month, category, amount, count)
+        changes.append((year, month, category, total - amount, total))
+    ledger.apply_deltas(db, user_id, daily)
+    budgets.check(db, user_id, changes)
+
+
+def apply_change(db, user_id: int, before: Entry = None, after: Entry = None):
+    """
+    Move an expense's contribution from `before` to `after`.
+    Pass before=None for a create and after=None for a delete.
+    """
+    if before == after:
+        return
+    apply_many(
+        db,
+        user_id,
+        removed=[before] if before is not None else (),
+        added=[after] if after is not None else (),
+    )
+
+
+def rebuild(conn, user_id: int = None, year: int = None, month: int = None):
+    """
+    Recompute rollups from the raw expenses (and archived day totals), for
+    one user or everyone, optionally limited to a single month.
+    Works with both a Session and a Connection.
+    """
+    rollup = models.ExpenseRollup
+
+    start = end = None
+    clear = delete(rollup)
+    if user_id is not None:
+        clear = clear.where(rollup.user_id == user_id)
+    if year is not None and month is not None:
+        start, end = month_bounds(year, month)
+        clear = clear.where(rollup.year == year, rollup.month == month)
+
+    daily = archive.daily_totals(user_id, start, end)
+    year_col = cast(extract("year", daily.c.date), Integer)
+    month_col = cast(extract("month", daily.c.date), Integer)
+    source = select(
+        daily.c.user_id,
+        year_col,
+        month_col,
+        daily.c.category,
+        func.sum(daily.c.total_cents),
+        func.sum(daily.c.count),
+    ).group_by(daily.c.user_id, year_col, month_col, daily.c.category)
+
+    conn.execute(clear)
+    conn.execute(
+        insert(rollup).from_select(
+            ["user_id", "year", "month", "category", "total_cents", "count"], source
+        )
+    )
+
+
+# ------------------------
+# Read path
+# ------------------------
+
+def monthly_total(db, user_id: int, year: int, month: int):
+    rollup = models.ExpenseRollup
+    cents = (
+        db.query(func.sum(rollup.total_cents))
+        .filter(
+            rollup.user_id == user_id,
+            rollup.year == year,
+            rollup.month == month,
+        )
+        .scalar()
+    )
+    return money.to_float(cents) if cents is not None else None
+
+
+def category_totals(db, user_id: int, year: int, month: int):
+    rollup = models.ExpenseRollup
+    rows = (
+        db.query(rollup.category, rollup.total_cents)
+        .filter(
+            rollup.user_id == user_id,
+            rollup.year == year,
+            rollup.month == month,
+        )
+        .order_by(rollup.category)
+        .all()
+    )
+    return [(category, money.to_float(cents)) for category, cents in rows]
+
+
+def range_summary(db, user_id: int, start: date, end: date, granularity: str) -> dict:
+    """
+    Totals, counts and per-category breakdowns for every period between the
+    first day of `start` and the last day of `end`'s month, from a single
+    GROUP BY query. The period just before the range is included in the
+    query so the first period also gets a delta.
+    """
+    first = period_start(start, granularity)
+    lookback = previous_period(first, granularity)
+    last = month_bounds(end.year, end.month)[1]
+
+    periods = []
+    cursor = first
+    while cursor < last:
+        periods.append(cursor)
+        cursor = next_period(cursor, granularity)
+        if len(periods) > MAX_PERIODS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Range spans more than {MAX_PERIODS} {granularity} periods",
+            )
+
+    daily = archive.daily_totals(user_id, lookback, last)
+    bucket = period_expr(db.get_bind().dialect.name, granularity, daily.c.date)
+    rows = (
+        db.query(bucket, daily.c.category, func.sum(daily.c.total_cents), func.sum(daily.c.count))
+        .group_by(bucket, daily.c.category)
+        .all()
+    )
+
+    # all in cents until the response is built
+    totals = defaultdict(int)
+    counts = defaultdict(int)
+    by_category = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+    for bucket_value, category, total, count in rows:
+        if isinstance(bucket_value, str):
+            bucket_value = date.fromisoformat(bucket_value)
+        key = period_start(bucket_value, granularity)
+        totals[key] += total or 0
+        counts[key] += count
+        by_category[key][category][0] += total or 0
+        by_category[key][category][1] += count
+
+    def breakdown(cells):
+        return [
+            {"category": category, "total": money.to_float(total), "count": count}
+            for category, (total, count) in sorted(cells.items())
+        ]
+
+    result_periods = []
+    overall = defaultdict(lambda: [0, 0])
+    grand_total = 0
+    previous_total = totals.get(lookback, 0)
+    for key in periods:
+        total = totals.get(key, 0)
+        delta = total - previous_total
+        grand_total += total
+        result_periods.append({
+            "period": key.isoformat(),
+            "total": money.to_float(total),
+            "count": counts.get(key, 0),
+            "categories": breakdown(by_category.get(key, {})),
+            "delta": money.to_float(delta),
+            "delta_pct": round(delta / previous_total * 100, 2) if previous_total else None,
+        })
+        for category, (cat_total, cat_count) in by_category.get(key, {}).items():
+            overall[category][0] += cat_total
+            overall[category][1] += cat_count
+        previous_total = total
+
+    return {
+        "granularity": granularity,
+        "total": money.to_float(grand_total),
+        "count": sum(p["count"] for p in result_periods),
+        "categories": breakdown(overall),
+        "periods": result_periods,
+    }
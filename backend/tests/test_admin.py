@@ -44,4 +44,58 @@ def registration_and_login(client,username,password):
         
         
     
-    
\ No newline at end of file
+    
+
+def _login_as_admin(client, db, username):
+    client.post(
+        "/auth/register",
+        json={"username": username, "password": "Admin@1234"},
+    )
+    from models import User
+
+    admin = db.query(User).filter_by(username=username).first()
+    admin.is_admin = True
+    db.commit()
+    client.post(
+        "/auth/login",
+        json={"username": username, "password": "Admin@1234"},
+    )
+
+
+def test_admin_user_listing_is_paginated_and_projected(client, db):
+    _login_as_admin(client, db, "listadmin")
+    for name in ("listuser_a", "listuser_b"):
+        client.post(
+            "/auth/register",
+            json={"username": name, "password": "Test@1234"},
+        )
+
+    first = client.get("/admin/users?username=listuser&limit=1&count=true")
+    assert first.status_code == 200
+    assert first.json() == [{"id": first.json()[0]["id"], "username": "listuser_a", "is_admin": False}]
+    assert first.headers["X-Total-Count"] == "2"
+    assert first.headers["X-Total-Count-Estimated"] == "false"
+
+    second = client.get(
+        f"/admin/users?username=listuser&limit=1&fields=username&cursor={first.headers['X-Next-Cursor']}"
+    )
+    assert second.json() == [{"username": "listuser_b"}]
+    assert "X-Next-Cursor" not in second.headers
+
+    assert client.get("/admin/users?fields=password").status_code == 400
+
+
+def test_admin_expense_listing_filters_and_streams(client, db):
+    _login_as_admin(client, db, "expenseadmin")
+    client.post(
+        "/expenses",
+        json={"title": "Admin lunch", "amount": 12, "category": "AdminFood", "date": "2025-07-01"},
+    )
+    me = client.get("/auth/me").json()
+
+    res = client.get(f"/admin/expenses?user_id={me['id']}&category=AdminFood&fields=title,amount")
+    assert res.json() == [{"title": "Admin lunch", "amount": 12}]
+
+    streamed = client.get(f"/admin/expenses?user_id={me['id']}&format=ndjson&fields=id")
+    assert streamed.headers["content-type"].startswith("application/x-ndjson")
+    assert len(streamed.text.strip().splitlines()) == 1
@@ -10,3 +10,274 @@ def test_register_and_login(client):
         json={"username": "TESTUSER", "password": "Test@1234"},
     )
     assert login_res.status_code == 200
+
+
+def test_principal_cache_is_invalidated_when_admin_flag_changes(client, db):
+    client.post(
+        "/auth/register",
+        json={"username": "promoteduser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "promoteduser", "password": "Test@1234"},
+    )
+
+    # first call caches the principal as a non-admin
+    assert client.get("/auth/me").status_code == 200
+    assert client.get("/admin/users").status_code == 403
+
+    from models import User
+
+    user = db.query(User).filter_by(username="promoteduser").first()
+    user.is_admin = True
+    db.commit()
+
+    assert client.get("/admin/users").status_code == 200
+
+
+def test_bumping_token_version_revokes_existing_tokens(client, db):
+    client.post(
+        "/auth/register",
+        json={"username": "revokeduser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "revokeduser", "password": "Test@1234"},
+    )
+    assert client.get("/auth/me").status_code == 200
+
+    from models import User
+
+    user = db.query(User).filter_by(username="revokeduser").first()
+    user.token_version += 1
+    db.commit()
+
+    assert client.get("/auth/me").status_code == 401
+
+
+def test_login_reports_hash_timing(client):
+    client.post(
+        "/auth/register",
+        json={"username": "timinguser", "password": "Test@1234"},
+    )
+    res = client.post(
+        "/auth/login",
+        json={"username": "timinguser", "password": "Test@1234"},
+    )
+    assert res.status_code == 200
+    assert "hash-queue;dur=" in res.headers["Server-Timing"]
+    assert "hash;dur=" in res.headers["Server-Timing"]
+
+
+def test_hash_pool_rejects_calls_when_saturated():
+    import asyncio
+    import time
+
+    from fastapi import HTTPException
+
+    from auth import HashPool
+
+    pool = HashPool(kind="thread", workers=1, max_queue=0)
+
+    async def burst():
+        return await asyncio.gather(
+            pool.run(time.sleep, 0.2),
+            pool.run(time.sleep, 0.2),
+            return_exceptions=True,
+        )
+
+    try:
+        results = asyncio.run(burst())
+    finally:
+        pool.shutdown()
+
+    errors = [r for r in results if isinstance(r, HTTPException)]
+    assert len(errors) == 1
+    assert errors[0].status_code == 429
+
+
+def test_access_token_claims_authorize_without_queries(client):
+    client.post(
+        "/auth/register",
+        json={"username": "claimsuser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "claimsuser", "password": "Test@1234"},
+    )
+
+    res = client.get("/auth/me")
+    assert res.json()["username"] == "claimsuser"
+    assert 'desc="0 queries"' in res.headers["server-timing"]
+
+
+def test_refresh_tokens_rotate_and_detect_reuse(client, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import refresh_tokens
+    from app import app
+
+    client.post(
+        "/auth/register",
+        json={"username": "refreshuser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "refreshuser", "password": "Test@1234"},
+    )
+    first = client.cookies.get("refresh_token")
+
+    res = client.post("/auth/refresh")
+    assert res.status_code == 200
+    second = client.cookies.get("refresh_token")
+    assert second and second != first
+    assert client.get("/auth/me").status_code == 200
+
+    # replaying the rotated token revokes the whole family, including `second`
+    monkeypatch.setattr(refresh_tokens, "ROTATION_GRACE_SECONDS", -1)
+    thief = TestClient(app)
+    thief.cookies.set("refresh_token", first)
+    assert thief.post("/auth/refresh").status_code == 401
+    assert client.post("/auth/refresh").status_code == 401
+
+
+def test_refresh_race_within_grace_keeps_the_winners_cookies(client):
+    from fastapi.testclient import TestClient
+
+    from app import app
+
+    client.post(
+        "/auth/register",
+        json={"username": "racinguser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "racinguser", "password": "Test@1234"},
+    )
+    first = client.cookies.get("refresh_token")
+
+    # two tabs hold `first`; one rotates it, then rotates again
+    other_tab = TestClient(app)
+    other_tab.cookies.set("refresh_token", first)
+    assert client.post("/auth/refresh").status_code == 200
+    assert client.post("/auth/refresh").status_code == 200
+    current = client.cookies.get("refresh_token")
+
+    res = other_tab.post("/auth/refresh")
+    assert res.status_code == 409
+    assert "set-cookie" not in res.headers
+    assert client.cookies.get("refresh_token") == current
+    assert client.get("/auth/me").status_code == 200
+    assert client.post("/auth/refresh").status_code == 200
+
+    # after logout there is no successor: the old token is just invalid
+    client.post("/auth/logout")
+    assert other_tab.post("/auth/refresh").status_code == 401
+
+
+def test_logout_everywhere_revokes_access_and_refresh_tokens(client):
+    from fastapi.testclient import TestClient
+
+    from app import app
+
+    client.post(
+        "/auth/register",
+        json={"username": "everywhereuser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "everywhereuser", "password": "Test@1234"},
+    )
+    other_device = TestClient(app)
+    other_device.post(
+        "/auth/login",
+        json={"username": "everywhereuser", "password": "Test@1234"},
+    )
+    assert other_device.get("/auth/me").status_code == 200
+
+    assert client.post("/auth/logout?everywhere=true").status_code == 200
+    assert other_device.get("/auth/me").status_code == 401
+    assert other_device.post("/auth/refresh").status_code == 401
+
+
+class SharedBackend:
+    """Stands in for Redis: every instance over the same dict sees the same keys."""
+
+    def __init__(self, store: dict):
+        self.store = store
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, value):
+        self.store[key] = value
+
+    def delete(self, key):
+        self.store.pop(key, None)
+
+    def clear(self):
+        self.store.clear()
+
+
+def test_logout_everywhere_reaches_other_workers(client, monkeypatch):
+    import principals
+
+    for name in ("_backend", "_changes", "CACHE_ENABLED"):
+        monkeypatch.setattr(principals, name, getattr(principals, name))
+    cache, changes = {}, {}
+    principals.set_backend(SharedBackend(cache), SharedBackend(changes))
+
+    client.post(
+        "/auth/register",
+        json={"username": "workeruser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "workeruser", "password": "Test@1234"},
+    )
+    token = client.cookies.get("access_token")
+    assert client.get("/auth/me").status_code == 200
+    assert client.post("/auth/logout?everywhere=true").status_code == 200
+
+    # another worker, with its own backend instances over the same store
+    principals.set_backend(SharedBackend(cache), SharedBackend(changes))
+    assert client.get("/auth/me", headers={"Cookie": f"access_token={token}"}).status_code == 401
+
+    # a worker with a store of its own would still trust the old claims...
+    principals.set_backend(principals.MemoryBackend(), principals.MemoryBackend())
+    assert client.get("/auth/me", headers={"Cookie": f"access_token={token}"}).status_code == 200
+
+    # ...so without a shared store every request is checked against the database
+    monkeypatch.setattr(principals, "CACHE_ENABLED", False)
+    assert client.get("/auth/me", headers={"Cookie": f"access_token={token}"}).status_code == 401
+
+
+def test_login_and_users_are_rate_limited(client, monkeypatch):
+    import ratelimit
+
+    client.post(
+        "/auth/register",
+        json={"username": "limiteduser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "limiteduser", "password": "Test@1234"},
+    )
+
+    monkeypatch.setitem(ratelimit.LIMITS, "auth", ratelimit.parse_limit("2/m,2"))
+    for _ in range(2):
+        res = client.post(
+            "/auth/login",
+            json={"username": "limiteduser", "password": "Wrong@1234"},
+        )
+        assert res.status_code == 401
+    res = client.post(
+        "/auth/login",
+        json={"username": "limiteduser", "password": "Wrong@1234"},
+    )
+    assert res.status_code == 429
+    assert int(res.headers["retry-after"]) >= 1
+
+    monkeypatch.setitem(ratelimit.LIMITS, "user", ratelimit.parse_limit("1/m,3"))
+    assert [client.get("/auth/me").status_code for _ in range(4)] == [200, 200, 200, 429]
+    assert ratelimit.rejected == 2
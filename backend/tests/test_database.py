@@ -0,0 +1,164 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from database import InstrumentedQueuePool, pool_metrics
+from instrumentation import N_PLUS_ONE_THRESHOLD, RequestMetrics, statement_shape
+
+
+def test_instrumented_pool_records_waits_and_timeouts(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=InstrumentedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.1,
+    )
+    pool_metrics.reset()
+
+    held = engine.connect()
+    with pytest.raises(PoolTimeoutError):
+        engine.connect()
+    held.close()
+
+    assert pool_metrics.timeouts == 1
+    assert pool_metrics.wait_seconds_max >= 0.1
+    engine.dispose()
+
+
+def test_pool_stats_is_exposed_to_admins(client):
+    client.post(
+        "/auth/register",
+        json={"username": "poolviewer", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "poolviewer", "password": "Test@1234"},
+    )
+    assert client.get("/admin/pool").status_code == 403
+
+
+def test_statement_shapes_flag_repeated_queries():
+    metrics = RequestMetrics("/expenses")
+    for i in range(N_PLUS_ONE_THRESHOLD + 1):
+        metrics.record_query("SELECT * FROM expenses WHERE id = ?", 0.001)
+    metrics.record_query("SELECT * FROM expenses WHERE id IN (?, ?, ?)", 0.001)
+
+    assert statement_shape("SELECT 1 WHERE id IN (?, ?,\n ?)") == "SELECT 1 WHERE id IN (?)"
+    assert metrics.repeated_statements() == [
+        ("SELECT * FROM expenses WHERE id = ?", N_PLUS_ONE_THRESHOLD + 1)
+    ]
+    assert metrics.queries == N_PLUS_ONE_THRESHOLD + 2
+
+
+def test_requests_report_server_timing_and_metrics(client):
+    client.post(
+        "/auth/register",
+        json={"username": "timinguser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "timinguser", "password": "Test@1234"},
+    )
+
+    res = client.get("/expenses")
+    assert res.status_code == 200
+    timing = res.headers["server-timing"]
+    assert "handler;dur=" in timing
+    assert "db;dur=" in timing and "queries" in timing
+
+    body = client.get("/metrics").text
+    assert 'http_requests_total{method="GET",route="/expenses",status="200"}' in body
+    assert "http_db_queries_total" in body
+
+
+def test_health_and_readiness_report_schema_and_warmup(client, db, monkeypatch):
+    import migrations
+    from database import pool_warmup
+
+    assert client.get("/healthz").json() == {"status": "ok"}
+
+    res = client.get("/readyz")
+    body = res.json()
+    assert body["database"] == "ok"
+    assert body["pending_migrations"] == migrations.pending(db)
+    assert res.status_code == (503 if body["pending_migrations"] else 200)
+
+    monkeypatch.setattr(migrations, "pending", lambda session: [])
+    res = client.get("/readyz")
+    assert res.status_code == 200
+    assert res.json()["status"] == "ready"
+
+    monkeypatch.setattr(pool_warmup, "state", "warming")
+    res = client.get("/readyz")
+    assert res.status_code == 503
+    assert res.json()["pool"]["state"] == "warming"
+
+
+def test_count_estimate_explain_binds_filter_values():
+    from sqlalchemy import select
+    from sqlalchemy.dialects import postgresql
+
+    import listing
+    import models
+
+    statement = select(models.Expense.id).where(models.Expense.category == "rent:march")
+    compiled = listing.Explain(statement).compile(dialect=postgresql.dialect())
+    assert str(compiled).startswith("EXPLAIN (FORMAT JSON) SELECT")
+    assert "rent:march" not in str(compiled)
+    assert list(compiled.params.values()) == ["rent:march"]
+
+
+def test_async_sessions_serve_reads_writes_and_streams(client, db, monkeypatch):
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    import database
+    from app import app
+
+    url = db.get_bind().url
+    pytest.importorskip("aiosqlite" if url.get_backend_name() == "sqlite" else "asyncpg")
+    # what DB_ASYNC=1 sets up at import, against the test database
+    monkeypatch.setattr(database, "DB_ASYNC", True)
+    monkeypatch.setattr(database, "DATABASE_URL", url.render_as_string(hide_password=False))
+    monkeypatch.setattr(database, "_engines", {})
+    app.dependency_overrides[database.get_db] = database.get_async_db
+
+    calls = []
+    run_sync = AsyncSession.run_sync
+
+    async def counted(self, fn, *args, **kwargs):
+        calls.append(fn.__name__)
+        return await run_sync(self, fn, *args, **kwargs)
+
+    monkeypatch.setattr(AsyncSession, "run_sync", counted)
+    try:
+        client.post(
+            "/auth/register",
+            json={"username": "asyncuser", "password": "Test@1234"},
+        )
+        client.post(
+            "/auth/login",
+            json={"username": "asyncuser", "password": "Test@1234"},
+        )
+        for day in (1, 2, 3):
+            res = client.post(
+                "/expenses",
+                json={"title": f"Day {day}", "amount": day, "category": "Food", "date": f"2025-04-0{day}"},
+            )
+            assert res.status_code == 200
+        assert calls
+
+        assert [e["title"] for e in client.get("/expenses?limit=2").json()] == ["Day 3", "Day 2"]
+        assert client.get("/expenses/summary/monthly?month=4&year=2025").json()["total"] == 6
+
+        monkeypatch.setattr(database, "STREAM_PULL_SIZE", 2)
+        calls.clear()
+        lines = client.get("/expenses?format=ndjson").text.splitlines()
+        assert len(lines) == 3
+        # pulled in batches inside run_sync, not drained in one go
+        assert calls.count("pull") >= 2
+    finally:
+        import asyncio
+
+        asyncio.run(database.dispose_engines())
+
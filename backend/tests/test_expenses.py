@@ -1,3 +1,7 @@
+import ledger
+import models
+
+
 def test_create_and_get_expense(client):
     client.post(
         "/auth/register",
@@ -24,3 +28,838 @@ def test_create_and_get_expense(client):
     list_res = client.get("/expenses")
     assert list_res.status_code == 200
     assert len(list_res.json()) == 1
+
+
+def test_expenses_keyset_pagination_and_filters(client):
+    client.post(
+        "/auth/register",
+        json={"username": "pageuser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "pageuser", "password": "Test@1234"},
+    )
+
+    for title, amount, category, day in [
+        ("Rent", 900, "Rent", "2025-01-01"),
+        ("Bus", 20, "Transport", "2025-01-02"),
+        ("Dinner", 45, "Food", "2025-01-03"),
+    ]:
+        client.post(
+            "/expenses",
+            json={"title": title, "amount": amount, "category": category, "date": day},
+        )
+
+    first = client.get("/expenses?limit=2")
+    assert first.status_code == 200
+    assert [e["title"] for e in first.json()] == ["Dinner", "Bus"]
+    cursor = first.headers["X-Next-Cursor"]
+
+    second = client.get(f"/expenses?limit=2&cursor={cursor}")
+    assert [e["title"] for e in second.json()] == ["Rent"]
+    assert "X-Next-Cursor" not in second.headers
+
+    filtered = client.get("/expenses?category=Food&from=2025-01-02")
+    assert [e["title"] for e in filtered.json()] == ["Dinner"]
+
+    streamed = client.get("/expenses?format=ndjson&max_amount=100")
+    assert streamed.headers["content-type"].startswith("application/x-ndjson")
+    assert len(streamed.text.strip().splitlines()) == 2
+
+    assert client.get("/expenses?cursor=not-a-cursor").status_code == 400
+
+
+def test_summaries_follow_creates_updates_and_deletes(client):
+    client.post(
+        "/auth/register",
+        json={"username": "summaryuser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "summaryuser", "password": "Test@1234"},
+    )
+
+    lunch = client.post(
+        "/expenses",
+        json={"title": "Lunch", "amount": 30, "category": "Food", "date": "2025-03-31"},
+    ).json()
+    taxi = client.post(
+        "/expenses",
+        json={"title": "Taxi", "amount": 12.5, "category": "Transport", "date": "2025-03-01"},
+    ).json()
+
+    monthly = client.get("/expenses/summary/monthly?month=3&year=2025").json()
+    assert monthly["total"] == 42.5
+
+    # moving an expense into another month and category moves its rollup too
+    client.put(
+        f"/expenses/{lunch['id']}",
+        json={"title": "Lunch", "amount": 30, "category": "Dining", "date": "2025-04-01"},
+    )
+    client.delete(f"/expenses/{taxi['id']}")
+
+    assert client.get("/expenses/summary/monthly?month=3&year=2025").json()["total"] == 0
+    assert client.get("/expenses/summary/category?month=3&year=2025").json() == []
+    assert client.get("/expenses/summary/category?month=4&year=2025").json() == [
+        {"category": "Dining", "total": 30}
+    ]
+    assert client.get("/expenses/summary/monthly?month=13&year=2025").status_code == 422
+
+
+def test_range_summary_returns_periods_and_deltas(client):
+    client.post(
+        "/auth/register",
+        json={"username": "rangeuser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "rangeuser", "password": "Test@1234"},
+    )
+
+    for title, amount, category, day in [
+        ("Groceries", 50, "Food", "2025-01-15"),
+        ("Rent", 800, "Rent", "2025-02-01"),
+        ("Snacks", 10, "Food", "2025-02-20"),
+        ("Cinema", 20, "Entertainment", "2025-03-10"),
+    ]:
+        client.post(
+            "/expenses",
+            json={"title": title, "amount": amount, "category": category, "date": day},
+        )
+
+    res = client.get("/expenses/summary/range?start=2025-02&end=2025-03&granularity=month")
+    assert res.status_code == 200
+    data = res.json()
+
+    assert data["total"] == 830
+    assert data["count"] == 3
+    feb, mar = data["periods"]
+    assert feb["period"] == "2025-02-01"
+    assert feb["total"] == 810
+    assert feb["delta"] == 760  # compared with January, just outside the range
+    assert feb["categories"] == [
+        {"category": "Food", "total": 10, "count": 1},
+        {"category": "Rent", "total": 800, "count": 1},
+    ]
+    assert mar["delta"] == -790
+
+    weekly = client.get("/expenses/summary/range?start=2025-02&end=2025-02&granularity=week").json()
+    assert weekly["periods"][0]["period"] == "2025-01-27"
+    assert sum(p["count"] for p in weekly["periods"]) == 2
+
+    assert client.get("/expenses/summary/range?start=2025-03&end=2025-02").status_code == 400
+
+
+def test_bulk_import_upserts_and_reports_row_errors(client, monkeypatch):
+    client.post(
+        "/auth/register",
+        json={"username": "bulkuser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "bulkuser", "password": "Test@1234"},
+    )
+
+    first = client.post(
+        "/expenses/bulk",
+        json=[
+            {"title": "Coffee", "amount": 4, "category": "Food", "date": "2025-05-01", "external_id": "tx-1"},
+            {"title": "Train", "amount": 15, "category": "Transport", "date": "2025-05-02"},
+            {"title": "Broken", "amount": "lots", "category": "Food", "date": "2025-05-03"},
+        ],
+    ).json()
+    assert (first["inserted"], first["updated"], first["failed"]) == (2, 0, 1)
+    assert first["errors"][0]["row"] == 3
+
+    csv_body = (
+        "title,amount,category,date,external_id\n"
+        "\"Coffee, large\",5,Food,2025-05-01,tx-1\n"
+        "Book,12,Shopping,2025-05-04,tx-2\n"
+    )
+    second = client.post(
+        "/expenses/bulk",
+        content=csv_body,
+        headers={"Content-Type": "text/csv"},
+    ).json()
+    assert (second["inserted"], second["updated"], second["failed"]) == (1, 1, 0)
+
+    titles = sorted(e["title"] for e in client.get("/expenses").json())
+    assert titles == ["Book", "Coffee, large", "Train"]
+    assert client.get("/expenses/summary/monthly?month=5&year=2025").json()["total"] == 32
+
+    ndjson = client.post(
+        "/expenses/bulk",
+        content='{"title": "Gift", "amount": 30, "category": "Shopping", "date": "2025-05-05"}\nnot json\n',
+        headers={"Content-Type": "application/x-ndjson"},
+    ).json()
+    assert (ndjson["inserted"], ndjson["failed"]) == (1, 1)
+
+    # the same external id twice: the later row wins, the earlier is superseded
+    duplicates = [
+        {"title": "Pen", "amount": 2, "category": "Shopping", "date": "2025-05-06", "external_id": "tx-3"},
+        {"title": "Ink", "amount": 3, "category": "Shopping", "date": "2025-05-06", "external_id": "tx-3"},
+    ]
+    res = client.post("/expenses/bulk", json=duplicates).json()
+    assert (res["inserted"], res["updated"], res["failed"]) == (1, 1, 0)
+
+    # the user row is locked before existing external ids are looked up,
+    # so concurrent imports of the same ids cannot both see the old row
+    import bulk
+    import httpcache
+
+    calls = []
+    bump, lookup = httpcache.bump_data_version, bulk.select
+    monkeypatch.setattr(httpcache, "bump_data_version", lambda *a: calls.append("lock") or bump(*a))
+    monkeypatch.setattr(bulk, "select", lambda *a: calls.append("lookup") or lookup(*a))
+    client.post("/expenses/bulk", json=duplicates[:1])
+    assert calls == ["lock", "lookup"]
+
+    import summaries
+    from sqlalchemy.exc import OperationalError
+
+    def fail(*args, **kwargs):
+        raise OperationalError("UPDATE", {}, Exception("disk full"))
+
+    monkeypatch.setattr(summaries, "apply_many", fail)
+    for row in duplicates:
+        row["external_id"] = "tx-4"
+    res = client.post("/expenses/bulk", json=duplicates).json()
+    assert (res["inserted"], res["updated"], res["failed"]) == (0, 0, 2)
+    assert [error["row"] for error in res["errors"]] == [1, 2]
+
+
+def test_export_streams_csv_and_xlsx(client):
+    client.post(
+        "/auth/register",
+        json={"username": "exportuser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "exportuser", "password": "Test@1234"},
+    )
+    for title, amount, day in [("Old", 5, "2024-12-31"), ("New", 7.5, "2025-06-01")]:
+        client.post(
+            "/expenses",
+            json={"title": title, "amount": amount, "category": "Food", "date": day},
+        )
+
+    csv_res = client.get("/expenses/export?format=csv&from=2025-01-01")
+    assert csv_res.status_code == 200
+    assert csv_res.headers["content-type"].startswith("text/csv")
+    assert csv_res.text.splitlines() == ["Title,Amount,Category,Date", "New,7.5,Food,2025-06-01"]
+
+    xlsx_res = client.get("/expenses/export?format=xlsx")
+    assert xlsx_res.status_code == 200
+    assert "Expense_Report.xlsx" in xlsx_res.headers["content-disposition"]
+
+    import io
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(io.BytesIO(xlsx_res.content))
+    assert workbook.sheetnames == ["Expenses", "Summary"]
+    assert workbook["Expenses"].max_row == 4
+    assert workbook["Summary"]["B3"].value == 12.5
+
+
+def test_conditional_gets_follow_data_version(client):
+    client.post(
+        "/auth/register",
+        json={"username": "etaguser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "etaguser", "password": "Test@1234"},
+    )
+    client.post(
+        "/expenses",
+        json={"title": "Lunch", "amount": 12, "category": "Food", "date": "2025-06-02"},
+    )
+
+    listed = client.get("/expenses")
+    etag = listed.headers["ETag"]
+    assert listed.headers["Cache-Control"] == "private, no-cache"
+    not_modified = client.get("/expenses", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["ETag"] == etag
+    # a different query is a different representation
+    assert client.get("/expenses?limit=1", headers={"If-None-Match": etag}).status_code == 200
+
+    summary_url = "/expenses/summary/monthly?month=6&year=2025"
+    summary = client.get(summary_url)
+    assert summary.json()["total"] == 12
+    assert client.get(summary_url, headers={"If-None-Match": summary.headers["ETag"]}).status_code == 304
+
+    client.post(
+        "/expenses",
+        json={"title": "Dinner", "amount": 30, "category": "Food", "date": "2025-06-03"},
+    )
+    assert client.get("/expenses", headers={"If-None-Match": etag}).status_code == 200
+    refreshed = client.get(summary_url, headers={"If-None-Match": summary.headers["ETag"]})
+    assert refreshed.status_code == 200
+    assert refreshed.json()["total"] == 42
+
+    me = client.get("/auth/me")
+    assert client.get("/auth/me", headers={"If-None-Match": me.headers["ETag"]}).status_code == 304
+
+
+def test_changes_feed_returns_deltas_and_tombstones(client, db):
+    import crud
+
+    client.post(
+        "/auth/register",
+        json={"username": "syncuser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "syncuser", "password": "Test@1234"},
+    )
+    ids = [
+        client.post(
+            "/expenses",
+            json={"title": title, "amount": 10, "category": "Food", "date": "2025-07-01"},
+        ).json()["id"]
+        for title in ("A", "B", "C")
+    ]
+
+    first = client.get("/expenses/changes?limit=2").json()
+    assert [e["title"] for e in first["upserted"]] == ["A", "B"]
+    assert first["has_more"] is True
+    rest = client.get(f"/expenses/changes?since={first['next_token']}").json()
+    assert [e["title"] for e in rest["upserted"]] == ["C"]
+    assert rest["has_more"] is False
+    token = rest["next_token"]
+
+    client.put(
+        f"/expenses/{ids[0]}",
+        json={"title": "A2", "amount": 15, "category": "Food", "date": "2025-07-01"},
+    )
+    client.delete(f"/expenses/{ids[1]}")
+
+    delta = client.get(f"/expenses/changes?since={token}").json()
+    assert [e["title"] for e in delta["upserted"]] == ["A2"]
+    assert delta["deleted"] == [ids[1]]
+
+    # soft-deleted rows are gone from every read
+    assert ids[1] not in [e["id"] for e in client.get("/expenses").json()]
+    assert client.delete(f"/expenses/{ids[1]}").status_code == 404
+    summary = client.get("/expenses/summary/monthly?month=7&year=2025").json()
+    assert summary["total"] == 25
+
+    crud.purge_tombstones(db, older_than_days=0)
+    assert client.get(f"/expenses/changes?since={token}").status_code == 410
+    assert client.get(f"/expenses/changes?since={delta['next_token']}").status_code == 200
+    assert client.get("/expenses/changes?since=garbage").status_code == 400
+
+
+def test_fast_json_path_matches_model_path(client, monkeypatch):
+    import serialization
+
+    client.post(
+        "/auth/register",
+        json={"username": "fastjsonuser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "fastjsonuser", "password": "Test@1234"},
+    )
+    for day in ("2025-08-01", "2025-08-02", "2025-08-03"):
+        client.post(
+            "/expenses",
+            json={"title": "Coffee", "amount": 3.5, "category": "Food", "date": day},
+        )
+
+    regular = client.get("/expenses?limit=2")
+    monkeypatch.setattr(serialization, "FAST_JSON", True)
+    fast = client.get("/expenses?limit=2")
+
+    assert fast.json() == regular.json()
+    assert fast.headers["X-Next-Cursor"] == regular.headers["X-Next-Cursor"]
+    assert fast.headers["ETag"] == regular.headers["ETag"]
+
+
+def test_search_ranks_fuzzy_matches_and_follows_writes(client):
+    client.post(
+        "/auth/register",
+        json={"username": "searchuser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "searchuser", "password": "Test@1234"},
+    )
+    ids = {}
+    for title, category in [
+        ("Coffee beans", "Food"),
+        ("Coffee with Sam", "Food"),
+        ("Bus pass", "Transport"),
+        ("Lunch", "Food"),
+    ]:
+        ids[title] = client.post(
+            "/expenses",
+            json={"title": title, "amount": 5, "category": category, "date": "2025-09-01"},
+        ).json()["id"]
+
+    exact = client.get("/expenses/search?q=coffee").json()
+    assert {e["title"] for e in exact} == {"Coffee beans", "Coffee with Sam"}
+    assert client.get("/expenses/search?q=cofee").json()[0]["title"].startswith("Coffee")
+    assert [e["title"] for e in client.get("/expenses/search?q=transp").json()] == ["Bus pass"]
+
+    first = client.get("/expenses/search?q=food&limit=2")
+    assert len(first.json()) == 2
+    second = client.get(f"/expenses/search?q=food&limit=2&cursor={first.headers['X-Next-Cursor']}")
+    assert len(second.json()) == 1
+
+    client.delete(f"/expenses/{ids['Coffee beans']}")
+    client.put(
+        f"/expenses/{ids['Lunch']}",
+        json={"title": "Coffee and cake", "amount": 5, "category": "Food", "date": "2025-09-01"},
+    )
+    titles = {e["title"] for e in client.get("/expenses/search?q=coffee").json()}
+    assert titles == {"Coffee with Sam", "Coffee and cake"}
+
+
+def test_amounts_are_exact_and_ledger_tracks_running_totals(client, db):
+    client.post(
+        "/auth/register",
+        json={"username": "ledgeruser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "ledgeruser", "password": "Test@1234"},
+    )
+
+    created = [
+        client.post(
+            "/expenses",
+            json={"title": "Snack", "amount": amount, "category": "Food", "date": day},
+        ).json()
+        for amount, day in [(0.1, "2025-10-05"), (0.2, "2025-10-01"), (19.99, "2025-10-03")]
+    ]
+    assert client.post(
+        "/expenses",
+        json={"title": "Bad", "amount": 1.005, "category": "Food", "date": "2025-10-01"},
+    ).status_code == 422
+    assert client.get("/expenses/summary/monthly?month=10&year=2025").json()["total"] == 20.29
+
+    # a backdated edit and a delete shift every later running total
+    client.put(
+        f"/expenses/{created[0]['id']}",
+        json={"title": "Snack", "amount": 5, "category": "Food", "date": "2025-09-30"},
+    )
+    client.delete(f"/expenses/{created[2]['id']}")
+
+    spent = client.get("/expenses/summary/spent?to=2025-10-02").json()
+    assert spent == {"from": None, "to": "2025-10-02", "total": 5.2, "count": 2}
+    spent = client.get("/expenses/summary/spent?from=2025-10-01&to=2025-10-31").json()
+    assert (spent["total"], spent["count"]) == (0.2, 1)
+    assert client.get("/expenses/summary/spent?from=2025-11-01&to=2025-10-01").status_code == 400
+
+    assert client.get("/expenses?min_amount=0.1&max_amount=100").status_code == 200
+    for bad in ("nan", "inf", "-inf", "1e300"):
+        assert client.get(f"/expenses?min_amount={bad}").status_code == 422
+        assert client.get(f"/expenses?max_amount={bad}").status_code == 422
+
+    user_id = client.get("/auth/me").json()["id"]
+    row = models.ExpenseLedger
+
+    def ledger_rows():
+        return (
+            db.query(row.date, row.day_cents, row.running_cents)
+            .filter(row.user_id == user_id)
+            .order_by(row.date)
+            .all()
+        )
+
+    maintained = ledger_rows()
+    assert [cents for _, _, cents in maintained] == [500, 520]
+    ledger.rebuild(db, user_id)
+    assert ledger_rows() == maintained
+    db.rollback()
+
+
+def test_budget_alerts_fire_once_per_threshold_and_are_delivered(client, db, monkeypatch):
+    from datetime import date
+
+    import alert_worker
+    from app import app
+    from dependencies import request_date
+
+    monkeypatch.setitem(app.dependency_overrides, request_date, lambda: date(2025, 8, 20))
+    client.post(
+        "/auth/register",
+        json={"username": "budgetuser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "budgetuser", "password": "Test@1234"},
+    )
+    assert client.put("/budgets/Food", json={"limit": 100}).json()["spent"] == 0
+
+    def spend(amount, day="2025-08-10"):
+        return client.post(
+            "/expenses",
+            json={"title": "Groceries", "amount": amount, "category": "Food", "date": day},
+        ).json()
+
+    spend(50)
+    assert client.get("/budgets/alerts").json() == []
+    second = spend(40)
+    spend(30, day="2025-09-01")  # another month
+    client.put(
+        f"/expenses/{second['id']}",
+        json={"title": "Groceries", "amount": 60, "category": "Food", "date": "2025-08-10"},
+    )
+    spend(5)  # already past both thresholds
+
+    alerts = client.get("/budgets/alerts").json()
+    assert [(a["month"], a["threshold"], a["spent"]) for a in alerts] == [
+        ("2025-08", 100, 110),
+        ("2025-08", 80, 90),
+    ]
+    assert client.get("/budgets?month=2025-08").json() == [
+        {"category": "Food", "limit": 100, "spent": 115, "percent": 115.0}
+    ]
+    # without a month, the request's date picks it
+    assert client.get("/budgets").json() == client.get("/budgets?month=2025-08").json()
+
+    sent = []
+    assert alert_worker.deliver_pending(db, notify=sent.append) >= 2
+    assert {(p["category"], p["threshold"]) for p in sent} >= {("Food", 80), ("Food", 100)}
+    assert alert_worker.deliver_pending(db, notify=sent.append) == 0
+    assert all(a["delivered"] for a in client.get("/budgets/alerts").json())
+
+
+def test_insights_report_trends_and_outliers_and_follow_writes(client):
+    client.post(
+        "/auth/register",
+        json={"username": "insightsuser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "insightsuser", "password": "Test@1234"},
+    )
+    for day in range(1, 7):
+        client.post(
+            "/expenses",
+            json={"title": "Lunch", "amount": 10, "category": "Food", "date": f"2025-06-0{day}"},
+        )
+    big = client.post(
+        "/expenses",
+        json={"title": "Banquet", "amount": 500, "category": "Food", "date": "2025-07-01"},
+    ).json()["id"]
+
+    data = client.get("/expenses/insights?months=120&z=2").json()
+    assert data["expenses"] == 7
+    assert data["total"] == 560
+    months = {m["month"]: m for m in data["months"]}
+    assert months["2025-06"]["total"] == 60
+    assert months["2025-07"]["total"] == 500
+    assert months["2025-07"]["growth_pct"] == 733.33
+    assert [o["id"] for o in data["outliers"]] == [big]
+    assert data["outliers"][0]["title"] == "Banquet"
+    assert set(data["forecast"]) >= {"next_month", "current_month_projection"}
+    assert [s["category"] for s in data["seasonality"]] == ["Food"]
+
+    client.delete(f"/expenses/{big}")
+    data = client.get("/expenses/insights?months=120&z=2").json()
+    assert data["expenses"] == 6
+    assert data["outliers"] == []
+    assert "2025-07" not in {m["month"] for m in data["months"] if m["total"]}
+
+    # no writes, but a new day: a fresh ETag and a recomputed forecast
+    from datetime import date
+
+    from app import app
+    from dependencies import request_date
+
+    try:
+        app.dependency_overrides[request_date] = lambda: date(2025, 6, 3)
+        res = client.get("/expenses/insights")
+        etag = res.headers["etag"]
+        assert res.json()["forecast"]["current_month_to_date"] == 60
+        assert client.get("/expenses/insights", headers={"If-None-Match": etag}).status_code == 304
+
+        app.dependency_overrides[request_date] = lambda: date(2025, 7, 3)
+        res = client.get("/expenses/insights", headers={"If-None-Match": etag})
+        assert res.status_code == 200
+        assert res.headers["etag"] != etag
+        assert res.json()["forecast"]["current_month_to_date"] == 0
+    finally:
+        app.dependency_overrides.pop(request_date, None)
+
+
+def _wait_for_job(client, job_id, timeout=10):
+    import time
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish: {job}")
+
+
+def test_background_jobs_run_exports_imports_and_retries(client, db, monkeypatch):
+    from sqlalchemy.orm import sessionmaker
+
+    import jobs
+
+    broker = jobs.LocalBroker("thread", session_factory=sessionmaker(bind=db.get_bind()))
+    monkeypatch.setattr(jobs, "broker", broker)
+    client.post(
+        "/auth/register",
+        json={"username": "jobsuser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "jobsuser", "password": "Test@1234"},
+    )
+
+    try:
+        res = client.post(
+            "/expenses/bulk?background=true",
+            content='{"title": "Tea", "amount": 2.5, "category": "Food", "date": "2025-03-01"}\n'
+                    '{"title": "Bus", "amount": 1.75, "category": "Transport", "date": "2025-03-02"}\n',
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+        assert res.status_code == 202
+        assert res.headers["Location"] == f"/jobs/{res.json()['id']}"
+        job = _wait_for_job(client, res.json()["id"])
+        assert job["status"] == "succeeded" and job["progress"] == 1.0
+        assert client.get(job["result_url"]).json()["inserted"] == 2
+
+        res = client.post("/expenses/export?format=csv")
+        assert res.status_code == 202
+        job = _wait_for_job(client, res.json()["id"])
+        download = client.get(job["result_url"])
+        assert download.headers["content-type"].startswith("text/csv")
+        assert download.text.splitlines()[1:] == ["Tea,2.5,Food,2025-03-01", "Bus,1.75,Transport,2025-03-02"]
+
+        # a failing attempt is retried after a backoff
+        calls = []
+
+        def flaky(db, ctx, user_id):
+            calls.append(user_id)
+            if len(calls) == 1:
+                raise RuntimeError("transient")
+            return {"calls": len(calls)}
+
+        monkeypatch.setitem(jobs.TASKS, "flaky", jobs.Task(flaky, 2, 60))
+        monkeypatch.setattr(jobs, "RETRY_BASE_SECONDS", 0.01)
+        user_id = client.get("/auth/me").json()["id"]
+        job = _wait_for_job(client, jobs.enqueue(db, user_id, "flaky")["id"])
+        assert job["status"] == "succeeded" and job["attempts"] == 2
+        assert client.get(job["result_url"]).json() == {"calls": 2}
+
+        # a rebuild takes the user row lock before it rewrites the rollups,
+        # like every expense writer, so the two are serialized
+        import httpcache
+        import summaries
+
+        order = []
+        bump, rebuild = httpcache.bump_data_version, summaries.rebuild
+        monkeypatch.setattr(httpcache, "bump_data_version", lambda *a: order.append("lock") or bump(*a))
+        monkeypatch.setattr(summaries, "rebuild", lambda *a: order.append("rebuild") or rebuild(*a))
+        job = _wait_for_job(client, jobs.enqueue(db, user_id, "rebuild_summaries")["id"])
+        assert job["status"] == "succeeded" and order == ["lock", "rebuild"]
+        assert client.get("/expenses/summary/monthly?month=3&year=2025").json()["total"] == 4.25
+
+        assert client.get("/jobs/unknown").status_code == 404
+    finally:
+        broker.shutdown()
+
+
+def test_local_broker_recovers_jobs_left_by_a_restart(client, db, monkeypatch):
+    import uuid
+    from datetime import datetime, timedelta
+
+    from sqlalchemy.orm import sessionmaker
+
+    import jobs
+    import models
+
+    client.post(
+        "/auth/register",
+        json={"username": "restartuser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "restartuser", "password": "Test@1234"},
+    )
+    user_id = client.get("/auth/me").json()["id"]
+
+    # the API went away: a queued job nobody runs and two whose worker died
+    monkeypatch.setattr(jobs, "broker", jobs.DatabaseBroker())
+    queued = client.post("/expenses/summary/rebuild").json()["id"]
+    started = datetime.utcnow() - timedelta(seconds=jobs.JOB_TIMEOUT_SECONDS + jobs.REAP_GRACE_SECONDS + 60)
+    stale = {}
+    for name, attempts in (("retried", 1), ("exhausted", 3)):
+        stale[name] = uuid.uuid4().hex
+        db.add(models.Job(
+            id=stale[name], user_id=user_id, kind="rebuild_summaries", params={},
+            status="running", attempts=attempts, max_attempts=3,
+            timeout_seconds=jobs.JOB_TIMEOUT_SECONDS, started_at=started,
+        ))
+    db.commit()
+
+    broker = jobs.LocalBroker("thread", session_factory=sessionmaker(bind=db.get_bind()))
+    monkeypatch.setattr(jobs, "broker", broker)
+    try:
+        assert broker.recover() == 2
+        assert _wait_for_job(client, queued)["status"] == "succeeded"
+        assert _wait_for_job(client, stale["retried"])["status"] == "succeeded"
+        exhausted = _wait_for_job(client, stale["exhausted"])
+        assert (exhausted["status"], exhausted["error"]) == ("failed", "Worker lost")
+        assert broker.recover() == 0
+    finally:
+        broker.shutdown()
+
+
+def test_archived_months_stay_in_summaries_and_exports(client, db, monkeypatch, tmp_path):
+    from datetime import date
+
+    import archive
+    import summaries
+
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path))
+    client.post(
+        "/auth/register",
+        json={"username": "archiveuser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "archiveuser", "password": "Test@1234"},
+    )
+    for title, amount, day in [("Old rent", 700, "2001-05-01"), ("Old lunch", 12.5, "2001-05-20"), ("New lunch", 8, "2001-06-02")]:
+        client.post(
+            "/expenses",
+            json={"title": title, "amount": amount, "category": "Food", "date": day},
+        )
+    deleted = client.post(
+        "/expenses",
+        json={"title": "Mistake", "amount": 1, "category": "Food", "date": "2001-05-03"},
+    ).json()["id"]
+    client.delete(f"/expenses/{deleted}")
+
+    before = client.get("/expenses")
+    etag = before.headers["etag"]
+    assert len(before.json()) == 3
+
+    result = archive.archive_month(db, date(2001, 5, 1))
+    assert result["rows"] == 2
+    assert client.get("/expenses", headers={"If-None-Match": etag}).status_code == 200
+    res = client.get("/expenses")
+    assert res.headers["etag"] != etag
+    assert [e["title"] for e in res.json()] == ["New lunch"]
+
+    def check_totals():
+        data = client.get("/expenses/summary/range?start=2001-05&end=2001-06&granularity=month").json()
+        assert [(p["total"], p["count"]) for p in data["periods"]] == [(712.5, 2), (8, 1)]
+        assert client.get("/expenses/summary/spent?from=2001-05-01&to=2001-05-31").json()["total"] == 712.5
+
+    check_totals()
+    user_id = client.get("/auth/me").json()["id"]
+    summaries.rebuild(db, user_id)
+    ledger.rebuild(db, user_id)
+    db.commit()
+    check_totals()
+
+    csv_lines = client.get("/expenses/export?format=csv").text.splitlines()
+    assert csv_lines[1:] == ["Old rent,700.0,Food,2001-05-01", "Old lunch,12.5,Food,2001-05-20", "New lunch,8.0,Food,2001-06-02"]
+    assert client.get("/expenses/insights?months=1").json()["total"] == 720.5
+
+    assert archive.restore(db, result["id"]) == 2
+    assert len(client.get("/expenses").json()) == 3
+    check_totals()
+
+
+def test_identical_concurrent_gets_share_one_response(client, monkeypatch):
+    import asyncio
+    import time
+
+    import httpx
+
+    import analytics
+    import singleflight
+    from app import app
+
+    client.post(
+        "/auth/register",
+        json={"username": "coalesceuser", "password": "Test@1234"},
+    )
+    client.post(
+        "/auth/login",
+        json={"username": "coalesceuser", "password": "Test@1234"},
+    )
+    client.post(
+        "/expenses",
+        json={"title": "Lunch", "amount": 10, "category": "Food", "date": "2025-06-01"},
+    )
+
+    calls = []
+    insights = analytics.insights
+
+    def slow_insights(*args, **kwargs):
+        calls.append(1)
+        time.sleep(0.2)
+        return insights(*args, **kwargs)
+
+    monkeypatch.setattr(analytics, "insights", slow_insights)
+    singleflight.clear()
+
+    async def burst(requests):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as ac:
+            return await asyncio.gather(*(
+                ac.get(path, headers={"Cookie": f"access_token={token}", **headers})
+                for path, token, headers in requests
+            ))
+
+    token = client.cookies.get("access_token")
+    responses = asyncio.run(burst([("/expenses/insights", token, {})] * 4))
+    assert [res.status_code for res in responses] == [200] * 4
+    assert len({res.content for res in responses}) == 1
+    assert len(calls) == 1
+    assert singleflight.coalesced == 3
+
+    # a different query is a different request
+    calls.clear()
+    asyncio.run(burst([("/expenses/insights?months=6", token, {}), ("/expenses/insights?months=3", token, {})]))
+    assert len(calls) == 2
+
+    # partial downloads are never shared
+    calls.clear()
+    asyncio.run(burst([("/expenses/insights?months=2", token, {"Range": f"bytes={start}-{start + 9}"}) for start in (0, 100)]))
+    assert len(calls) == 2
+
+    # a GET sent after the client's own write does not join one from before it
+    async def read_after_write(path):
+        transport = httpx.ASGITransport(app=app)
+        cookies = {"Cookie": f"access_token={token}"}
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as ac:
+            before = asyncio.create_task(ac.get(path, headers=cookies))
+            await asyncio.sleep(0.05)
+            await ac.post(
+                "/expenses",
+                json={"title": "Dinner", "amount": 20, "category": "Food", "date": "2025-06-02"},
+                headers=cookies,
+            )
+            return await asyncio.gather(before, ac.get(path, headers=cookies))
+
+    calls.clear()
+    before, after = asyncio.run(read_after_write("/expenses/insights?months=4"))
+    assert len(calls) == 2
+    assert before.status_code == 200 and after.json()["expenses"] == 2
+
+    # a revoked token does not get the response of a current one
+    client.post("/auth/logout?everywhere=true")
+    client.post(
+        "/auth/login",
+        json={"username": "coalesceuser", "password": "Test@1234"},
+    )
+    calls.clear()
+    current = client.cookies.get("access_token")
+    assert current != token
+    responses = asyncio.run(burst([("/expenses/insights?months=9", current, {}), ("/expenses/insights?months=9", token, {})]))
+    assert [res.status_code for res in responses] == [200, 401]
+    assert len(calls) == 1
@@ -5,4 +5,37 @@ const api = axios.create({
   withCredentials: true, // 🔴 REQUIRED for cookies
 });
 
-export default api;
\ No newline at end of file
+// Access tokens are short lived: on a 401, trade the refresh cookie for a
+// new one and retry once. Concurrent 401s share a single refresh call.
+let refreshing = null;
+const NO_REFRESH = ["/auth/login", "/auth/register", "/auth/refresh", "/auth/logout"];
+
+api.interceptors.response.use(
+  (response) => response,
+  async (error) => {
+    const { config, response } = error;
+    if (
+      response?.status !== 401 ||
+      !config ||
+      config._retried ||
+      NO_REFRESH.includes(config.url)
+    ) {
+      throw error;
+    }
+
+    refreshing = refreshing || api.post("/auth/refresh").finally(() => {
+      refreshing = null;
+    });
+    try {
+      await refreshing;
+    } catch (refreshError) {
+      // 409: another tab refreshed first and its cookies are already set
+      if (refreshError.response?.status !== 409) {
+        throw error;
+      }
+    }
+    return api({ ...config, _retried: true });
+  }
+);
+
+export default api;
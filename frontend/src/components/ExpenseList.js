@@ -1,6 +1,5 @@
 import { useEffect, useState } from "react";
 import AddExpense from "./AddExpense";
-import * as XLSX from "xlsx";
 import { saveAs } from "file-saver";
 import api from "../api";
 import {
@@ -20,12 +19,14 @@ import {
   Stack,
   Box,
   Chip,
+  Alert,
 } from "@mui/material";
 
 function ExpenseList() {
   const [expenses, setExpenses] = useState([]);
   const [selectedExpense, setSelectedExpense] = useState(null);
   const [filter, setFilter] = useState("");
+  const [error, setError] = useState("");
 
   const getCategoryColor = (category) => {
     const colors = {
@@ -63,80 +64,12 @@ function ExpenseList() {
   //     saveAs(new Blob([csv]), "expenses.csv");
   //   };
   const exportExcel = () => {
-    // ======================
-    // 1. Expense data
-    // ======================
-    const expenseData = expenses.map((e) => ({
-      Title: e.title,
-      Amount: e.amount,
-      Category: e.category,
-      Date: e.date,
-    }));
-
-    // ======================
-    // 2. Total expense
-    // ======================
-    const totalExpense = expenses.reduce((sum, e) => sum + Number(e.amount), 0);
-
-    // ======================
-    // 3. Category summary
-    // ======================
-    const categoryTotals = {};
-    expenses.forEach((e) => {
-      categoryTotals[e.category] =
-        (categoryTotals[e.category] || 0) + Number(e.amount);
-    });
-
-    const summaryData = Object.keys(categoryTotals).map((cat) => ({
-      Category: cat,
-      "Total Amount": categoryTotals[cat],
-    }));
-
-    // ======================
-    // 4. Workbook
-    // ======================
-    const workbook = XLSX.utils.book_new();
-
-    // -------- Expenses Sheet --------
-    const expenseSheet = XLSX.utils.json_to_sheet(expenseData);
-
-    XLSX.utils.sheet_add_aoa(expenseSheet, [["EXPENSE TRACKER REPORT"]], {
-      origin: "A1",
-    });
-
-    expenseSheet["!cols"] = [
-      { wch: 25 },
-      { wch: 15 },
-      { wch: 18 },
-      { wch: 15 },
-    ];
-
-    XLSX.utils.book_append_sheet(workbook, expenseSheet, "Expenses");
-
-    // -------- Summary Sheet --------
-    const summarySheet = XLSX.utils.json_to_sheet(summaryData);
-
-    XLSX.utils.sheet_add_aoa(summarySheet, [["SUMMARY"]], { origin: "A1" });
-
-    XLSX.utils.sheet_add_aoa(summarySheet, [["Total Expense", totalExpense]], {
-      origin: "A3",
-    });
-
-    summarySheet["!cols"] = [{ wch: 20 }, { wch: 18 }];
-
-    XLSX.utils.book_append_sheet(workbook, summarySheet, "Summary");
-
-    // ======================
-    // 5. Export file
-    // ======================
-    const excelBuffer = XLSX.write(workbook, {
-      bookType: "xlsx",
-      type: "array",
-    });
-
-    const blob = new Blob([excelBuffer], { type: "application/octet-stream" });
-
-    saveAs(blob, "Expense_Report.xlsx");
+    // The report (Expenses + Summary sheets) is built and streamed by the API
+    setError("");
+    api
+      .get("/expenses/export?format=xlsx", { responseType: "blob" })
+      .then((res) => saveAs(res.data, "Expense_Report.xlsx"))
+      .catch(() => setError("Failed to export report"));
   };
 
   return (
@@ -169,6 +102,8 @@ function ExpenseList() {
             </Button>
           </Box>
 
+          {error && <Alert severity="error" sx={{ mb: 2 }}>{error}</Alert>}
+
           <Box sx={{ mb: 3, p: 2, background: "#f5f5f5", borderRadius: 1 }}>
             <Stack direction={{ xs: "column", md: "row" }} spacing={2} sx={{ alignItems: "center" }}>
               <Box>
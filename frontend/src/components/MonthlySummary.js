@@ -27,23 +27,24 @@ function MonthlySummary() {
     setLoading(true);
     setError("");
     try {
-      const [summaryRes, categoryRes] = await Promise.all([
-        api.get(`/expenses/summary/monthly?month=${month}&year=${year}`),
-        api.get(`/expenses/summary/category?month=${month}&year=${year}`)
-      ]);
-      setTotal(summaryRes.data.total);
-      setCategories(categoryRes.data);
+      // One request covers the selected month and, if requested, the one before it
+      const pad = (m) => String(m).padStart(2, "0");
+      const end = `${year}-${pad(month)}`;
+      const prevMonth = month === 1 ? 12 : month - 1;
+      const prevYear = month === 1 ? year - 1 : year;
+      const start = fetchPrevious ? `${prevYear}-${pad(prevMonth)}` : end;
+
+      const res = await api.get(
+        `/expenses/summary/range?start=${start}&end=${end}&granularity=month`
+      );
+      const periods = res.data.periods;
+      const current = periods[periods.length - 1];
+      setTotal(current.total);
+      setCategories(current.categories);
 
-      // Fetch previous month data if requested
       if (fetchPrevious) {
-        const prevMonth = month === 1 ? 12 : month - 1;
-        const prevYear = month === 1 ? year - 1 : year;
-        const [prevSummaryRes, prevCategoryRes] = await Promise.all([
-          api.get(`/expenses/summary/monthly?month=${prevMonth}&year=${prevYear}`),
-          api.get(`/expenses/summary/category?month=${prevMonth}&year=${prevYear}`)
-        ]);
-        setPrevTotal(prevSummaryRes.data.total);
-        setPrevCategories(prevCategoryRes.data);
+        setPrevTotal(periods[0].total);
+        setPrevCategories(periods[0].categories);
       }
     } catch (err) {
       setError("Failed to fetch summary");